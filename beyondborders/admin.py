@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Destination, Booking, Review, Wishlist, BlogPost
+from .models import Destination, Booking, Review, Wishlist, BlogPost, ExchangeRate, DepartureInventory
 
 # Register your models here.
 
@@ -41,3 +41,19 @@ class BlogPostAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at', 'updated_at')
     prepopulated_fields = {'slug': ('title',)}
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'rate', 'updated_at')
+    search_fields = ('currency',)
+    readonly_fields = ('updated_at',)
+
+@admin.register(DepartureInventory)
+class DepartureInventoryAdmin(admin.ModelAdmin):
+    list_display = ('destination', 'travel_date', 'capacity', 'reserved', 'available')
+    list_filter = ('travel_date',)
+    search_fields = ('destination__name',)
+    date_hierarchy = 'travel_date'
+    # Maintained by the Booking signals (beyondborders.inventory)
+    readonly_fields = ('reserved',)
+    raw_id_fields = ('destination',)
@@ -0,0 +1,263 @@
+"""
+Static asset bundles.
+
+``ASSET_BUNDLES`` maps bundle names to the static files they concatenate,
+in order. ``collectstatic`` (through BundlingStaticFilesStorage, the
+``staticfiles`` storage) builds every bundle into ``bundles/`` under
+STATIC_ROOT, minifying members that are not minified already; the
+bundles then go through ManifestStaticFilesStorage like any other file,
+so they get content-hashed names, relative ``url()``s in CSS point at
+hashed files, and ``staticfiles.json`` records the names. Finally every
+hashed text file gets ``.gz`` (and, with the ``brotli`` package, ``.br``)
+siblings that a server can send to clients accepting them.
+
+Hashed names change whenever the content does, so they can be cached for
+a year. The ``{% bundle %}`` tag (asset_tags) looks them up in the
+manifest the storage keeps in memory; with DEBUG on, or before
+collectstatic has written a manifest (e.g. under the test runner), it
+links the member files instead, and ``{% static %}`` unhashed names.
+"""
+import gzip
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage, staticfiles_storage
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUNDLE_DIR = 'bundles'
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.xml', '.html', '.map', '.eot', '.ttf', '.otf')
+# Below this, compression saves less than the extra file costs
+MIN_COMPRESS_SIZE = 512
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_CSS_IMPORT = re.compile(r'''@import\s+(?:url\([^)]*\)|['"][^'"]*['"])[^;]*;''')
+_CSS_IMPORT_STRING = re.compile(r'''(@import\s*(['"]))([^'"]+)\2''')
+_CSS_CHARSET = re.compile(r'@charset\s+[^;]+;')
+# Strings and comments, which minify_css must not look into
+_CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|/\*.*?\*/)''', re.DOTALL)
+_SOURCE_MAP = re.compile(r'^\s*(?://|/\*)[#@]\s*sourceMappingURL=.*$', re.MULTILINE)
+# A "/" after one of these starts a regular expression, not a division
+_JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'yield'}
+
+
+def bundles():
+    return getattr(settings, 'ASSET_BUNDLES', {})
+
+
+def bundle_path(name):
+    return posixpath.join(BUNDLE_DIR, name)
+
+
+def is_minified(path):
+    return re.search(r'[.-]min\.(css|js)$', path) is not None
+
+
+def minify_css(text):
+    """Drop comments (but /*! license */ ones) and redundant whitespace; strings are kept as they are"""
+    parts = _CSS_TOKENS.split(text)
+    for i, part in enumerate(parts):
+        if i % 2:
+            if part.startswith('/*') and not part.startswith('/*!'):
+                parts[i] = ''
+            continue
+        code = re.sub(r'\s+', ' ', part)
+        code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+        parts[i] = re.sub(r':\s+', ':', code)
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """
+    Drop comments (but /*! license */ ones), indentation and blank lines.
+    Line breaks between statements are kept, so automatic semicolon
+    insertion is unaffected.
+    """
+    out, i, length = [], 0, len(text)
+    last = ''  # last significant character written
+
+    def regex_allowed():
+        if not last or last in _JS_REGEX_PRECEDERS or last == '\n':
+            return True
+        word = re.search(r'([A-Za-z_$]+)\s*$', ''.join(out[-12:]))
+        return word is not None and word.group(1) in _JS_REGEX_KEYWORDS
+
+    while i < length:
+        char = text[i]
+        if char in '\'"`':
+            end = i + 1
+            while end < length and text[end] != char:
+                end += 2 if text[end] == '\\' else 1
+            out.append(text[i:end + 1])
+            last, i = char, end + 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = length if end == -1 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            if text.startswith('/*!', i):
+                out.append(text[i:end])
+            # A comment that spanned lines still separates statements
+            if '\n' in text[i:end] and last and last != '\n':
+                out.append('\n')
+                last = '\n'
+            i = end
+        elif char == '/' and regex_allowed():
+            end, in_class = i + 1, False
+            while end < length and (text[end] != '/' or in_class) and text[end] != '\n':
+                if text[end] == '\\':
+                    end += 1
+                elif text[end] == '[':
+                    in_class = True
+                elif text[end] == ']':
+                    in_class = False
+                end += 1
+            out.append(text[i:end + 1])
+            last, i = '/', end + 1
+        elif char.isspace():
+            end = i
+            while end < length and text[end].isspace():
+                end += 1
+            newline = '\n' in text[i:end]
+            following = text[end] if end < length else ''
+            if newline and last and last != '\n':
+                out.append('\n')
+                last = '\n'
+            elif not newline and last and last != '\n' and following:
+                # Keep a space only where dropping it would merge two tokens
+                if (_is_word(last) and _is_word(following)) or (last == following and last in '+-'):
+                    out.append(' ')
+            i = end
+        else:
+            out.append(char)
+            last, i = char, i + 1
+    return ''.join(out).strip()
+
+
+def _is_word(char):
+    return char.isalnum() or char in '_$\\' or ord(char) > 127
+
+
+def _rebase_css_urls(text, member):
+    """Rewrite relative url()s and @import strings in ``member`` so they resolve from BUNDLE_DIR"""
+    directory = posixpath.dirname(member)
+
+    def rebase(url):
+        if re.match(r'^([a-z]+:|/|#)', url, re.IGNORECASE):
+            return url
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        target = posixpath.normpath(posixpath.join(directory, path))
+        return posixpath.relpath(target, BUNDLE_DIR) + suffix
+
+    text = _CSS_URL.sub(lambda match: f'url({match.group(1)}{rebase(match.group(2))}{match.group(1)})', text)
+    return _CSS_IMPORT_STRING.sub(lambda match: f'{match.group(1)}{rebase(match.group(3))}{match.group(2)}', text)
+
+
+def build_bundle(name, sources):
+    """
+    Concatenate ``sources``, a list of (static path, text), into the
+    content of bundle ``name``.
+    """
+    is_css = name.endswith('.css')
+    imports, parts = [], []
+    for path, text in sources:
+        text = _SOURCE_MAP.sub('', text)
+        if is_css:
+            text = _rebase_css_urls(_CSS_CHARSET.sub('', text), path)
+            # @import is only valid before every other rule
+            imports.extend(_CSS_IMPORT.findall(text))
+            text = _CSS_IMPORT.sub('', text)
+            parts.append(text if is_minified(path) else minify_css(text))
+        else:
+            parts.append(text if is_minified(path) else minify_js(text))
+    if is_css:
+        return '\n'.join(imports + parts) + '\n'
+    # A member may end without a semicolon, or in a comment
+    return '\n;'.join(part.strip() for part in parts) + '\n'
+
+
+def compress(storage, name):
+    """Write precompressed siblings of stored file ``name``; returns their names"""
+    with storage.open(name) as handle:
+        data = handle.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    written = []
+    for suffix, content in variants:
+        if len(content) < len(data) * 0.9 and not storage.exists(name + suffix):
+            storage._save(name + suffix, ContentFile(content))
+            written.append(name + suffix)
+    return written
+
+
+class BundlingStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also builds ASSET_BUNDLES and precompresses hashed files"""
+
+    # The vendored libraries point at source maps that are not shipped, so
+    # only url() and @import references are rewritten
+    patterns = (
+        ('*.css', (
+            r"""(?P<matched>url\(['"]{0,1}\s*(?P<url>.*?)["']{0,1}\))""",
+            (r"""(?P<matched>@import\s*["']\s*(?P<url>.*?)["'])""", '@import url("%(url)s")'),
+        )),
+    )
+
+    def load_manifest(self):
+        hashed_files, manifest_hash = super().load_manifest()
+        # Until collectstatic writes a manifest (a fresh checkout, the test
+        # runner) files are linked by their unhashed names instead of raising
+        self.collected = bool(hashed_files)
+        return hashed_files, manifest_hash
+
+    def url(self, name, force=False):
+        if not self.collected:
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+        paths = dict(paths)
+        for name, members in bundles().items():
+            sources = []
+            for member in members:
+                if member not in paths:
+                    raise ImproperlyConfigured(f'ASSET_BUNDLES[{name!r}] refers to unknown static file {member!r}')
+                storage, path = paths[member]
+                with storage.open(path) as handle:
+                    sources.append((member, handle.read().decode('utf-8')))
+            path = bundle_path(name)
+            if self.exists(path):
+                self.delete(path)
+            self._save(path, ContentFile(build_bundle(name, sources).encode('utf-8')))
+            paths[path] = (self, path)
+
+        yield from super().post_process(paths, dry_run, **options)
+
+        for hashed_name in sorted(set(self.hashed_files.values())):
+            if hashed_name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        return compress(self, name)
+
+
+def bundle_urls(name):
+    """URLs to link for bundle ``name``: the bundle, or its members with DEBUG on or before collectstatic"""
+    if name not in bundles():
+        raise ValueError(f'Unknown asset bundle {name!r}; add it to ASSET_BUNDLES')
+    if settings.DEBUG or not getattr(staticfiles_storage, 'collected', False):
+        return [staticfiles_storage.url(member) for member in bundles()[name]]
+    return [staticfiles_storage.url(bundle_path(name))]
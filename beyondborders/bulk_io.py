@@ -0,0 +1,285 @@
+"""
+Streaming CSV / JSONL import of destinations and export of bookings and reviews.
+
+Imports read the file row by row and write in batches: each batch looks up
+the destinations it already has by natural key (name + location) in one
+query, then updates those with ``bulk_update`` and inserts the rest with
+``bulk_create``. Rows that fail validation are reported with their line
+number and skipped; they never abort the import. Like the travello copy,
+the search documents and caches are refreshed once at the end because
+bulk writes skip the Destination signals. Images are copied in only for
+rows that are written, and queued for renditions with them.
+
+Exports stream rows from an ``.iterator()`` straight to the output, so
+memory stays constant however many rows there are.
+"""
+import csv
+import json
+import os
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import cache, rendition_queue
+from .data_migration import refresh_derived_data
+from .models import Booking, Destination, Review
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 500
+
+IMPORT_FIELDS = ('name', 'desc', 'price', 'offer', 'location', 'latitude', 'longitude', 'currency', 'img')
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', 'off', ''}
+
+EXPORTS = {
+    'bookings': (Booking, (
+        ('id', 'id'), ('user', 'user__username'), ('destination_id', 'destination_id'),
+        ('destination', 'destination__name'), ('travel_date', 'travel_date'),
+        ('number_of_travelers', 'number_of_travelers'), ('status', 'status'), ('created_at', 'created_at'),
+    )),
+    'reviews': (Review, (
+        ('id', 'id'), ('user', 'user__username'), ('destination_id', 'destination_id'),
+        ('destination', 'destination__name'), ('rating', 'rating'), ('comment', 'comment'),
+        ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    )),
+}
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return 'jsonl' if extension in ('jsonl', 'ndjson') else 'csv'
+
+
+def read_rows(stream, file_format):
+    """Yield (line number, dict) for each record of an open text stream"""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield line_number, error
+            continue
+        yield line_number, row if isinstance(row, dict) else ValueError('expected a JSON object')
+
+
+class RowError:
+    def __init__(self, line, errors):
+        self.line = line
+        self.errors = errors
+
+    def __str__(self):
+        return f'line {self.line}: ' + '; '.join(
+            f'{field}: {" ".join(messages)}' if field != '__all__' else ' '.join(messages)
+            for field, messages in self.errors.items()
+        )
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.invalid = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return (self.created + self.updated) / self.seconds if self.seconds else 0.0
+
+
+def natural_key(name, location):
+    return (name, location or '')
+
+
+class DestinationImporter:
+    """
+    Upsert destinations from rows of IMPORT_FIELDS columns.
+
+    Only the columns a row contains are written, so a file with just
+    ``name,location,price`` updates prices of existing destinations. With
+    ``images_dir``, the ``img`` column names a file in that directory that
+    is copied into media storage; otherwise it is an existing storage name.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, images_dir=None, on_error=None):
+        self.batch_size = batch_size
+        self.images_dir = images_dir
+        self.on_error = on_error
+        self.result = ImportResult()
+
+    def run(self, rows):
+        started = time.monotonic()
+        batch = []
+        for line, row in rows:
+            parsed = self._parse(line, row)
+            if parsed is not None:
+                batch.append(parsed)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+        if self.result.created or self.result.updated:
+            refresh_derived_data()
+        self.result.seconds = time.monotonic() - started
+        return self.result
+
+    def _error(self, line, errors):
+        self.result.invalid += 1
+        if self.on_error:
+            self.on_error(RowError(line, errors))
+
+    def _parse(self, line, row):
+        """Return (line, values) for a valid row, reporting and dropping invalid ones"""
+        if isinstance(row, Exception):
+            self._error(line, {'__all__': [str(row)]})
+            return None
+        if None in row:
+            # csv.DictReader files surplus cells under None
+            self._error(line, {'__all__': ['more values than columns']})
+            return None
+        unknown = sorted(set(row) - set(IMPORT_FIELDS))
+        if unknown:
+            self._error(line, {'__all__': [f'unknown column{"s" if len(unknown) > 1 else ""} {", ".join(unknown)}']})
+            return None
+        values = {name: _text(row[name]) for name in IMPORT_FIELDS if name in row}
+        errors = {}
+        if not values.get('name'):
+            errors['name'] = ['This field is required.']
+        if 'offer' in values:
+            offer = (values['offer'] or '').lower()
+            if offer not in TRUE_VALUES | FALSE_VALUES:
+                errors['offer'] = [f'"{values["offer"]}" is not a boolean.']
+            values['offer'] = offer in TRUE_VALUES
+        for name in ('location', 'latitude', 'longitude'):
+            if name in values and values[name] == '':
+                values[name] = None
+        if values.get('currency'):
+            values['currency'] = values['currency'].upper()
+
+        instance = Destination(**{name: value for name, value in values.items() if name != 'img'})
+        exclude = [field.name for field in Destination._meta.concrete_fields if field.name not in values]
+        # A new destination needs every required field; an update only the ones it writes
+        try:
+            instance.clean_fields(exclude=exclude + ['img'])
+        except ValidationError as error:
+            errors.update(error.message_dict)
+        for name, bound in (('latitude', 90), ('longitude', 180)):
+            value = getattr(instance, name)
+            if name not in errors and value is not None and not -bound <= value <= bound:
+                errors[name] = [f'Must be between -{bound} and {bound}.']
+        if 'img' in values and not errors:
+            try:
+                self._check_image(values['img'])
+            except ValidationError as error:
+                errors['img'] = error.messages
+        if errors:
+            self._error(line, errors)
+            return None
+        for name in values:
+            if name != 'img':
+                values[name] = getattr(instance, name)
+        return line, values
+
+    def _check_image(self, value):
+        if not value:
+            raise ValidationError('This field is required.')
+        if self.images_dir and not os.path.isfile(os.path.join(self.images_dir, value)):
+            raise ValidationError(f'No such file in the images directory: {value}')
+
+    def _store_image(self, value):
+        """Storage name for an ``img`` value, copying the file in from ``images_dir``"""
+        if not self.images_dir:
+            return value
+        path = os.path.join(self.images_dir, value)
+        name = Destination._meta.get_field('img').generate_filename(None, os.path.basename(path))
+        # Re-importing the same file reuses the stored copy
+        if default_storage.exists(name) and default_storage.size(name) == os.path.getsize(path):
+            return name
+        with open(path, 'rb') as image:
+            return default_storage.save(name, File(image))
+
+    def _write(self, batch):
+        names = {values['name'] for _, values in batch}
+        existing = {}
+        for pk, name, location in Destination.objects.filter(name__in=names).order_by('-pk').values_list(
+            'pk', 'name', 'location'
+        ):
+            # Lowest pk wins if the table already holds duplicates
+            existing[natural_key(name, location)] = pk
+
+        creates, updates, seen = {}, {}, set()
+        required = [field.name for field in Destination._meta.concrete_fields
+                    if field.editable and not field.blank and not field.has_default() and not field.primary_key]
+        for line, values in batch:
+            key = natural_key(values['name'], values.get('location'))
+            pk = existing.get(key)
+            if pk is None:
+                missing = [name for name in required if values.get(name) in (None, '')]
+                if missing:
+                    self._error(line, {name: ['This field is required.'] for name in missing})
+                    continue
+                # A later row for the same key replaces an earlier one in the batch
+                creates[key] = values
+            else:
+                updates[key] = (pk, values)
+
+        # Only now that the rows are accepted, so a rejected row leaves no file behind
+        written = list(creates.values()) + [values for _, values in updates.values()]
+        for values in written:
+            if 'img' in values:
+                values['img'] = self._store_image(values['img'])
+
+        with transaction.atomic():
+            Destination.objects.bulk_create([Destination(**values) for values in creates.values()])
+            # Rows that carry the same columns go in one bulk_update
+            by_fields = {}
+            for pk, values in updates.values():
+                by_fields.setdefault(tuple(sorted(values)), []).append(Destination(pk=pk, **values))
+            for fields, objects in by_fields.items():
+                Destination.objects.bulk_update(objects, fields)
+            if updates:
+                cache.bump(*(f'destination:{pk}' for pk, _ in updates.values()))
+            # bulk_create and bulk_update skip the signal that queues new images
+            rendition_queue.enqueue(*(values['img'] for values in written if values.get('img')))
+        self.result.created += len(creates)
+        self.result.updated += len(updates)
+
+
+def _text(value):
+    if value is None:
+        return None
+    return value.strip() if isinstance(value, str) else str(value)
+
+
+def export_rows(kind, stream, file_format, chunk_size=2000):
+    """Write every booking or review to ``stream``; returns the number of rows"""
+    model, columns = EXPORTS[kind]
+    headers = [header for header, _ in columns]
+    rows = model.objects.order_by('pk').values_list(*(path for _, path in columns)).iterator(chunk_size=chunk_size)
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(headers)
+        for row in rows:
+            writer.writerow(_plain(value) for value in row)
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(dict(zip(headers, map(_plain, row))), ensure_ascii=False))
+            stream.write('\n')
+            count += 1
+    return count
+
+
+def _plain(value):
+    # Full precision, unlike DjangoJSONEncoder's millisecond timestamps
+    return value.isoformat() if hasattr(value, 'isoformat') else value
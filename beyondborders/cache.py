@@ -0,0 +1,163 @@
+"""
+Response caching for read-mostly views, invalidated by model signals.
+
+Every cached view depends on one or more namespaces ("destinations",
+"destination:12", "blog", "user:3", ...). Each namespace has a version
+number stored in the cache, and the cache key of a response embeds the
+versions of its namespaces. A write bumps only the namespaces it affects
+(see beyondborders.signals), so stale entries become unreachable and age
+out without flushing unrelated pages.
+
+Keys also include the view, the normalized query string, the visitor's
+currency and whether the visitor is anonymous. Anonymous responses are
+shared. Authenticated responses are keyed per session, because pages
+render the user's name and wishlist state. Responses that set a cookie,
+including any that rendered ``{% csrf_token %}``, are never stored; cached
+pages with forms leave the token input empty for base.html to fill from
+the CSRF cookie. A hit replays the stored body and headers.
+
+Works with any Django cache backend; settings.py configures the local-
+memory backend, and the file-based backend works as well.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+KEY_PREFIX = 'view-cache'
+# Recomputed for every response, or never present on a stored one
+_UNSTORED_HEADERS = {'content-length', 'set-cookie', 'x-view-cache'}
+
+
+def get_cache():
+    return caches[getattr(settings, 'VIEW_CACHE_ALIAS', 'default')]
+
+
+def _version_key(namespace):
+    return f'{KEY_PREFIX}:ns:{namespace}'
+
+
+def _fresh_version():
+    # Time-based, so a version key that was evicted never restarts at a
+    # number an older entry was stored under
+    return time.time_ns()
+
+
+def namespace_versions(namespaces):
+    cache = get_cache()
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, 0) for key in keys]
+
+
+def bump(*namespaces):
+    """Invalidate every cached response that depends on these namespaces once the transaction commits"""
+    def _bump():
+        cache = get_cache()
+        for namespace in namespaces:
+            key = _version_key(namespace)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, _fresh_version(), None)
+    transaction.on_commit(_bump)
+
+
+def _request_key(request, view_name, namespaces):
+    versions = namespace_versions(namespaces)
+    # Empty parameters and page=1 don't change the page, so they share a key
+    params = sorted(
+        (key, value) for key in request.GET for value in request.GET.getlist(key)
+        if value != '' and (key, value) != ('page', '1')
+    )
+    if request.user.is_authenticated:
+        audience = f'user:{request.user.pk}:{request.session.session_key}'
+    else:
+        audience = 'anonymous'
+    # Prices are rendered in the visitor's currency (beyondborders.middleware)
+    currency = getattr(request, 'currency', None)
+    digest = hashlib.md5(repr((versions, params, audience, currency)).encode(), usedforsecurity=False).hexdigest()
+    return f'{KEY_PREFIX}:{view_name}:{digest}'
+
+
+def _cacheable_request(request):
+    # Flash messages are rendered into the page and consumed by it
+    return request.method in ('GET', 'HEAD') and not len(messages.get_messages(request))
+
+
+def _cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def _serve(request, view_name, namespaces, render):
+    if not _cacheable_request(request):
+        return render()
+
+    # An authenticated user's pages also depend on their own writes
+    if request.user.is_authenticated:
+        namespaces = list(namespaces) + [f'user:{request.user.pk}']
+    cache = get_cache()
+    key = _request_key(request, view_name, namespaces)
+    cached = cache.get(key)
+    if cached is not None:
+        content, headers = cached
+        response = HttpResponse(content)
+        for header, value in headers:
+            response[header] = value
+        response['X-View-Cache'] = 'hit'
+        return response
+
+    response = render()
+    if callable(getattr(response, 'render', None)):
+        response = response.render()
+    if _cacheable_response(request, response):
+        timeout = getattr(settings, 'VIEW_CACHE_TIMEOUT', 300)
+        headers = [(header, value) for header, value in response.items() if header.lower() not in _UNSTORED_HEADERS]
+        cache.set(key, (response.content, headers), timeout)
+        response['X-View-Cache'] = 'miss'
+    return response
+
+
+def cache_view(namespaces):
+    """
+    Cache a function view's response.
+
+    ``namespaces`` is a list of namespace names or a callable taking
+    (request, *args, **kwargs) and returning one.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            names = namespaces(request, *args, **kwargs) if callable(namespaces) else namespaces
+            return _serve(request, view.__name__, names, lambda: view(request, *args, **kwargs))
+        return wrapped
+    return decorator
+
+
+class CachedViewMixin:
+    """Cache a class-based view's response under ``get_cache_namespaces()``"""
+    cache_namespaces = ()
+
+    def get_cache_namespaces(self):
+        return list(self.cache_namespaces)
+
+    def dispatch(self, request, *args, **kwargs):
+        return _serve(
+            request, type(self).__name__, self.get_cache_namespaces(),
+            lambda: super(CachedViewMixin, self).dispatch(request, *args, **kwargs),
+        )
@@ -0,0 +1,136 @@
+"""
+Background confirmation of bookings.
+
+Saving a new Booking enqueues a BookingConfirmationJob row in the same
+transaction (see signals), so ``book_destination`` returns as soon as the
+booking and its job are written. The ``process_booking_confirmations``
+worker then takes jobs oldest first, a batch per transaction:
+
+- bookings still pending are confirmed, or cancelled (giving their seats
+  back) when the travel date passed before the worker got to them, with
+  one UPDATE per outcome;
+- the batch's jobs are deleted in the same transaction, so a crash leaves
+  them queued for the next run.
+
+The queue is an ordinary table, so no broker is needed. On PostgreSQL
+(any backend with SKIP LOCKED) each worker locks its batch with
+``SELECT ... FOR UPDATE SKIP LOCKED`` and concurrent workers take the next
+unlocked rows. SQLite has no row locks: a worker claims its batch with a
+conditional UPDATE, which also takes the database write lock, so other
+workers wait for the batch to commit instead of processing it twice.
+"""
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from . import cache, inventory
+from .models import Booking, BookingConfirmationJob
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+
+class BatchResult:
+    """Counts and timings of one processed batch"""
+
+    def __init__(self, jobs=0, confirmed=0, cancelled=0, skipped=0, max_wait=0.0, avg_wait=0.0, duration=0.0):
+        self.jobs = jobs
+        self.confirmed = confirmed
+        self.cancelled = cancelled
+        # Bookings no longer pending (e.g. changed in the admin) are left alone
+        self.skipped = skipped
+        # Seconds between enqueueing and processing
+        self.max_wait = max_wait
+        self.avg_wait = avg_wait
+        self.duration = duration
+
+    def __str__(self):
+        return (
+            f'{self.jobs} jobs: {self.confirmed} confirmed, {self.cancelled} cancelled, '
+            f'{self.skipped} skipped in {self.duration * 1000:.1f}ms '
+            f'(waited avg {self.avg_wait:.2f}s, max {self.max_wait:.2f}s)'
+        )
+
+
+def enqueue(*bookings):
+    BookingConfirmationJob.objects.bulk_create([BookingConfirmationJob(booking=booking) for booking in bookings])
+
+
+def enqueue_pending():
+    """Queue every pending booking without a job, e.g. ones made before the worker existed. Returns the count."""
+    queued = BookingConfirmationJob.objects.values('booking_id')
+    pending = Booking.objects.filter(status='pending').exclude(pk__in=queued).values_list('pk', flat=True)
+    jobs = [BookingConfirmationJob(booking_id=pk) for pk in pending.iterator(chunk_size=2000)]
+    BookingConfirmationJob.objects.bulk_create(jobs, batch_size=1000, ignore_conflicts=True)
+    return len(jobs)
+
+
+def _claim(batch_size):
+    """Lock or claim the oldest ``batch_size`` jobs; call inside a transaction"""
+    jobs = BookingConfirmationJob.objects.order_by('pk')
+    if connection.features.has_select_for_update_skip_locked:
+        return list(jobs.select_for_update(skip_locked=True)[:batch_size])
+    token = uuid.uuid4().hex
+    BookingConfirmationJob.objects.filter(
+        pk__in=jobs.filter(claimed_by='').values('pk')[:batch_size],
+    ).update(claimed_by=token)
+    return list(jobs.filter(claimed_by=token))
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """Confirm or cancel the bookings of up to ``batch_size`` queued jobs; returns a BatchResult"""
+    started = time.perf_counter()
+    with transaction.atomic():
+        jobs = _claim(batch_size)
+        if not jobs:
+            return BatchResult(duration=time.perf_counter() - started)
+        now = timezone.now()
+        waits = [(now - job.enqueued_at).total_seconds() for job in jobs]
+
+        # Locked so an admin edit can't change a status (and its seats) under us
+        bookings = Booking.objects.select_for_update().filter(
+            pk__in=[job.booking_id for job in jobs], status='pending',
+        ).order_by('pk').values_list('pk', 'user_id', 'destination_id', 'travel_date', 'number_of_travelers')
+        today = timezone.localdate()
+        confirm, cancel, users = [], [], set()
+        released = defaultdict(int)
+        for pk, user_id, destination_id, travel_date, travelers in bookings:
+            users.add(user_id)
+            if travel_date < today:
+                cancel.append(pk)
+                released[destination_id, travel_date] += travelers
+            else:
+                confirm.append(pk)
+
+        # Bulk UPDATEs skip the Booking signals, so seats and caches are handled here
+        if confirm:
+            Booking.objects.filter(pk__in=confirm).update(status='confirmed')
+        if cancel:
+            Booking.objects.filter(pk__in=cancel).update(status='cancelled')
+            for (destination_id, travel_date), seats in sorted(released.items()):
+                inventory.release(destination_id, travel_date, seats)
+        if users:
+            cache.bump(*(f'user:{user_id}' for user_id in sorted(users)))
+        BookingConfirmationJob.objects.filter(pk__in=[job.pk for job in jobs]).delete()
+
+    result = BatchResult(
+        jobs=len(jobs), confirmed=len(confirm), cancelled=len(cancel),
+        skipped=len(jobs) - len(confirm) - len(cancel),
+        max_wait=max(waits), avg_wait=sum(waits) / len(waits),
+        duration=time.perf_counter() - started,
+    )
+    logger.info('Booking confirmations: %s', result)
+    return result
+
+
+def queue_stats():
+    """(queued jobs, seconds the oldest has waited)"""
+    stats = BookingConfirmationJob.objects.aggregate(count=Count('pk'), oldest=Min('enqueued_at'))
+    waited = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+    return stats['count'], waited
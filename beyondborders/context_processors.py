@@ -0,0 +1,9 @@
+from .currency import get_currency, get_rates
+
+
+def currency(request):
+    """The visitor's currency and the currencies they can switch to"""
+    return {
+        'currency': get_currency(request),
+        'currencies': get_rates().currencies,
+    }
@@ -0,0 +1,247 @@
+"""
+Price conversion between the currencies destinations are priced in and the
+one the visitor picked.
+
+Rates live in the ExchangeRate table as units per one ``BASE_CURRENCY``,
+loaded from a JSON or CSV file with the ``load_exchange_rates`` command (or
+the sample ``exchange_rates`` fixture). Each process keeps the table in memory as
+a RateTable stamped with the version of the 'exchange-rates' cache
+namespace; ExchangeRate signals bump that version, and a worker reloads
+when it sees a new one, or after ``EXCHANGE_RATES_TTL`` seconds when the
+cache is not shared between workers.
+
+Display conversion is a dictionary lookup per price. Filtering and sorting
+run in SQL: ``price_range_q`` turns a range in the visitor's currency into
+one (currency, price) range per source currency, which the
+dest_currency_price_idx index answers, and ``annotate_local_price`` adds
+``price_local`` for ordering. Prices in a currency without a rate are
+compared and sorted as stored (as if already in the visitor's currency),
+after every converted price, rather than dropped.
+"""
+import csv
+import json
+import math
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+from . import cache
+from .models import ExchangeRate
+
+NAMESPACE = 'exchange-rates'
+COOKIE_NAME = 'currency'
+# How often a worker looks up the rates version in the cache
+VERSION_CHECK_INTERVAL = 1.0
+
+SYMBOLS = {
+    'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'CNY': '¥', 'INR': '₹',
+    'NGN': '₦', 'KRW': '₩', 'TRY': '₺', 'BRL': 'R$', 'AUD': 'A$', 'CAD': 'C$',
+}
+
+
+def base_currency():
+    return getattr(settings, 'BASE_CURRENCY', 'USD')
+
+
+class RateTable:
+    def __init__(self, rates, version=None):
+        self.rates = dict(rates)
+        self.rates.setdefault(base_currency(), Decimal(1))
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_database(cls, version=None):
+        return cls(ExchangeRate.objects.values_list('currency', 'rate'), version)
+
+    @property
+    def currencies(self):
+        return sorted(self.rates)
+
+    def supports(self, currency):
+        return currency in self.rates
+
+    def factor(self, source, target):
+        """Multiplier from ``source`` to ``target`` amounts, or None when either rate is unknown"""
+        if source == target:
+            return Decimal(1)
+        if source not in self.rates or target not in self.rates:
+            return None
+        return self.rates[target] / self.rates[source]
+
+    def convert(self, amount, source, target):
+        factor = self.factor(source, target)
+        if amount is None or factor is None:
+            return None
+        return Decimal(amount) * factor
+
+
+class _Holder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.table = None
+        self.checked_at = 0.0
+
+    def invalidate(self):
+        self.table = None
+
+    def _current(self, table, version, now):
+        ttl = getattr(settings, 'EXCHANGE_RATES_TTL', 600)
+        return table is not None and table.version == version and now - table.loaded_at < ttl
+
+    def get(self):
+        table, now = self.table, time.monotonic()
+        if table is not None and now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return table
+        version = cache.namespace_versions([NAMESPACE])[0]
+        if self._current(table, version, now):
+            self.checked_at = now
+            return table
+        with self.lock:
+            if not self._current(self.table, version, now):
+                self.table = RateTable.from_database(version)
+            self.checked_at = now
+            return self.table
+
+
+rate_table = _Holder()
+
+
+def get_rates():
+    return rate_table.get()
+
+
+def get_currency(request):
+    """The currency to show ``request`` prices in: its cookie if the rate is known, else the default"""
+    currency = getattr(request, 'currency', None)
+    if currency is None:
+        currency = request.COOKIES.get(COOKIE_NAME, '').upper()
+        if not get_rates().supports(currency):
+            currency = getattr(settings, 'DEFAULT_CURRENCY', base_currency())
+    return currency
+
+
+def money_affixes(currency):
+    """(prefix, suffix) around a formatted amount: ('€', '') or ('', ' CHF')"""
+    symbol = SYMBOLS.get(currency)
+    return (symbol, '') if symbol else ('', f' {currency}')
+
+
+def format_money(amount, currency):
+    """Format an amount in whole units, e.g. "€1,250" or "1,250 CHF"; an empty string for None"""
+    if amount is None:
+        return ''
+    prefix, suffix = money_affixes(currency)
+    return f'{prefix}{Decimal(amount):,.0f}{suffix}'
+
+
+def local_price_expression(currency, field='price', currency_field='currency'):
+    """SQL expression for ``field`` converted into ``currency``; prices in an unknown currency as stored"""
+    rates = get_rates()
+    return Case(
+        *(
+            When(**{currency_field: source}, then=F(field) * Value(float(rates.factor(source, currency))))
+            for source in rates.currencies
+        ),
+        default=Cast(field, FloatField()),
+        output_field=FloatField(),
+    )
+
+
+def unknown_rate_expression(currency_field='currency'):
+    """SQL flag for prices in a currency without a rate, which sort after the converted ones"""
+    return Case(
+        When(**{f'{currency_field}__in': get_rates().currencies}, then=Value(False)),
+        default=Value(True),
+        output_field=BooleanField(),
+    )
+
+
+def annotate_local_price(queryset, currency, name='price_local'):
+    """Add ``name`` and ``rate_unknown``; order by both (in that order) to sort by local price"""
+    return queryset.annotate(**{name: local_price_expression(currency), 'rate_unknown': unknown_rate_expression()})
+
+
+def price_range_q(low, high, currency, field='price', currency_field='currency'):
+    """
+    Q for prices between ``low`` and ``high`` (either may be None) in ``currency``.
+
+    Each source currency gets its own range on the stored integer prices, so
+    the database compares indexed columns instead of converted values.
+    Prices in currencies without a rate are compared as stored.
+    """
+    rates = get_rates()
+    condition = Q()
+    for source in rates.currencies:
+        condition |= Q(**{currency_field: source}, **_price_bounds(low, high, rates.factor(source, currency), field))
+    unknown = ~Q(**{f'{currency_field}__in': rates.currencies})
+    return condition | (unknown & Q(**_price_bounds(low, high, Decimal(1), field)))
+
+
+def _price_bounds(low, high, factor, field):
+    bounds = {}
+    if low is not None:
+        bounds[f'{field}__gte'] = math.ceil(Decimal(low) / factor)
+    if high is not None:
+        bounds[f'{field}__lte'] = math.floor(Decimal(high) / factor)
+    return bounds
+
+
+def read_rates(stream, file_format):
+    """
+    Parse rates from an open text stream.
+
+    JSON is ``{"base": "USD", "rates": {"EUR": 0.92, ...}}`` (``base`` is
+    optional); CSV has ``currency,rate`` columns. Rates given against
+    another base are rebased onto BASE_CURRENCY, which must then be listed.
+    Returns {currency: Decimal rate}; raises ValueError on a bad row.
+    """
+    if file_format == 'json':
+        data = json.load(stream)
+        base, rows = data.get('base', base_currency()), data.get('rates', {}).items()
+    else:
+        base, rows = base_currency(), ((row['currency'], row['rate']) for row in csv.DictReader(stream))
+    rates = {}
+    for currency, rate in rows:
+        currency = (currency or '').strip().upper()
+        try:
+            rate = Decimal(str(rate).strip())
+        except InvalidOperation:
+            raise ValueError(f'{currency}: "{rate}" is not a number')
+        if len(currency) != 3 or not currency.isalpha():
+            raise ValueError(f'"{currency}" is not a currency code')
+        if not rate.is_finite() or rate <= 0:
+            raise ValueError(f'{currency}: the rate must be positive')
+        rates[currency] = rate
+    base = base.upper()
+    rates.setdefault(base, Decimal(1))
+    if base_currency() not in rates:
+        raise ValueError(f'Rates are against {base} but do not include {base_currency()}')
+    unit = rates[base_currency()]
+    return {currency: (rate / unit).quantize(Decimal('1E-10')) for currency, rate in rates.items()}
+
+
+def save_rates(rates, replace=False):
+    """
+    Upsert {currency: rate} into ExchangeRate in one statement.
+
+    With ``replace``, currencies missing from ``rates`` are deleted. Returns
+    (saved, deleted) counts.
+    """
+    deleted = 0
+    with transaction.atomic():
+        ExchangeRate.objects.bulk_create(
+            [ExchangeRate(currency=code, rate=rate) for code, rate in sorted(rates.items())],
+            update_conflicts=True, unique_fields=['currency'], update_fields=['rate', 'updated_at'],
+        )
+        if replace:
+            deleted, _ = ExchangeRate.objects.exclude(currency__in=list(rates)).delete()
+        # bulk_create skips the signals that do this for single saves
+        cache.bump(NAMESPACE, 'destinations')
+        transaction.on_commit(rate_table.invalidate)
+    return len(rates), deleted
@@ -0,0 +1,359 @@
+"""
+Copy the legacy travello destinations and bookings into beyondborders.
+
+Source rows are streamed in primary-key order and written with
+``bulk_create`` in batches. Each batch commits in one transaction together
+with its checkpoint (the last source ID copied), so an interrupted run
+resumes after the last committed batch without copying a row twice. Every
+copied row is recorded in LegacyDestination / LegacyBooking: bookings
+resolve their destination through the first, and verify() compares source
+and copy through both. Users are shared, so booking user IDs are copied as
+they are.
+
+A table is copied either whole or as primary-key range shards with one
+checkpoint each; beyondborders.sharded_migration runs shards in worker
+processes.
+
+Bulk inserts skip model signals. Each batch queues what they would have
+queued (renditions of the destination images, confirmations of pending
+bookings) in its own transaction and invalidates the pages of the users it
+booked for; once destinations are copied the search documents are rebuilt
+and the listing caches invalidated in one go. Both steps also queue
+whatever rows copied by an earlier run are still missing.
+"""
+import hashlib
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import F, Max, Min, Q
+
+from . import cache, confirmations, rendition_queue, search, search_index, similarity, suggest
+from .models import (
+    Booking, DataMigrationCheckpoint, Destination, LegacyBooking, LegacyDestination,
+)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 2000
+
+DESTINATIONS = 'travello.destination'
+BOOKINGS = 'travello.booking'
+
+DESTINATION_FIELDS = ('name', 'img', 'desc', 'price', 'offer')
+BOOKING_FIELDS = ('user_id', 'destination_id', 'travel_date', 'number_of_travelers', 'status', 'created_at')
+
+
+class DataMigrationError(Exception):
+    pass
+
+
+class Shard:
+    """The source rows of ``table`` with start <= pk <= stop (no upper bound when stop is None)"""
+
+    def __init__(self, table, start=1, stop=None):
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    @property
+    def key(self):
+        if self.start <= 1 and self.stop is None:
+            return self.table
+        return f'{self.table}:{self.start}-{self.stop}'
+
+    def filter(self, queryset, field='pk'):
+        queryset = queryset.filter(**{f'{field}__gte': self.start})
+        if self.stop is not None:
+            queryset = queryset.filter(**{f'{field}__lte': self.stop})
+        return queryset
+
+    def __str__(self):
+        return self.key
+
+
+class StageResult:
+    def __init__(self, name, copied=0, skipped=0, seconds=0.0):
+        self.name = name
+        self.copied = copied
+        self.skipped = skipped
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.copied / self.seconds if self.seconds else 0.0
+
+
+class ShardCheck:
+    def __init__(self, shard, source_count, source_checksum, target_count, target_checksum):
+        self.shard = shard
+        self.source_count = source_count
+        self.source_checksum = source_checksum
+        self.target_count = target_count
+        self.target_checksum = target_checksum
+
+    @property
+    def ok(self):
+        return (self.source_count, self.source_checksum) == (self.target_count, self.target_checksum)
+
+
+def source_models():
+    """Return the travello (Destination, Booking) models"""
+    try:
+        return apps.get_model('travello', 'Destination'), apps.get_model('travello', 'Booking')
+    except LookupError:
+        raise DataMigrationError(
+            "The travello app is not installed; add 'travello' to INSTALLED_APPS to migrate its data"
+        )
+
+
+def _source_queryset(table):
+    OldDestination, OldBooking = source_models()
+    return (OldDestination if table == DESTINATIONS else OldBooking).objects.all()
+
+
+def plan_shards(table, shard_size=None):
+    """
+    Split ``table`` into primary-key ranges of ``shard_size`` IDs.
+
+    Boundaries are multiples of shard_size, so a resumed run with the same
+    size finds the same shards (and their checkpoints) again. Without a
+    size the table is a single shard.
+    """
+    if not shard_size:
+        return [Shard(table)]
+    bounds = _source_queryset(table).aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    first, last = (bounds['low'] - 1) // shard_size, (bounds['high'] - 1) // shard_size
+    return [Shard(table, index * shard_size + 1, (index + 1) * shard_size) for index in range(first, last + 1)]
+
+
+def check_checkpoints(table, shards):
+    """Refuse to resume a table that was partly copied with a different shard layout"""
+    planned = {shard.key for shard in shards}
+    started = DataMigrationCheckpoint.objects.filter(
+        Q(key=table) | Q(key__startswith=f'{table}:'), rows_copied__gt=0
+    ).values_list('key', flat=True)
+    unexpected = sorted(set(started) - planned)
+    if unexpected:
+        raise DataMigrationError(
+            f'{table} was partly copied as {", ".join(unexpected[:3])}{"..." if len(unexpected) > 3 else ""}; '
+            'resume it with the same sharding options'
+        )
+
+
+def _checkpoint(shard):
+    checkpoint, _ = DataMigrationCheckpoint.objects.get_or_create(
+        key=shard.key, defaults={'last_source_id': shard.start - 1}
+    )
+    return checkpoint
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _streamed_rows(queryset, after, chunk_size, field='pk'):
+    """Rows after ``after`` in ``field`` order from one server-side iterator"""
+    return queryset.filter(**{f'{field}__gt': after}).order_by(field).iterator(chunk_size=chunk_size)
+
+
+def _bounded_rows(queryset, after, chunk_size, field='pk'):
+    """
+    Rows after ``after`` in ``field`` order, one LIMIT query per chunk.
+
+    No cursor stays open between chunks. SQLite cannot commit while another
+    connection holds a read open, so this is how concurrent shard workers
+    read without stalling each other's writes.
+    """
+    while True:
+        chunk = list(queryset.filter(**{f'{field}__gt': after}).order_by(field)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        after = chunk[-1][0]
+
+
+@contextmanager
+def _keep_auto_now_add(model):
+    """Let bulk_create keep copied timestamps instead of stamping the current time"""
+    fields = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _require_returned_ids():
+    if not connection.features.can_return_rows_from_bulk_insert:
+        raise DataMigrationError(f'{connection.vendor} does not return primary keys from bulk inserts')
+
+
+def _copy(shard, rows, write_batch, batch_size, progress):
+    """
+    Copy ``rows`` (tuples starting with the source ID) batch by batch.
+
+    ``write_batch(batch)`` inserts one batch and returns how many rows it
+    skipped; it runs in the same transaction as the checkpoint update.
+    """
+    result = StageResult(shard.key)
+    started = time.monotonic()
+    for batch in _batches(rows, batch_size):
+        with transaction.atomic():
+            skipped = write_batch(batch)
+            DataMigrationCheckpoint.objects.filter(key=shard.key).update(
+                last_source_id=batch[-1][0],
+                rows_copied=F('rows_copied') + len(batch) - skipped,
+                rows_skipped=F('rows_skipped') + skipped,
+            )
+        result.copied += len(batch) - skipped
+        result.skipped += skipped
+        result.seconds = time.monotonic() - started
+        if progress:
+            progress(result, batch[-1][0])
+    result.seconds = time.monotonic() - started
+    return result
+
+
+def copy_destinations(shard, batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                      progress=None, streaming=True):
+    """Copy one shard of travello destinations; returns (StageResult, {source ID: new ID})"""
+    _require_returned_ids()
+    checkpoint = _checkpoint(shard)
+    queryset = shard.filter(_source_queryset(DESTINATIONS)).values_list('pk', *DESTINATION_FIELDS)
+    rows = (_streamed_rows if streaming else _bounded_rows)(queryset, checkpoint.last_source_id, chunk_size)
+    copied_ids = {}
+
+    def write_batch(batch):
+        destinations = Destination.objects.bulk_create([
+            Destination(**dict(zip(DESTINATION_FIELDS, row[1:]))) for row in batch
+        ])
+        LegacyDestination.objects.bulk_create([
+            LegacyDestination(source_id=row[0], destination_id=destination.pk)
+            for row, destination in zip(batch, destinations)
+        ])
+        copied_ids.update((row[0], destination.pk) for row, destination in zip(batch, destinations))
+        rendition_queue.enqueue(*(row[2] for row in batch))
+        return 0
+
+    return _copy(shard, rows, write_batch, batch_size, progress), copied_ids
+
+
+def copy_bookings(shard, destination_ids, batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                  progress=None, streaming=True):
+    """Copy one shard of travello bookings, resolving destinations through ``destination_ids``"""
+    _require_returned_ids()
+    checkpoint = _checkpoint(shard)
+    queryset = shard.filter(_source_queryset(BOOKINGS)).values_list('pk', *BOOKING_FIELDS)
+    rows = (_streamed_rows if streaming else _bounded_rows)(queryset, checkpoint.last_source_id, chunk_size)
+
+    def write_batch(batch):
+        # Bookings whose destination was never copied are counted as skipped
+        kept = [row for row in batch if row[2] in destination_ids]
+        bookings = Booking.objects.bulk_create([
+            Booking(**dict(zip(BOOKING_FIELDS, row[1:]), destination_id=destination_ids[row[2]]))
+            for row in kept
+        ])
+        LegacyBooking.objects.bulk_create([
+            LegacyBooking(source_id=row[0], booking_id=booking.pk)
+            for row, booking in zip(kept, bookings)
+        ])
+        confirmations.enqueue(*(booking for booking in bookings if booking.status == 'pending'))
+        if kept:
+            cache.bump(*(f'user:{user_id}' for user_id in sorted({row[1] for row in kept})))
+        return len(batch) - len(kept)
+
+    with _keep_auto_now_add(Booking):
+        return _copy(shard, rows, write_batch, batch_size, progress)
+
+
+def destination_id_map():
+    return dict(LegacyDestination.objects.values_list('source_id', 'destination_id').iterator())
+
+
+def migrate_destinations(batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    shard = Shard(DESTINATIONS)
+    check_checkpoints(DESTINATIONS, [shard])
+    result, _ = copy_destinations(shard, batch_size, chunk_size, progress)
+    # Also when resuming after a run that stopped before this step
+    if result.copied or _checkpoint(shard).rows_copied:
+        refresh_derived_data()
+    return result
+
+
+def migrate_bookings(batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    shard = Shard(BOOKINGS)
+    check_checkpoints(BOOKINGS, [shard])
+    result = copy_bookings(shard, destination_id_map(), batch_size, chunk_size, progress)
+    refresh_booking_data()
+    return result
+
+
+def _digest(rows):
+    digest = hashlib.sha1()
+    count = 0
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+        digest.update(b'\n')
+        count += 1
+    return count, digest.hexdigest()
+
+
+def verify(shard, destination_ids=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compare the row count and checksum of a source shard with its copy.
+
+    Source rows are hashed in pk order and copies in the order of the source
+    IDs recorded for them. Booking destinations are compared through
+    ``destination_ids``; bookings skipped for lack of one are left out.
+    """
+    after = shard.start - 1
+    if shard.table == DESTINATIONS:
+        source = shard.filter(_source_queryset(DESTINATIONS)).values_list('pk', *DESTINATION_FIELDS)
+        target = shard.filter(LegacyDestination.objects, 'source_id').values_list(
+            'source_id', *(f'destination__{field}' for field in DESTINATION_FIELDS)
+        )
+        source_rows = _bounded_rows(source, after, chunk_size)
+    else:
+        if destination_ids is None:
+            destination_ids = destination_id_map()
+        source = shard.filter(_source_queryset(BOOKINGS)).values_list('pk', *BOOKING_FIELDS)
+        target = shard.filter(LegacyBooking.objects, 'source_id').values_list(
+            'source_id', *(f'booking__{field}' for field in BOOKING_FIELDS)
+        )
+        source_rows = (
+            row[:2] + (destination_ids[row[2]],) + row[3:]
+            for row in _bounded_rows(source, after, chunk_size)
+            if row[2] in destination_ids
+        )
+    target_rows = _bounded_rows(target, after, chunk_size, field='source_id')
+    return ShardCheck(shard, *_digest(source_rows), *_digest(target_rows))
+
+
+def refresh_derived_data():
+    """Rebuild what the skipped Destination signals would have maintained"""
+    search.rebuild_search_index()
+    suggest.suggestion_index.invalidate()
+    similarity.destination_arrays.invalidate()
+    if search_index.is_enabled():
+        search_index.index_holder.rebuild(compact=True)
+    cache.bump('destinations')
+    # Images already rendered are skipped by the queue
+    images = Destination.objects.exclude(img='').values_list('img', flat=True).distinct()
+    rendition_queue.enqueue(*images.iterator(chunk_size=DEFAULT_CHUNK_SIZE))
+
+
+def refresh_booking_data():
+    """Queue the confirmations the skipped Booking signals would have queued"""
+    confirmations.enqueue_pending()
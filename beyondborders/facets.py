@@ -0,0 +1,128 @@
+"""
+Facet counts for the destinations page: how many results each location,
+price bucket, rating bucket and the offer filter would give.
+
+All counts come from one query: the search-filtered destinations grouped
+by location, with one conditional COUNT per facet value. Each facet is
+counted with every active filter except its own, so picking a location
+still shows how many results the other locations have. Totals for price,
+rating and offer are the sums over the location groups.
+
+Results are cached per filter set, visitor currency and rates version, and
+depend on the 'destinations' namespace, so any Destination or Review write
+invalidates them. Pages and sort orders of the same filters share an entry.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .cache import get_cache, namespace_versions
+from .currency import get_rates, price_range_q
+
+KEY_PREFIX = 'facets'
+# (min_price, max_price) in the visitor's currency, inclusive like the search form
+PRICE_BUCKETS = ((None, 99), (100, 249), (250, 499), (500, 999), (1000, None))
+RATING_BUCKETS = (4, 3, 2, 1)
+MAX_LOCATIONS = 15
+
+
+def filter_conditions(data, currency):
+    """Return {facet: Q} for the facet filters active in the search form's cleaned data"""
+    conditions = {}
+    if data.get('location'):
+        conditions['location'] = Q(location__icontains=data['location'])
+    if data.get('min_price') or data.get('max_price'):
+        # Bounds are in the visitor's currency; converted per source currency in SQL
+        conditions['price'] = price_range_q(data.get('min_price') or None, data.get('max_price') or None, currency)
+    if data.get('min_rating'):
+        # Filter on the stored average rating
+        conditions['rating'] = Q(rating_avg__gte=int(data['min_rating']))
+    if data.get('offer_only'):
+        conditions['offer'] = Q(offer=True)
+    return conditions
+
+
+def _all_but(conditions, name):
+    condition = Q()
+    for facet, facet_condition in conditions.items():
+        if facet != name:
+            condition &= facet_condition
+    return condition
+
+
+def _count(condition):
+    return Count('pk', filter=condition) if condition else Count('pk')
+
+
+def _cache_key(data, currency):
+    versions = namespace_versions(['destinations'])
+    active = sorted((name, str(value)) for name, value in data.items() if value not in (None, '', False))
+    digest = hashlib.md5(repr((versions, active, currency, get_rates().version)).encode(), usedforsecurity=False)
+    return f'{KEY_PREFIX}:{digest.hexdigest()}'
+
+
+def count_facets(queryset, data, currency):
+    """
+    Return facet counts for ``queryset`` (the destinations matching the text
+    query, before facet filters) under the form's cleaned ``data``.
+    """
+    data = {name: data.get(name) for name in ('query', 'location', 'min_price', 'max_price', 'min_rating', 'offer_only')}
+    cache = get_cache()
+    key = _cache_key(data, currency)
+    counts = cache.get(key)
+    if counts is None:
+        counts = _count_facets(queryset, filter_conditions(data, currency), currency)
+        cache.set(key, counts, getattr(settings, 'FACET_CACHE_TIMEOUT', 300))
+    return _present(counts, data)
+
+
+def _count_facets(queryset, conditions, currency):
+    aggregates = {
+        'total': _count(_all_but(conditions, None)),
+        'location_total': _count(_all_but(conditions, 'location')),
+        'offer_any': _count(_all_but(conditions, 'offer')),
+        'offer_only': _count(_all_but(conditions, 'offer') & Q(offer=True)),
+    }
+    others = _all_but(conditions, 'price')
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        aggregates[f'price_{index}'] = _count(others & price_range_q(low, high, currency))
+    others = _all_but(conditions, 'rating')
+    for stars in RATING_BUCKETS:
+        aggregates[f'rating_{stars}'] = _count(others & Q(rating_avg__gte=stars))
+
+    counts = dict.fromkeys(aggregates, 0)
+    locations = []
+    for row in queryset.order_by().values('location').annotate(**aggregates):
+        for name in aggregates:
+            counts[name] += row[name]
+        if row['location'] and row['location_total']:
+            locations.append((row['location'], row['location_total']))
+    locations.sort(key=lambda item: (-item[1], item[0]))
+    counts['locations'] = locations[:MAX_LOCATIONS]
+    return counts
+
+
+def _present(counts, data):
+    """Shape cached counts for the template, marking the selected values"""
+    location = (data.get('location') or '').lower()
+    min_rating = int(data['min_rating']) if data.get('min_rating') else None
+    return {
+        'total': counts['total'],
+        'locations': [
+            {'value': value, 'count': count, 'selected': value.lower() == location}
+            for value, count in counts['locations']
+        ],
+        'prices': [
+            {
+                'min': low, 'max': high, 'count': counts[f'price_{index}'],
+                'selected': (data.get('min_price') or None, data.get('max_price') or None) == (low, high),
+            }
+            for index, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        'ratings': [
+            {'stars': stars, 'count': counts[f'rating_{stars}'], 'selected': min_rating == stars}
+            for stars in RATING_BUCKETS
+        ],
+        'offers': {'count': counts['offer_only'], 'any': counts['offer_any'], 'selected': bool(data.get('offer_only'))},
+    }
@@ -0,0 +1,288 @@
+"""
+In-process serving of collected static files and uploaded media.
+
+FileServingMiddleware answers GET and HEAD requests under STATIC_URL and
+MEDIA_URL from STATIC_ROOT and MEDIA_ROOT before any other middleware runs
+(sessions, auth, ...), so a single container can serve the site without a
+separate web server in front of it:
+
+- Responses are FileResponses over the open file. Under a WSGI server with
+  ``wsgi.file_wrapper`` (gunicorn, uWSGI) the server sends them with
+  ``os.sendfile``, without copying the file through Python, byte ranges
+  included.
+- ETag and Last-Modified come from the file's size and mtime; conditional
+  requests get 304 (or 412) from Django's get_conditional_response.
+- A single ``Range: bytes=...`` is answered with 206 (honouring
+  If-Range); other range requests get the whole file.
+- Clients accepting br or gzip get the ``.br``/``.gz`` sibling written by
+  collectstatic (beyondborders.assets) when there is one, with its own
+  ETag and ``Vary: Accept-Encoding``.
+- Content-hashed files (fingerprinted static files and image renditions)
+  never change, so they are cached for a year and never stat()ed again.
+  Other files are cached briefly and re-stat()ed at most every
+  ``FILE_STAT_CACHE_TTL`` seconds.
+
+Files that do not exist fall through to the URLconf, which returns 404.
+"""
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .images import RENDITION_DIR
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+STATIC_MAX_AGE = 60
+MEDIA_MAX_AGE = 60 * 60
+# Files whose stat results are kept per process
+STAT_CACHE_SIZE = 10000
+# Preferred first; the suffix is what collectstatic writes
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# ManifestStaticFilesStorage inserts a 12-digit hash before the extension
+_HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def stat_cache_ttl():
+    return getattr(settings, 'FILE_STAT_CACHE_TTL', 2.0)
+
+
+class StaticFile:
+    """What a response needs to know about one file, from one stat() per variant"""
+
+    def __init__(self, path, immutable, max_age):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = quote_etag(f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+        self.immutable = immutable
+        self.max_age = max_age
+        content_type, encoding = mimetypes.guess_type(path)
+        if encoding:
+            # A stored .gz is served as is, not decompressed by the browser
+            content_type = 'application/octet-stream'
+        content_type = content_type or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        # {encoding: (path, size, etag)} for the precompressed siblings
+        self.variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                variant = os.stat(path + suffix)
+            except OSError:
+                continue
+            etag = quote_etag(f'{variant.st_size:x}-{variant.st_mtime_ns:x}-{encoding}')
+            self.variants[encoding] = (path + suffix, variant.st_size, etag)
+        self.checked_at = time.monotonic()
+
+    def is_fresh(self):
+        return self.immutable or time.monotonic() - self.checked_at < stat_cache_ttl()
+
+    def cache_control(self):
+        if self.immutable:
+            return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        return f'public, max-age={self.max_age}'
+
+
+class StatCache:
+    """Least recently used StaticFiles, shared by the threads of a process"""
+
+    def __init__(self, size=STAT_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, immutable, max_age):
+        """The StaticFile at ``path``, or None if it is not a regular file"""
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.entries.move_to_end(path)
+        if entry is not None and entry.is_fresh():
+            return entry
+        try:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(path)
+            entry = StaticFile(path, immutable, max_age)
+        except OSError:
+            with self.lock:
+                self.entries.pop(path, None)
+            return None
+        with self.lock:
+            self.entries[path] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+stat_cache = StatCache()
+
+
+def _mounts():
+    """(URL prefix, root, max age, immutable(name)) for each served directory"""
+    mounts = []
+    if settings.STATIC_URL and settings.STATIC_ROOT:
+        mounts.append((settings.STATIC_URL, settings.STATIC_ROOT, STATIC_MAX_AGE, _HASHED_NAME.search))
+    if settings.MEDIA_URL and settings.MEDIA_ROOT:
+        mounts.append((settings.MEDIA_URL, settings.MEDIA_ROOT, MEDIA_MAX_AGE, _is_rendition))
+    # Only prefixes served by this site, not other hosts
+    return [mount for mount in mounts if mount[0].startswith('/')]
+
+
+def _is_rendition(name):
+    # Rendition names are derived from the source's content hash
+    return name.startswith(RENDITION_DIR + '/')
+
+
+def find_file(path_info):
+    """The StaticFile for a request path, or None when no file is served there"""
+    for prefix, root, max_age, immutable in _mounts():
+        if not path_info.startswith(prefix):
+            continue
+        name = path_info[len(prefix):]
+        if not name or name.endswith('/'):
+            return None
+        try:
+            path = safe_join(root, name)
+        except (SuspiciousFileOperation, ValueError):
+            return None
+        return stat_cache.get(path, bool(immutable(name)), max_age)
+    return None
+
+
+def accepted_encodings(request):
+    """Content codings the client accepts, ignoring any with q=0"""
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = re.search(r'q=(\d+(?:\.\d*)?)', params)
+        if coding and not (quality and float(quality.group(1)) == 0):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def byte_range(request, size, etag, mtime):
+    """
+    (start, length) of the single range requested, None to send the whole
+    file, or False if the range cannot be satisfied.
+    """
+    header = request.META.get('HTTP_RANGE', '').replace(' ', '')
+    match = _RANGE.match(header)
+    if not match or match.groups() == ('', ''):
+        # Several ranges, or not bytes: the whole file is a valid answer
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        date = parse_http_date_safe(if_range)
+        if if_range != etag and date != int(mtime):
+            return None
+    first, last = match.groups()
+    if not first:
+        # The last N bytes
+        length = min(int(last), size)
+        return (size - length, length) if length else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+
+class _FileRange:
+    """
+    The ``length`` bytes of ``file`` from ``start``. Exposes fileno() so a
+    WSGI file wrapper can still sendfile() it: the server sends
+    Content-Length bytes from the current offset.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def serve(request, static_file):
+    """Response for a GET or HEAD of ``static_file``"""
+    path, size, etag = static_file.path, static_file.size, static_file.etag
+    encoding = None
+    wants_range = 'HTTP_RANGE' in request.META
+    # Ranges refer to the identity encoding, so they are served from the original
+    if not wants_range:
+        accepted = accepted_encodings(request)
+        for candidate, _ in ENCODINGS:
+            if candidate in static_file.variants and candidate in accepted:
+                encoding = candidate
+                path, size, etag = static_file.variants[candidate]
+                break
+
+    headers = HttpResponse(content_type=static_file.content_type)
+    headers['ETag'] = etag
+    headers['Last-Modified'] = http_date(static_file.mtime)
+    headers['Cache-Control'] = static_file.cache_control()
+    headers['Accept-Ranges'] = 'bytes'
+    if static_file.variants:
+        headers['Vary'] = 'Accept-Encoding'
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(static_file.mtime), response=headers)
+    if conditional is not headers:
+        return conditional
+
+    status, start, length = 200, 0, size
+    if wants_range:
+        requested = byte_range(request, size, etag, static_file.mtime)
+        if requested is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if requested is not None:
+            status, (start, length) = 206, requested
+
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=static_file.content_type)
+    else:
+        try:
+            file = open(path, 'rb')
+        except OSError:
+            # Deleted since it was stat()ed
+            stat_cache.clear()
+            return None
+        body = file if status == 200 else _FileRange(file, start, length)
+        response = FileResponse(body, status=status, content_type=static_file.content_type)
+    # FileResponse adds an inline Content-Disposition with the file name
+    response.headers.pop('Content-Disposition', None)
+    for header, value in headers.items():
+        response.headers.setdefault(header, value)
+    response['Content-Length'] = str(length)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+    return response
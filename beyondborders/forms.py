@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
@@ -65,6 +67,8 @@ class BookingForm(forms.ModelForm):
         max_value=10, 
         widget=forms.NumberInput(attrs={'class': 'form-control', 'min': '1', 'max': '10'})
     )
+    # Issued with the form so a resubmission can be recognised (beyondborders.idempotency)
+    idempotency_key = forms.UUIDField(required=False, widget=forms.HiddenInput)
 
     class Meta:
         model = Booking
@@ -74,6 +78,8 @@ class BookingForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['travel_date'].widget.attrs.update({'class': 'form-control'})
         self.fields['number_of_travelers'].widget.attrs.update({'class': 'form-control'})
+        if not self.is_bound:
+            self.fields['idempotency_key'].initial = uuid.uuid4()
 
 class ReviewForm(forms.ModelForm):
     """Form for users to submit reviews"""
@@ -107,14 +113,18 @@ class DestinationSearchForm(forms.Form):
         required=False,
         widget=forms.TextInput(attrs={
             'class': 'form-control',
-            'placeholder': 'Search destinations...'
+            'placeholder': 'Search destinations...',
+            'list': 'destination-suggestions',
+            'autocomplete': 'off'
         })
     )
     location = forms.CharField(
         required=False,
         widget=forms.TextInput(attrs={
             'class': 'form-control',
-            'placeholder': 'Location...'
+            'placeholder': 'Location...',
+            'list': 'location-suggestions',
+            'autocomplete': 'off'
         })
     )
     min_price = forms.IntegerField(
@@ -140,3 +150,15 @@ class DestinationSearchForm(forms.Form):
         required=False,
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    sort = forms.ChoiceField(
+        choices=[('', 'Recommended'), ('price', 'Price: low to high'), ('-price', 'Price: high to low')],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    
+    def __init__(self, *args, currency=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if currency:
+            # Price bounds are entered in the visitor's currency
+            self.fields['min_price'].widget.attrs['placeholder'] = f'Min price ({currency})'
+            self.fields['max_price'].widget.attrs['placeholder'] = f'Max price ({currency})'
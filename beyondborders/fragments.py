@@ -0,0 +1,87 @@
+"""
+Cached destination card fragments.
+
+The card markup on the listing pages is identical for every visitor apart
+from a few user-specific overlays (wishlist heart, remove button, added
+date), which the page templates render outside the fragment. Fragments are
+cached per destination under the 'destination:<pk>' namespace version from
+beyondborders.cache, so a Destination save or a Review change (which
+updates the rating aggregates) invalidates exactly that card. Cards that
+carry a search snippet depend on the query, so they are rendered but not
+stored.
+
+A page costs one get_many for the namespace versions, one get_many for the
+fragments and one set_many for any misses.
+
+The "Nearby Destinations" block of a detail page lists other destinations,
+so it is cached on its own under the 'geo' namespace, which only changes to
+a destination's name, location or coordinates bump. Edits elsewhere leave
+the page cached, and a page re-rendered for its own destination reuses the
+block instead of repeating the nearest-neighbour queries.
+"""
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .cache import get_cache, namespace_versions
+from . import geo
+from .currency import get_rates
+from .images import get_manifest
+from .models import Destination
+
+KEY_PREFIX = 'card'
+
+
+def attach_card_html(destinations, template_name, authenticated, currency):
+    """
+    Set ``card_html`` on each destination to its rendered card fragment.
+
+    ``authenticated`` selects the variant (Book Now vs Login to Book) and
+    ``currency`` the one prices are shown in; they are the only
+    visitor-dependent inputs the fragments receive.
+    """
+    destinations = list(destinations)
+    if not destinations:
+        return destinations
+    cache = get_cache()
+    versions = namespace_versions([f'destination:{destination.pk}' for destination in destinations])
+    # New exchange rates change every card's price, new renditions its image
+    variant = f"{'auth' if authenticated else 'anon'}:{currency}:{get_rates().version}:{get_manifest().version}"
+    keys = [
+        f'{KEY_PREFIX}:{template_name}:{variant}:{destination.pk}:{version}'
+        for destination, version in zip(destinations, versions)
+    ]
+    cacheable = [not getattr(destination, 'search_snippet', None) for destination in destinations]
+    cached = cache.get_many([key for key, store in zip(keys, cacheable) if store])
+
+    rendered = {}
+    for destination, key, store in zip(destinations, keys, cacheable):
+        html = cached.get(key) if store else None
+        if html is None:
+            html = render_to_string(template_name, {
+                'destination': destination,
+                'authenticated': authenticated,
+                'currency': currency,
+            })
+            if store:
+                rendered[key] = html
+        destination.card_html = mark_safe(html)
+    if rendered:
+        cache.set_many(rendered, getattr(settings, 'CARD_FRAGMENT_TIMEOUT', 3600))
+    return destinations
+
+
+def nearby_html(destination, limit, radius_km):
+    """Rendered list of the ``limit`` destinations nearest to ``destination`` within ``radius_km``"""
+    cache = get_cache()
+    version = namespace_versions([geo.NAMESPACE])[0]
+    key = f'nearby:{destination.pk}:{limit}:{radius_km}:{version}'
+    html = cache.get(key)
+    if html is None:
+        nearby = geo.nearest(
+            Destination.objects.exclude(pk=destination.pk).only('id', 'name', 'location', 'latitude', 'longitude'),
+            destination.latitude, destination.longitude, limit=limit, max_radius_km=radius_km,
+        )
+        html = render_to_string('includes/nearby_destinations.html', {'nearby_destinations': nearby})
+        cache.set(key, html, getattr(settings, 'CARD_FRAGMENT_TIMEOUT', 3600))
+    return mark_safe(html)
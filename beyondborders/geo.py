@@ -0,0 +1,102 @@
+"""
+Nearby-destination queries on the plain latitude/longitude columns.
+
+No PostGIS: a query first restricts rows to the bounding box of the search
+circle, which the (latitude, longitude) index answers as a range scan, then
+computes the exact haversine distance in SQL for the few rows left and
+filters and orders by it. Django provides the trigonometric functions on
+SQLite as well, so the same queries run on both backends.
+
+k-nearest queries widen the radius until the circle holds k destinations;
+everything inside a circle is closer than anything outside it, so the
+first k rows by distance are then exact.
+
+Pages showing what is near a destination are cached under NAMESPACE, which
+beyondborders.signals bumps when a destination is placed, moved, renamed or
+removed.
+"""
+import math
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Half the circumference: no two points are further apart
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+NAMESPACE = 'geo'
+
+DEFAULT_RADIUS_KM = 50
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between two points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Return a Q limiting latitude/longitude to the box around the circle.
+
+    The longitude span widens towards the poles and is split in two where
+    it crosses the antimeridian; circles reaching a pole cover every
+    longitude.
+    """
+    lat, lon = float(lat), float(lon)
+    delta_lat = radius_km / KM_PER_DEGREE
+    box = Q(latitude__gte=max(lat - delta_lat, -90), latitude__lte=min(lat + delta_lat, 90))
+    if abs(lat) + delta_lat >= 90:
+        return box
+    delta_lon = math.degrees(
+        math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat))))
+    )
+    if delta_lon >= 180:
+        return box
+    west, east = lon - delta_lon, lon + delta_lon
+    if west < -180:
+        return box & (Q(longitude__gte=west + 360) | Q(longitude__lte=east))
+    if east > 180:
+        return box & (Q(longitude__gte=west) | Q(longitude__lte=east - 360))
+    return box & Q(longitude__gte=west, longitude__lte=east)
+
+
+def distance_expression(lat, lon):
+    """SQL haversine distance in kilometres from (lat, lon) to each row"""
+    lat1, lon1 = Radians(Value(float(lat))), Radians(Value(float(lon)))
+    lat2 = Radians(Cast(F('latitude'), FloatField()))
+    lon2 = Radians(Cast(F('longitude'), FloatField()))
+    a = (
+        Power(Sin((lat2 - lat1) / 2), 2)
+        + Cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    )
+    # Least() guards asin against rounding just above 1
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)))
+
+
+def within(queryset, lat, lon, radius_km=DEFAULT_RADIUS_KM):
+    """Rows of ``queryset`` within ``radius_km`` of (lat, lon), nearest first, with ``distance_km``"""
+    return queryset.filter(bounding_box(lat, lon, radius_km)).annotate(
+        distance_km=distance_expression(lat, lon)
+    ).filter(distance_km__lte=radius_km).order_by('distance_km', 'pk')
+
+
+def nearest(queryset, lat, lon, limit=DEFAULT_LIMIT, max_radius_km=MAX_DISTANCE_KM,
+            start_radius_km=DEFAULT_RADIUS_KM):
+    """
+    Return a list of the ``limit`` rows nearest to (lat, lon), with ``distance_km``.
+
+    Searches circles of four times the radius each round, from
+    ``start_radius_km`` until one holds ``limit`` rows or ``max_radius_km``
+    is reached, so dense areas only ever read a small box of the index.
+    """
+    radius = min(start_radius_km, max_radius_km)
+    while True:
+        rows = list(within(queryset, lat, lon, radius)[:limit])
+        if len(rows) >= limit or radius >= max_radius_km:
+            return rows
+        radius = min(radius * 4, max_radius_km)
@@ -0,0 +1,77 @@
+"""
+Deduplication of booking form submissions.
+
+BookingForm carries a random ``idempotency_key``, issued when the form is
+rendered. The key is stored in IdempotencyKey (unique per user) in the same
+transaction as the booking it created, so a double click, a browser retry
+or a replayed POST finds the original booking with one indexed lookup and
+redirects to it without writing anything. Two copies racing each other
+both get as far as inserting the key; the loser's transaction rolls back
+(booking and seats included) and it redirects to the winner's booking.
+Each key also stores a fingerprint of the submission; the same key sent
+with different details (a form edited after it was submitted) raises
+KeyReused rather than silently standing for the first booking.
+
+Keys only need to outlive retries. ``purge_expired`` deletes keys older
+than ``IDEMPOTENCY_KEY_TTL`` seconds in batches; run it from cron with the
+``purge_idempotency_keys`` command rather than on requests.
+"""
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+PURGE_BATCH_SIZE = 1000
+
+
+class KeyReused(Exception):
+    """The key already made a booking from a submission with different details"""
+
+
+def fingerprint(*values):
+    """Digest identifying a submission by the values it was made with"""
+    return hashlib.sha256(repr(values).encode()).hexdigest()
+
+
+def find_booking_id(user, key, fingerprint=''):
+    """ID of the booking ``user`` already made with ``key``, or None; raises KeyReused if made with other details"""
+    if key is None:
+        return None
+    stored = IdempotencyKey.objects.filter(key=key, user=user).values_list('booking_id', 'fingerprint').first()
+    if stored is None:
+        return None
+    booking_id, stored_fingerprint = stored
+    if fingerprint and stored_fingerprint and fingerprint != stored_fingerprint:
+        raise KeyReused(key)
+    return booking_id
+
+
+def remember(user, key, booking, fingerprint=''):
+    """Record that ``key`` created ``booking``; raises IntegrityError if it already did another"""
+    if key is not None:
+        IdempotencyKey.objects.create(key=key, user=user, booking=booking, fingerprint=fingerprint)
+
+
+def purge_expired(batch_size=PURGE_BATCH_SIZE, progress=None):
+    """
+    Delete keys past their TTL, ``batch_size`` rows per transaction so the
+    purge never holds long locks. ``progress(deleted)`` is called after each
+    batch. Returns the number of keys deleted.
+    """
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+    cutoff = timezone.now() - datetime.timedelta(seconds=ttl)
+    expired = IdempotencyKey.objects.filter(created_at__lt=cutoff).order_by('created_at')
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            # Nothing refers to a key, so this is a single DELETE
+            deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+        if progress:
+            progress(deleted)
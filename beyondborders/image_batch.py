@@ -0,0 +1,173 @@
+"""
+Parallel regeneration of image renditions for files already uploaded.
+
+The upload directories under MEDIA_ROOT are walked lazily and handed out in
+chunks to a pool of worker processes, which decode, resize, encode and
+store the renditions (see beyondborders.images). The parent process keeps
+the database side: per chunk it looks up which files already have
+renditions for the current spec, and it upserts the resulting
+ImageRenditionSet rows in batches.
+
+A worker always hashes the file, and skips decoding when the hash matches
+the one recorded for the current spec, so a rerun after an interruption,
+or after uploads were replaced in place, only does the missing work. At
+most ``workers * IN_FLIGHT_PER_WORKER`` files are in flight, so memory
+stays bounded however many files there are.
+
+This module only imports Django lazily so that worker processes started
+with the "spawn" method can load it before Django is set up.
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.bmp', '.tif', '.tiff')
+IN_FLIGHT_PER_WORKER = 4
+
+
+class RegenerationResult:
+    def __init__(self):
+        self.scanned = 0
+        self.current = 0
+        self.generated = 0
+        self.failed = []
+        self.files_written = 0
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        return self.scanned / self.seconds if self.seconds else 0.0
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+def _render(source, known_hash, spec):
+    """Worker: (source, outcome, bytes read, rendition set or error, files written)"""
+    from django.core.files.storage import default_storage
+
+    from . import images
+
+    try:
+        with default_storage.open(source, 'rb') as handle:
+            data = handle.read()
+        source_hash = images.content_hash(data)
+        if source_hash == known_hash:
+            return source, 'current', len(data), None, 0
+        width, height, variants = images.render_variants(data, source_hash, spec)
+        written = images.write_variants(variants)
+        return source, 'generated', len(data), images.rendition_set(source, source_hash, spec, width, height, variants), written
+    except Exception as exc:
+        return source, 'failed', 0, f'{type(exc).__name__}: {exc}', 0
+
+
+def upload_directories():
+    from .models import BlogPost, Destination
+
+    return [
+        str(model._meta.get_field(field).upload_to).strip('/')
+        for model, field in ((Destination, 'img'), (BlogPost, 'image'))
+    ]
+
+
+def iter_sources(directories=None):
+    """Storage names of the images under ``directories`` of MEDIA_ROOT, in a stable order"""
+    from django.conf import settings
+
+    from .images import RENDITION_DIR
+
+    root = settings.MEDIA_ROOT
+    for directory in directories or upload_directories():
+        for path, subdirectories, files in os.walk(os.path.join(root, directory)):
+            subdirectories.sort()
+            if os.path.relpath(path, root).split(os.sep)[0] == RENDITION_DIR:
+                subdirectories.clear()
+                continue
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.relpath(os.path.join(path, name), root).replace(os.sep, '/')
+
+
+def peak_memory_mb():
+    """(this process, largest worker) peak resident set size in MB"""
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    )
+
+
+def _pool(workers):
+    from django.db import connections
+
+    # Forked children must not share the parent's open connections
+    connections.close_all()
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context(method), initializer=_init_worker,
+    )
+
+
+def regenerate(workers, directories=None, force=False, chunk_size=100, progress=None):
+    """
+    Generate missing or outdated renditions for every uploaded image.
+
+    With ``force`` every file is decoded again; unchanged renditions are
+    still not rewritten. ``progress(result)`` is called after each chunk.
+    Returns a RegenerationResult.
+    """
+    from . import images
+    from .models import ImageRenditionSet
+
+    spec = images.spec_key()
+    result = RegenerationResult()
+    started = time.monotonic()
+    pending, rows = set(), []
+
+    def collect(futures):
+        for future in futures:
+            source, outcome, size, payload, written = future.result()
+            result.bytes_read += size
+            result.files_written += written
+            if outcome == 'current':
+                result.current += 1
+            elif outcome == 'generated':
+                result.generated += 1
+                rows.append(payload)
+            else:
+                result.failed.append((source, payload))
+
+    sources = iter_sources(directories)
+    with _pool(workers) as pool:
+        while True:
+            chunk = list(islice(sources, chunk_size))
+            if not chunk:
+                break
+            known = {} if force else dict(
+                ImageRenditionSet.objects.filter(source__in=chunk, spec=spec).values_list('source', 'content_hash')
+            )
+            for source in chunk:
+                while len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(_render, source, known.get(source), spec))
+            result.scanned += len(chunk)
+            # Record what is done so far, so an interrupted run keeps it
+            images.save_rendition_sets(rows)
+            rows.clear()
+            result.seconds = time.monotonic() - started
+            if progress:
+                progress(result)
+        collect(pending)
+        images.save_rendition_sets(rows)
+    result.seconds = time.monotonic() - started
+    return result
@@ -0,0 +1,249 @@
+"""
+Responsive renditions of uploaded images (Destination.img, BlogPost.image).
+
+Each source image is resized to every width in ``IMAGE_RENDITION_WIDTHS``
+that is smaller than the original (plus the original width, capped at the
+largest configured one), in every format in ``IMAGE_RENDITION_FORMATS``.
+The last format is the ``<img>`` fallback; JPEG becomes PNG for sources
+with transparency. Renditions are stored under ``renditions/`` with names
+built from the source's content hash and the rendition spec, so a URL
+never changes meaning and can be cached forever, and regenerating an
+unchanged image writes nothing.
+
+One ImageRenditionSet row per source records its hash, size and
+renditions. Each process keeps all rows in memory, keyed by source name
+and reloaded when the 'images' cache namespace version changes, so the
+``responsive_img`` template tag never queries per image.
+
+Renditions are generated by a background worker when a Destination or
+BlogPost is saved with an image that has none for the current spec (see
+rendition_queue), and for everything already uploaded by the
+``generate_image_renditions`` command (see image_batch). Until then, and
+for images that cannot be decoded, the tag renders the original.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import cache
+from .models import BlogPost, Destination, ImageRenditionSet
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'images'
+RENDITION_DIR = 'renditions'
+# How often a worker looks up the manifest version in the cache
+VERSION_CHECK_INTERVAL = 1.0
+
+DEFAULT_WIDTHS = (320, 640, 960, 1440)
+DEFAULT_FORMATS = ('avif', 'webp', 'jpeg')
+DEFAULT_QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80, 'png': None}
+
+EXIF_ORIENTATION = 0x0112
+# AVIF at the default speed takes ~10x longer for about the same size
+ENCODER_OPTIONS = {'avif': {'speed': 8}, 'jpeg': {'optimize': True, 'progressive': True}, 'png': {'optimize': True}}
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+
+
+def rendition_widths():
+    return tuple(sorted(getattr(settings, 'IMAGE_RENDITION_WIDTHS', DEFAULT_WIDTHS)))
+
+
+def rendition_formats():
+    return tuple(getattr(settings, 'IMAGE_RENDITION_FORMATS', DEFAULT_FORMATS))
+
+
+def rendition_quality(image_format):
+    return getattr(settings, 'IMAGE_RENDITION_QUALITY', DEFAULT_QUALITY).get(image_format)
+
+
+def spec_key():
+    """Short hash of the settings renditions depend on; changing any of them regenerates every image"""
+    spec = repr((rendition_widths(), rendition_formats(), [rendition_quality(f) for f in rendition_formats()]))
+    return hashlib.sha256(spec.encode()).hexdigest()[:8]
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def rendition_name(source_hash, spec, width, image_format):
+    return posixpath.join(RENDITION_DIR, source_hash[:2], f'{source_hash[:20]}-{spec}', f'{width}.{EXTENSIONS[image_format]}')
+
+
+def target_widths(original_width):
+    widths = rendition_widths()
+    targets = [width for width in widths if width < original_width]
+    # Never upscale; small originals get one rendition at their own width
+    targets.append(min(original_width, widths[-1]))
+    return sorted(set(targets))
+
+
+def render_variants(data, source_hash, spec=None):
+    """
+    Decode ``data`` and return (width, height, [(format, width, name, bytes)])
+    for every rendition. Pure function of its arguments, so it can run in a
+    worker process.
+    """
+    from PIL import Image, ImageOps
+
+    spec = spec or spec_key()
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        # EXIF orientations 5-8 are rotated by 90 degrees when displayed
+        if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # JPEGs decode straight at a reduced scale (never below the largest
+        # rendition), which bounds memory for very large originals
+        image.draft('RGB', (rendition_widths()[-1], rendition_widths()[-1]))
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        variants = []
+        # Largest first, each resized from the previous one: cheaper than
+        # always starting from the original and indistinguishable at these ratios
+        current = image
+        for target in sorted(target_widths(width), reverse=True):
+            if target != current.width:
+                current = current.resize((target, max(1, round(height * target / width))), Image.Resampling.LANCZOS)
+            for image_format in rendition_formats():
+                if image_format == 'jpeg' and has_alpha:
+                    image_format = 'png'
+                buffer = io.BytesIO()
+                options = dict(ENCODER_OPTIONS.get(image_format, {}))
+                quality = rendition_quality(image_format)
+                if quality is not None:
+                    options['quality'] = quality
+                current.save(buffer, format=image_format.upper(), **options)
+                variants.append((image_format, target, rendition_name(source_hash, spec, target, image_format), buffer.getvalue()))
+    return width, height, variants
+
+
+def write_variants(variants, storage=None):
+    """Store rendered variants that are not stored yet; returns the number of files written"""
+    storage = storage or default_storage
+    written = 0
+    for _, _, name, content in variants:
+        # Names are content-addressed, so an existing file already has these bytes
+        if not storage.exists(name):
+            storage.save(name, ContentFile(content))
+            written += 1
+    return written
+
+
+def save_rendition_sets(rows):
+    """
+    Upsert ImageRenditionSet rows, given as dicts of its fields, in one
+    statement and make every worker reload the manifest. Only the detail
+    pages (and the blog, if a post uses one of the images) showing them are
+    invalidated; cached listings pick the renditions up when they expire.
+    """
+    if not rows:
+        return
+    ImageRenditionSet.objects.bulk_create(
+        [ImageRenditionSet(**row) for row in rows],
+        update_conflicts=True, unique_fields=['source'],
+        update_fields=['content_hash', 'spec', 'width', 'height', 'renditions', 'updated_at'],
+    )
+    sources = [row['source'] for row in rows]
+    pks = Destination.objects.filter(img__in=sources).values_list('pk', flat=True)
+    namespaces = [NAMESPACE, *(f'destination:{pk}' for pk in pks)]
+    if BlogPost.objects.filter(image__in=sources).exists():
+        namespaces.append('blog')
+    cache.bump(*namespaces)
+
+
+def rendition_set(source, source_hash, spec, width, height, variants):
+    return {
+        'source': source, 'content_hash': source_hash, 'spec': spec, 'width': width, 'height': height,
+        'renditions': [[image_format, target, name] for image_format, target, name, _ in variants],
+        'updated_at': timezone.now(),
+    }
+
+
+def generate(source, storage=None):
+    """Generate the renditions of the stored image ``source``; returns the number of files written"""
+    storage = storage or default_storage
+    with storage.open(source, 'rb') as handle:
+        data = handle.read()
+    source_hash = content_hash(data)
+    spec = spec_key()
+    width, height, variants = render_variants(data, source_hash, spec)
+    written = write_variants(variants, storage)
+    save_rendition_sets([rendition_set(source, source_hash, spec, width, height, variants)])
+    return written
+
+
+class Manifest:
+    def __init__(self, entries, version=None):
+        self.entries = entries
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_database(cls, version=None):
+        rows = ImageRenditionSet.objects.only('source', 'spec', 'width', 'height', 'renditions')
+        return cls({row.source: row for row in rows.iterator(chunk_size=2000)}, version)
+
+    def get(self, source):
+        return self.entries.get(source)
+
+
+class _Holder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.checked_at = 0.0
+
+    def invalidate(self):
+        self.manifest = None
+
+    def get(self):
+        manifest, now = self.manifest, time.monotonic()
+        if manifest is not None and now - self.checked_at < VERSION_CHECK_INTERVAL:
+            return manifest
+        version = cache.namespace_versions([NAMESPACE])[0]
+        if manifest is not None and manifest.version == version:
+            self.checked_at = now
+            return manifest
+        with self.lock:
+            if self.manifest is None or self.manifest.version != version:
+                self.manifest = Manifest.from_database(version)
+            self.checked_at = now
+            return self.manifest
+
+
+manifest_holder = _Holder()
+
+
+def get_manifest():
+    return manifest_holder.get()
+
+
+def srcsets(source):
+    """
+    Return (width, height, [(mime type, srcset)], fallback url) for a stored
+    image, the fallback format last; None when it has no renditions yet.
+    """
+    entry = get_manifest().get(source)
+    if entry is None:
+        return None
+    by_format = {}
+    for image_format, width, name in sorted(entry.renditions, key=lambda rendition: rendition[1]):
+        by_format.setdefault(image_format, []).append((width, default_storage.url(name)))
+    sources = [
+        (MIME_TYPES[image_format], ', '.join(f'{url} {width}w' for width, url in renditions))
+        for image_format, renditions in by_format.items()
+    ]
+    # Browsers without srcset support get the largest fallback rendition
+    fallback = list(by_format.values())[-1][-1][1]
+    return entry.width, entry.height, sources, fallback
@@ -0,0 +1,142 @@
+"""
+Seat inventory per destination and travel date.
+
+Each (destination, travel date) pair has a DepartureInventory row with its
+capacity and the seats held by bookings that are not cancelled. Booking
+signals keep ``reserved`` in step with every Booking write, the way
+beyondborders.ratings keeps the rating aggregates: taking seats is one
+conditional UPDATE (``reserved + seats <= capacity``) on that row, so
+concurrent bookings for the same date queue on a single row lock and can
+never oversell, while other dates and destinations are not blocked. A
+booking that does not fit raises SoldOut before it is written.
+
+Rows are created on first use with the destination's ``seats_per_date`` as
+the capacity, counting any bookings made before the row existed; staff can
+change a date's capacity in the admin.
+
+The UPDATE needs no retry on its own, but a transaction can still lose a
+deadlock (a booking moved between dates touches two rows) or, on SQLite,
+find the database locked. ``atomic_with_retry`` reruns the whole
+transaction in those cases, and when ``reserve`` raises InventoryBusy: the
+seats were there every time it re-read the row but taken again before
+its UPDATE, which is contention rather than a sold-out date.
+"""
+import random
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F, Sum
+
+from .models import Booking, DepartureInventory, Destination
+
+MAX_ATTEMPTS = 5
+# UPDATEs reserve() tries within one transaction before raising InventoryBusy
+RESERVE_ATTEMPTS = 3
+# Seconds before the first retry; doubled (with jitter) for each further one
+RETRY_DELAY = 0.02
+
+
+class SoldOut(Exception):
+    def __init__(self, destination_id, travel_date, available):
+        self.destination_id = destination_id
+        self.travel_date = travel_date
+        self.available = available
+        super().__init__(f'{available} seat(s) left for destination {destination_id} on {travel_date}')
+
+
+class InventoryBusy(Exception):
+    def __init__(self, destination_id, travel_date):
+        self.destination_id = destination_id
+        self.travel_date = travel_date
+        super().__init__(f'Seats for destination {destination_id} on {travel_date} kept changing; try again')
+
+
+def _take(destination_id, travel_date, seats):
+    return DepartureInventory.objects.filter(
+        destination_id=destination_id, travel_date=travel_date, reserved__lte=F('capacity') - seats,
+    ).update(reserved=F('reserved') + seats)
+
+
+def _create_row(destination_id, travel_date):
+    """Create the row for a travel date, counting the seats of bookings made before it existed"""
+    held = Booking.objects.filter(
+        destination_id=destination_id, travel_date=travel_date,
+    ).exclude(status='cancelled').aggregate(seats=Sum('number_of_travelers'))['seats'] or 0
+    capacity = Destination.objects.values_list('seats_per_date', flat=True).get(pk=destination_id)
+    try:
+        with transaction.atomic():
+            DepartureInventory.objects.create(
+                destination_id=destination_id, travel_date=travel_date,
+                capacity=max(capacity, held), reserved=held,
+            )
+    except IntegrityError:
+        # Another booking created it first
+        pass
+
+
+def reserve(destination_id, travel_date, seats):
+    """
+    Take ``seats`` on a travel date, or raise SoldOut leaving the inventory
+    unchanged. Raises InventoryBusy when the seats were free whenever the row
+    was read, yet gone by the next UPDATE.
+    """
+    for _ in range(RESERVE_ATTEMPTS):
+        if _take(destination_id, travel_date, seats):
+            return
+        row = DepartureInventory.objects.filter(destination_id=destination_id, travel_date=travel_date).first()
+        if row is None:
+            _create_row(destination_id, travel_date)
+        elif row.available < seats:
+            raise SoldOut(destination_id, travel_date, row.available)
+        # Otherwise seats were released after the UPDATE looked; try again
+    raise InventoryBusy(destination_id, travel_date)
+
+
+def release(destination_id, travel_date, seats):
+    """Give back ``seats``; dates without an inventory row never counted them"""
+    DepartureInventory.objects.filter(
+        destination_id=destination_id, travel_date=travel_date, reserved__gte=seats,
+    ).update(reserved=F('reserved') - seats)
+
+
+def move(old, new):
+    """
+    Apply a change of held seats, each an (destination_id, travel_date, seats)
+    tuple or None. Raises SoldOut when ``new`` does not fit; run it in a
+    transaction so a release made before that is rolled back too.
+    """
+    if old == new:
+        return
+    if old and new and old[:2] == new[:2]:
+        if new[2] > old[2]:
+            reserve(new[0], new[1], new[2] - old[2])
+        else:
+            release(old[0], old[1], old[2] - new[2])
+        return
+    # Touch the two rows in a fixed order so opposite moves can't deadlock
+    changes = sorted(
+        [(held[:2], kind, held[2]) for kind, held in (('release', old), ('reserve', new)) if held],
+        key=lambda change: (change[0][0], str(change[0][1])),
+    )
+    for (destination_id, travel_date), kind, seats in changes:
+        if kind == 'reserve':
+            reserve(destination_id, travel_date, seats)
+        else:
+            release(destination_id, travel_date, seats)
+
+
+def atomic_with_retry(func, attempts=MAX_ATTEMPTS):
+    """
+    Run ``func()`` in a transaction, rerunning it after a deadlock, lock
+    timeout or InventoryBusy. Inside an outer transaction there is nothing
+    to retry, so errors propagate at once.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic():
+                return func()
+        except (OperationalError, InventoryBusy):
+            if attempt == attempts or transaction.get_connection().in_atomic_block:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
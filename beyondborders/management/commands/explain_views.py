@@ -0,0 +1,80 @@
+import re
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from beyondborders import views
+from beyondborders.models import Destination
+
+# Plan lines that mean a whole table is read row by row
+SEQUENTIAL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (?P<table>\S+)'),
+    'sqlite': re.compile(r'\bSCAN (?P<table>\w+)(?! USING)(?:$|\s)'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the page queries of the shipped listing views and flag '
+        'sequential scans. Run against production-sized data: on small '
+        'tables the planner legitimately prefers sequential scans.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fail', action='store_true',
+            help='Exit with an error if any query plan contains a sequential scan',
+        )
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Print the full plan of every query',
+        )
+
+    def handle(self, *args, **options):
+        pattern = SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f'EXPLAIN checks are not supported on {connection.vendor}')
+
+        flagged = []
+        for label, queryset in self._view_queries():
+            plan = queryset.explain()
+            scans = sorted({match.group('table') for match in pattern.finditer(plan)})
+            if scans:
+                flagged.append(label)
+                self.stdout.write(self.style.WARNING(f'SEQ  {label}: sequential scan on {", ".join(scans)}'))
+            else:
+                self.stdout.write(f'ok   {label}')
+            if options['verbose_plans'] or scans:
+                for line in plan.splitlines():
+                    self.stdout.write(f'       {line}')
+
+        if flagged and options['fail']:
+            raise CommandError(f'{len(flagged)} quer{"y" if len(flagged) == 1 else "ies"} use sequential scans')
+
+    def _view_queries(self):
+        """Yield (label, page queryset) for each listing view as it would run"""
+        factory = RequestFactory()
+        user = User.objects.order_by('pk').first() or User(pk=1, username='explain')
+        location = Destination.objects.exclude(location=None).values_list('location', flat=True).first() or 'x'
+
+        def page(view_class, path, params=None, authenticated=False):
+            request = factory.get(path, params or {})
+            request.user = user if authenticated else AnonymousUser()
+            view = view_class()
+            view.setup(request)
+            queryset = view.get_queryset()
+            return queryset[:view.paginate_by]
+
+        yield 'index', Destination.objects.filter(offer=True).order_by('name')
+        yield 'destinations', page(views.DestinationListView, '/destinations/')
+        yield 'destinations ?max_price', page(views.DestinationListView, '/destinations/', {'max_price': 500})
+        yield 'destinations ?min_rating', page(views.DestinationListView, '/destinations/', {'min_rating': 4})
+        yield 'destinations ?location', page(views.DestinationListView, '/destinations/', {'location': location})
+        yield 'wishlist', page(views.WishlistView, '/wishlist/', authenticated=True)
+        yield 'my trips', page(views.MyTripsView, '/my-trips/', authenticated=True)
+        yield 'blog', page(views.BlogListView, '/blog/')
+        destination = Destination.objects.order_by('pk').first()
+        if destination is not None:
+            yield 'destination reviews', destination.reviews.all()[:10]
@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from beyondborders import bulk_io
+
+
+class Command(BaseCommand):
+    help = 'Stream every booking or review to a CSV or JSONL file (or stdout) in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(bulk_io.EXPORTS), help='What to export')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument(
+            '--format', choices=bulk_io.FORMATS,
+            help='Output format (default: from the output extension, CSV for stdout)',
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or (bulk_io.guess_format(output) if output else 'csv')
+        if output:
+            with open(output, 'w', newline='', encoding='utf-8') as stream:
+                count = bulk_io.export_rows(options['kind'], stream, file_format)
+            self.stderr.write(self.style.SUCCESS(f'Exported {count} {options["kind"]} to {output}'))
+        else:
+            bulk_io.export_rows(options['kind'], sys.stdout, file_format)
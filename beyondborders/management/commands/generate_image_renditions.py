@@ -0,0 +1,52 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders import image_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate responsive renditions for every uploaded image under MEDIA_ROOT in a pool '
+        'of processes, e.g. after changing IMAGE_RENDITION_WIDTHS or _FORMATS. Images whose '
+        'renditions are current (same content hash and settings) are skipped, so an '
+        'interrupted run can simply be started again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes (default: one per CPU)',
+        )
+        parser.add_argument(
+            '--directory', action='append', dest='directories', metavar='DIR',
+            help='Directory under MEDIA_ROOT to scan; may be repeated '
+                 f'(default: the upload directories, {", ".join(image_batch.upload_directories())})',
+        )
+        parser.add_argument('--force', action='store_true', help='Decode every image again, even if current')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Files per manifest lookup (default: 100)')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
+        result = image_batch.regenerate(
+            options['workers'], directories=options['directories'], force=options['force'],
+            chunk_size=options['chunk_size'],
+            progress=self._progress if options['verbosity'] > 1 else None,
+        )
+        for source, error in result.failed:
+            self.stderr.write(f'  {source}: {error}')
+        parent, worker = image_batch.peak_memory_mb()
+        self.stdout.write(
+            f'Scanned {result.scanned} images in {result.seconds:.1f}s ({result.rate:.1f}/s, '
+            f'{result.bytes_read / 1024 / 1024 / max(result.seconds, 1e-9):.1f} MB/s read): '
+            f'{result.generated} generated, {result.current} current, {len(result.failed)} failed, '
+            f'{result.files_written} files written'
+        )
+        self.stdout.write(f'Peak memory: {parent:.0f} MB main process, {worker:.0f} MB largest worker')
+        if result.failed:
+            raise CommandError(f'{len(result.failed)} image(s) could not be processed')
+        self.stdout.write(self.style.SUCCESS('Renditions are up to date'))
+
+    def _progress(self, result):
+        self.stdout.write(f'  {result.scanned} scanned, {result.generated} generated, {result.current} current')
@@ -0,0 +1,64 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders import bulk_io
+
+
+class Command(BaseCommand):
+    help = (
+        'Create or update destinations from a CSV or JSONL file, matched on name and location. '
+        f'Columns: {", ".join(bulk_io.IMPORT_FIELDS)}. Invalid rows are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument(
+            '--format', choices=bulk_io.FORMATS,
+            help='File format (default: from the extension; .jsonl/.ndjson are JSONL, anything else CSV)',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=bulk_io.DEFAULT_BATCH_SIZE,
+            help=f'Rows written per transaction (default: {bulk_io.DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Directory the img column is relative to; those files are copied into media storage',
+        )
+        parser.add_argument(
+            '--errors',
+            help='Also write invalid rows as JSON lines ({"line": ..., "errors": {...}}) to this file',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['images_dir'] and not os.path.isdir(options['images_dir']):
+            raise CommandError(f'{options["images_dir"]} is not a directory')
+        file_format = options['format'] or bulk_io.guess_format(options['path'])
+        errors_file = open(options['errors'], 'w', encoding='utf-8') if options['errors'] else None
+
+        def on_error(error):
+            self.stderr.write(str(error))
+            if errors_file:
+                errors_file.write(json.dumps({'line': error.line, 'errors': error.errors}) + '\n')
+
+        importer = bulk_io.DestinationImporter(
+            batch_size=options['batch_size'], images_dir=options['images_dir'], on_error=on_error,
+        )
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                result = importer.run(bulk_io.read_rows(stream, file_format))
+        except OSError as error:
+            raise CommandError(error)
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created} and updated {result.updated} destinations in {result.seconds:.1f}s '
+            f'({result.rows_per_second:,.0f} rows/s)'
+        ))
+        if result.invalid:
+            self.stdout.write(self.style.WARNING(f'Skipped {result.invalid} invalid row{"s" if result.invalid != 1 else ""}'))
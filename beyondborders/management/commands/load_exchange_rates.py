@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders.currency import read_rates, save_rates
+
+
+class Command(BaseCommand):
+    help = 'Load exchange rates from a JSON ({"base": ..., "rates": {...}}) or CSV (currency,rate) file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Rates file')
+        parser.add_argument(
+            '--format', choices=('json', 'csv'),
+            help='File format (default: from the file extension)',
+        )
+        parser.add_argument(
+            '--replace', action='store_true',
+            help='Delete stored rates for currencies the file does not list',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        try:
+            with open(path, encoding='utf-8', newline='') as stream:
+                rates = read_rates(stream, file_format)
+        except OSError as error:
+            raise CommandError(f'Cannot read {path}: {error.strerror}')
+        except (ValueError, KeyError) as error:
+            raise CommandError(f'{os.path.basename(path)}: {error}')
+        saved, deleted = save_rates(rates, replace=options['replace'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {saved} exchange rate{"s" if saved != 1 else ""}'
+            + (f', deleted {deleted}' if deleted else '')
+        ))
@@ -0,0 +1,168 @@
+import datetime
+import queue
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from beyondborders.models import Booking, DepartureInventory, Destination
+
+USER_PREFIX = 'booking-load-test'
+
+
+class Command(BaseCommand):
+    help = (
+        'Fire concurrent booking requests at book_destination for one travel date, '
+        'report throughput and latency, and fail if any seat was oversold or a booking '
+        'was refused while seats were left. Generates a destination and users that are '
+        'deleted afterwards; run it against a staging database, not production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent clients (default: 16)')
+        parser.add_argument('--requests', type=int, default=200, help='Booking requests in total (default: 200)')
+        parser.add_argument('--seats', type=int, default=100, help='Seats on the travel date (default: 100)')
+        parser.add_argument(
+            '--max-travelers', type=int, default=4,
+            help='Each request books 1 to this many travelers (default: 4)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the party sizes')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows for inspection')
+
+    def handle(self, *args, **options):
+        if min(options['clients'], options['requests'], options['seats'], options['max_travelers']) < 1:
+            raise CommandError('--clients, --requests, --seats and --max-travelers must be positive')
+        travel_date = datetime.date.today() + datetime.timedelta(days=365)
+        rng = random.Random(options['seed'])
+        jobs = queue.Queue()
+        for _ in range(options['requests']):
+            jobs.put(rng.randint(1, options['max_travelers']))
+
+        destination, users = self._seed(options['clients'], options['seats'])
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                results, elapsed = self._run(destination, users, travel_date, jobs)
+            self._report(results, elapsed, options['clients'])
+            failures = self._verify(destination, travel_date, results)
+        finally:
+            if options['keep']:
+                self.stdout.write(f'Kept destination #{destination.pk} and users {USER_PREFIX}-*')
+            else:
+                destination.delete()
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        if failures:
+            for failure in failures:
+                self.stdout.write(self.style.ERROR(f'FAIL {failure}'))
+            raise CommandError(f'{len(failures)} inventory check(s) failed')
+        self.stdout.write(self.style.SUCCESS('No overbooking: bookings, inventory and responses agree'))
+
+    def _seed(self, clients, seats):
+        destination = Destination.objects.create(
+            name='Booking load test', img='pics/placeholder.jpg', desc='Generated for load_test_bookings',
+            price=100, seats_per_date=seats,
+        )
+        users = User.objects.bulk_create([User(username=f'{USER_PREFIX}-{i}') for i in range(clients)])
+        return destination, users
+
+    def _run(self, destination, users, travel_date, jobs):
+        url = reverse('book_destination', args=[destination.pk])
+        results = []
+        # Log every client in before the clock starts, then release them together
+        start = threading.Barrier(len(users) + 1)
+        threads = [
+            threading.Thread(target=self._client, args=(user, url, travel_date, jobs, results, start))
+            for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def _client(self, user, url, travel_date, jobs, results, start):
+        try:
+            client = Client()
+            try:
+                client.force_login(user)
+            finally:
+                # Still release the others if logging in failed
+                start.wait()
+            while True:
+                try:
+                    travelers = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    response = client.post(url, {
+                        'travel_date': travel_date, 'number_of_travelers': travelers,
+                        'idempotency_key': uuid.uuid4(),
+                    })
+                    if response.status_code == 302:
+                        outcome = 'booked'
+                    elif b'left on this date' in response.content or b'sold out' in response.content:
+                        outcome = 'sold out'
+                    else:
+                        outcome = f'HTTP {response.status_code}'
+                except Exception as exc:
+                    outcome = type(exc).__name__
+                # list.append is atomic
+                results.append((outcome, travelers, time.perf_counter() - started))
+        finally:
+            connections.close_all()
+
+    def _report(self, results, elapsed, clients):
+        outcomes = {}
+        for outcome, _, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        latencies = sorted(latency * 1000 for _, _, latency in results)
+        self.stdout.write(
+            f'{len(results)} requests from {clients} clients in {elapsed:.2f}s: '
+            f'{len(results) / elapsed:.1f} requests/s'
+        )
+        self.stdout.write('  ' + ', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items())))
+        if latencies:
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(
+                f'  latency ms: median {statistics.median(latencies):.1f}, '
+                f'p95 {p95:.1f}, max {latencies[-1]:.1f}'
+            )
+
+    def _verify(self, destination, travel_date, results):
+        failures = []
+        booked = sum(travelers for outcome, travelers, _ in results if outcome == 'booked')
+        stored = Booking.objects.filter(
+            destination=destination, travel_date=travel_date,
+        ).aggregate(seats=Sum('number_of_travelers'))['seats'] or 0
+        row = DepartureInventory.objects.filter(destination=destination, travel_date=travel_date).first()
+        reserved, capacity = (row.reserved, row.capacity) if row else (0, destination.seats_per_date)
+        self.stdout.write(f'  seats: {stored} booked, {reserved} reserved, capacity {capacity}')
+
+        if stored > capacity:
+            failures.append(f'{stored} seats booked for a capacity of {capacity}')
+        if stored != reserved:
+            failures.append(f'inventory says {reserved} seats reserved, bookings hold {stored}')
+        if stored != booked:
+            failures.append(f'{booked} seats confirmed to clients, {stored} stored')
+        # Seats are only ever taken during the run, so a refusal is wrong if
+        # the request would still fit now
+        refused = [travelers for outcome, travelers, _ in results if outcome == 'sold out']
+        wrongly = [travelers for travelers in refused if travelers <= capacity - reserved]
+        if wrongly:
+            failures.append(f'{len(wrongly)} request(s) refused while {capacity - reserved} seats were left')
+        errors = [outcome for outcome, _, _ in results if outcome not in ('booked', 'sold out')]
+        if errors:
+            failures.append(f'{len(errors)} request(s) failed: {", ".join(sorted(set(errors)))}')
+        return failures
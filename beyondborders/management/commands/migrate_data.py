@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders import data_migration, sharded_migration
+from beyondborders.data_migration import BOOKINGS, DESTINATIONS, Shard
+
+DEFAULT_SHARD_SIZE = 100000
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy travello destinations and bookings into beyondborders in batches. '
+        'Progress is checkpointed per batch, so an interrupted run resumes where it stopped. '
+        'With --workers, primary-key range shards are copied in parallel processes and verified.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=data_migration.DEFAULT_BATCH_SIZE,
+            help=f'Rows written per transaction (default: {data_migration.DEFAULT_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=data_migration.DEFAULT_CHUNK_SIZE,
+            help=f'Rows fetched per round trip from the source tables (default: {data_migration.DEFAULT_CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Worker processes; more than one copies the tables in primary-key shards (default: 1)',
+        )
+        parser.add_argument(
+            '--shard-size', type=int,
+            help=f'Primary-key span of a shard; implies sharded mode (default with --workers: {DEFAULT_SHARD_SIZE}). '
+                 'Resume an interrupted run with the same value.',
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Compare row counts and checksums of source and copy afterwards (always done in sharded mode)',
+        )
+
+    def handle(self, *args, **options):
+        if min(options['batch_size'], options['chunk_size'], options['workers'], options['shard_size'] or 1) < 1:
+            raise CommandError('--batch-size, --chunk-size, --workers and --shard-size must be positive')
+        try:
+            if options['workers'] > 1 or options['shard_size']:
+                checks = self._sharded(options)
+            else:
+                checks = self._serial(options)
+        except data_migration.DataMigrationError as error:
+            raise CommandError(error)
+        if checks is not None:
+            self._report_checks(checks)
+
+    def _serial(self, options):
+        kwargs = {
+            'batch_size': options['batch_size'],
+            'chunk_size': options['chunk_size'],
+            'progress': self._progress if options['verbosity'] > 1 else None,
+        }
+        for stage in (data_migration.migrate_destinations, data_migration.migrate_bookings):
+            self._report(stage(**kwargs))
+        if options['verify']:
+            return [data_migration.verify(Shard(DESTINATIONS)), data_migration.verify(Shard(BOOKINGS))]
+        return None
+
+    def _sharded(self, options):
+        workers = options['workers']
+        shard_size = options['shard_size'] or DEFAULT_SHARD_SIZE
+        self.stdout.write(f'Copying in shards of {shard_size} IDs with {workers} worker{"s" if workers != 1 else ""}')
+        destinations, bookings, checks = sharded_migration.migrate_sharded(
+            workers, shard_size, options['batch_size'], options['chunk_size'],
+            progress=self._report if options['verbosity'] > 1 else None,
+        )
+        self._report(destinations)
+        self._report(bookings)
+        return checks
+
+    def _progress(self, result, last_source_id):
+        self.stdout.write(
+            f'  {result.name}: {result.copied} rows up to #{last_source_id} '
+            f'({result.rows_per_second:,.0f} rows/s)'
+        )
+
+    def _report(self, result):
+        message = f'{result.name}: copied {result.copied} rows in {result.seconds:.1f}s ({result.rows_per_second:,.0f} rows/s)'
+        if result.skipped:
+            message += f', skipped {result.skipped} without a copied destination'
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def _report_checks(self, checks):
+        failed = [check for check in checks if not check.ok]
+        for check in failed:
+            self.stdout.write(self.style.ERROR(
+                f'MISMATCH {check.shard}: source {check.source_count} rows ({check.source_checksum[:12]}), '
+                f'copy {check.target_count} rows ({check.target_checksum[:12]})'
+            ))
+        if failed:
+            raise CommandError(f'{len(failed)} of {len(checks)} shards do not match their source')
+        self.stdout.write(self.style.SUCCESS(f'Verified {len(checks)} shard{"s" if len(checks) != 1 else ""}: counts and checksums match'))
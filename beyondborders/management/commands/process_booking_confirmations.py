@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders.confirmations import BATCH_SIZE, enqueue_pending, process_batch, queue_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Worker that confirms queued bookings in batches. Runs until interrupted; '
+        'start as many as needed, they never take the same job.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help=f'Jobs per transaction (default: {BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to sleep when the queue is empty (default: 1.0)',
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument(
+            '--enqueue-pending', action='store_true',
+            help='First queue pending bookings that have no job, e.g. ones made before the worker existed',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['enqueue_pending']:
+            self.stdout.write(f'Queued {enqueue_pending()} pending bookings')
+        queued, waited = queue_stats()
+        self.stdout.write(f'{queued} jobs queued, oldest waiting {waited:.1f}s')
+
+        totals = {'jobs': 0, 'confirmed': 0, 'cancelled': 0, 'skipped': 0, 'busy': 0.0}
+        started = time.monotonic()
+        try:
+            while True:
+                result = process_batch(options['batch_size'])
+                if result.jobs:
+                    for name in ('jobs', 'confirmed', 'cancelled', 'skipped'):
+                        totals[name] += getattr(result, name)
+                    totals['busy'] += result.duration
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'  {result}')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        rate = totals['jobs'] / totals['busy'] if totals['busy'] else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {totals["jobs"]} jobs in {time.monotonic() - started:.1f}s: '
+            f'{totals["confirmed"]} confirmed, {totals["cancelled"]} cancelled, {totals["skipped"]} skipped '
+            f'({rate:.0f} jobs/s while busy)'
+        ))
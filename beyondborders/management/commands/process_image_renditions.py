@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders.rendition_queue import BATCH_SIZE, process_batch, queue_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Worker that generates renditions for newly uploaded images. Runs until interrupted; '
+        'start as many as needed, they never take the same job.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE,
+            help=f'Jobs claimed at a time (default: {BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to sleep when the queue is empty (default: 1.0)',
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        queued, waited = queue_stats()
+        self.stdout.write(f'{queued} images queued, oldest waiting {waited:.1f}s')
+
+        processed = 0
+        started = time.monotonic()
+        try:
+            while True:
+                done = process_batch(options['batch_size'])
+                if done:
+                    processed += done
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'  {processed} images processed')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} images in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders.idempotency import PURGE_BATCH_SIZE, purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete booking idempotency keys older than IDEMPOTENCY_KEY_TTL; meant to run from cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PURGE_BATCH_SIZE,
+            help=f'Keys deleted per transaction (default: {PURGE_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        deleted = purge_expired(
+            batch_size=options['batch_size'],
+            progress=self._progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired key{"s" if deleted != 1 else ""}'))
+
+    def _progress(self, deleted):
+        self.stdout.write(f'  {deleted} keys deleted')
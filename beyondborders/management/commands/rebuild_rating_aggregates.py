@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from beyondborders.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating sum/count/average and star histogram for every destination'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of destinations written per bulk update (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        reviewed = rebuild_rating_aggregates(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt rating aggregates ({reviewed} reviewed destination{"s" if reviewed != 1 else ""})'
+        ))
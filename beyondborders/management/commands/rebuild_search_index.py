@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from beyondborders import search_index
+from beyondborders.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents for every destination'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} destination{"s" if indexed != 1 else ""}'))
+
+        if search_index.is_enabled():
+            index = search_index.index_holder.rebuild(compact=True)
+            self.stdout.write(self.style.SUCCESS(
+                f'Built in-memory index: {len(index.documents)} documents, '
+                f'{len(index.vocabulary)} terms, ~{index.estimated_bytes // 1024} KiB'
+                + ('' if index.complete else ' (memory cap reached, index incomplete)')
+            ))
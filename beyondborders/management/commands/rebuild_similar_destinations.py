@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders.similarity import DEFAULT_TOP_K, rebuild_similar_destinations
+
+
+class Command(BaseCommand):
+    help = 'Precompute the "you may also like" destinations shown on every destination page'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=DEFAULT_TOP_K,
+            help=f'Similar destinations stored per destination (default: {DEFAULT_TOP_K})',
+        )
+        parser.add_argument(
+            '--destination', type=int, action='append', dest='destination_ids', metavar='ID',
+            help='Only rank this destination; may be repeated',
+        )
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1:
+            raise CommandError('--top-k must be positive')
+        started = time.monotonic()
+        ranked = rebuild_similar_destinations(
+            k=options['top_k'], destination_ids=options['destination_ids'],
+            progress=self._progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Ranked {ranked} destination{"s" if ranked != 1 else ""} '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+
+    def _progress(self, done, total):
+        self.stdout.write(f'  {done}/{total} destinations')
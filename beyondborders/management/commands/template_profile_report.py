@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from beyondborders import template_profiling
+
+KINDS = ('template', 'include', 'block', 'variable')
+
+
+class Command(BaseCommand):
+    help = (
+        'Sum up the template render profiles appended to TEMPLATE_PROFILE_DUMP '
+        '(with TEMPLATE_PROFILING on) and list the hot spots, slowest per request first: '
+        'templates by self time, includes, blocks and variables by total time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump', nargs='?', help='Profile file (default: TEMPLATE_PROFILE_DUMP)')
+        parser.add_argument('--limit', type=int, default=20, help='Rows per kind (default: 20)')
+        parser.add_argument('--kind', choices=KINDS, action='append', help='Only show this kind; may be repeated')
+
+    def handle(self, *args, **options):
+        path = options['dump'] or getattr(settings, 'TEMPLATE_PROFILE_DUMP', None)
+        if not path:
+            raise CommandError('Pass a profile file or set TEMPLATE_PROFILE_DUMP')
+        try:
+            with open(path, encoding='utf-8') as handle:
+                requests, total, rows = template_profiling.summarize(handle)
+        except FileNotFoundError:
+            raise CommandError(f'{path} does not exist; is TEMPLATE_PROFILING on?')
+        if not requests:
+            raise CommandError(f'{path} holds no profiles')
+
+        self.stdout.write(f'{requests} requests, {total / requests:.2f} ms rendering per request')
+        for kind in options['kind'] or KINDS:
+            selected = [row for row in rows if row['kind'] == kind][:options['limit']]
+            if not selected:
+                continue
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'\n{kind}s by {"self" if kind == "template" else "total"} time'
+            ))
+            self.stdout.write(f'{"ms/request":>10} {"share":>6} {"calls/request":>13}  name')
+            for row in selected:
+                share = row['per_request_ms'] / (total / requests) if total else 0
+                where = f'  ({row["template"]})' if row['template'] else ''
+                self.stdout.write(
+                    f'{row["per_request_ms"]:>10.3f} {share:>6.1%} {row["calls"] / requests:>13.1f}  {row["name"]}{where}'
+                )
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import template_profiling
+from .currency import get_currency
+from .file_serving import find_file, serve
+
+
+class CurrencyMiddleware:
+    """Set ``request.currency``, the currency the visitor sees prices in"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.currency = get_currency(request)
+        return self.get_response(request)
+
+
+class FileServingMiddleware:
+    """Serve files under STATIC_URL and MEDIA_URL (see beyondborders.file_serving)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD'):
+            static_file = find_file(request.path_info)
+            if static_file is not None:
+                response = serve(request, static_file)
+                if response is not None:
+                    return response
+        return self.get_response(request)
+
+
+class TemplateProfilingMiddleware:
+    """Time each request's template rendering when TEMPLATE_PROFILING is on (see beyondborders.template_profiling)"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TEMPLATE_PROFILING', False):
+            raise MiddlewareNotUsed
+        template_profiling.install()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile, token = template_profiling.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            template_profiling.stop(token)
+        if profile.entries:
+            response['Server-Timing'] = profile.server_timing()
+            template_profiling.dump(profile, request, response)
+        return response
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:35
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'beyondborders_destination_fts'
+
+
+def create_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX beyondborders_destination_search_gin '
+            'ON beyondborders_destination USING gin (search_vector)'
+        )
+        schema_editor.execute(
+            "UPDATE beyondborders_destination SET search_vector = "
+            "setweight(to_tsvector('english', COALESCE(name, '')), 'A') || "
+            "setweight(to_tsvector('english', COALESCE(location, '')), 'B') || "
+            "setweight(to_tsvector('english', COALESCE(\"desc\", '')), 'C')"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+            f'name, location, "desc", tokenize = \'porter unicode61\')'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, location, "desc") '
+            f'SELECT id, name, COALESCE(location, \'\'), "desc" FROM beyondborders_destination'
+        )
+
+
+def drop_search_backend(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS beyondborders_destination_search_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0003_destination_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.CreateModel(
+            name='DestinationSearchDocument',
+            fields=[
+                ('destination', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='beyondborders.destination')),
+                ('document', models.TextField(db_column='beyondborders_destination_fts')),
+            ],
+            options={
+                'db_table': 'beyondborders_destination_fts',
+                'managed': False,
+            },
+        ),
+    ]
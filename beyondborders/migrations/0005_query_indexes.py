@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0004_destination_search_document'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogpost',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-created_at', '-id'], name='blogpost_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='booking_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(fields=['-offer', 'name', 'id'], name='dest_offer_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(condition=models.Q(('offer', True)), fields=['name'], name='dest_offers_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(fields=['price'], name='dest_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(fields=['rating_avg'], name='dest_rating_avg_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['destination', '-created_at'], name='review_dest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wishlist',
+            index=models.Index(fields=['user', '-added_at', '-id'], name='wishlist_user_added_idx'),
+        ),
+    ]
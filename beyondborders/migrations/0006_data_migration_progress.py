@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0005_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataMigrationCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('last_source_id', models.BigIntegerField(default=0)),
+                ('rows_copied', models.BigIntegerField(default=0)),
+                ('rows_skipped', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LegacyDestination',
+            fields=[
+                ('source_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beyondborders.destination')),
+            ],
+        ),
+    ]
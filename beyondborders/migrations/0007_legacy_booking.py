@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0006_data_migration_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LegacyBooking',
+            fields=[
+                ('source_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beyondborders.booking')),
+            ],
+        ),
+    ]
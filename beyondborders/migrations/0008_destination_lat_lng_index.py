@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0007_legacy_booking'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(fields=['latitude', 'longitude'], name='dest_lat_lng_idx'),
+        ),
+    ]
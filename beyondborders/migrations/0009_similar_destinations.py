@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0008_destination_lat_lng_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarDestination',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_destinations', to='beyondborders.destination')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beyondborders.destination')),
+            ],
+            options={
+                'ordering': ['destination', 'rank'],
+                'unique_together': {('destination', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0010_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='seats_per_date',
+            field=models.PositiveIntegerField(default=50),
+        ),
+        migrations.CreateModel(
+            name='DepartureInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('travel_date', models.DateField()),
+                ('capacity', models.PositiveIntegerField()),
+                ('reserved', models.PositiveIntegerField(default=0)),
+                ('destination', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory', to='beyondborders.destination')),
+            ],
+            options={
+                'verbose_name_plural': 'departure inventory',
+                'constraints': [models.CheckConstraint(condition=models.Q(('reserved__lte', models.F('capacity'))), name='inventory_not_overbooked')],
+                'unique_together': {('destination', 'travel_date')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingConfirmationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beyondborders.booking')),
+            ],
+        ),
+    ]
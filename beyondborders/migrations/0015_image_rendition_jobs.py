@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beyondborders', '0014_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageRenditionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('enqueued_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_by', models.CharField(blank=True, default='', max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
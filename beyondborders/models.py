@@ -1,10 +1,19 @@
+from decimal import Decimal
+
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
 # Create your models here.
 
+# Destination columns rendered by the listing cards (destinations, search, wishlist)
+DESTINATION_CARD_FIELDS = (
+    'id', 'name', 'img', 'desc', 'price', 'offer', 'location', 'currency',
+    'rating_avg', 'rating_count',
+)
+
 class Destination(models.Model):
     name = models.CharField(max_length=100)
     img = models.ImageField(upload_to='pics')
@@ -16,20 +25,66 @@ class Destination(models.Model):
     latitude = models.DecimalField(max_digits=10, decimal_places=8, blank=True, null=True)
     longitude = models.DecimalField(max_digits=11, decimal_places=8, blank=True, null=True)
     currency = models.CharField(max_length=3, default='USD')
+    # Capacity of each travel date's DepartureInventory row when it is created
+    seats_per_date = models.PositiveIntegerField(default=50)
+    # Denormalized rating aggregates, maintained by beyondborders.ratings
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    # Weighted full-text document (PostgreSQL only), maintained by beyondborders.search
+    search_vector = SearchVectorField(null=True, editable=False)
     
     def __str__(self):
         return self.name
     
     def average_rating(self):
-        """Calculate average rating for this destination"""
-        reviews = self.reviews.all()
-        if reviews:
-            return sum(review.rating for review in reviews) / len(reviews)
-        return 0
+        """Return the stored average rating for this destination"""
+        return self.rating_avg
+    average_rating.admin_order_field = 'rating_avg'
     
     def review_count(self):
-        """Return total number of reviews"""
-        return self.reviews.count()
+        """Return the stored total number of reviews"""
+        return self.rating_count
+    review_count.admin_order_field = 'rating_count'
+    
+    def rating_histogram(self):
+        """Return review counts per star, keyed 1 to 5"""
+        return {stars: getattr(self, f'rating_{stars}_count') for stars in range(1, 6)}
+    
+    class Meta:
+        indexes = [
+            # Listing order: special offers first, then alphabetical
+            models.Index(fields=['-offer', 'name', 'id'], name='dest_offer_name_idx'),
+            # Home page: offers only, alphabetical
+            models.Index(fields=['name'], condition=models.Q(offer=True), name='dest_offers_name_idx'),
+            models.Index(fields=['price'], name='dest_price_idx'),
+            models.Index(fields=['rating_avg'], name='dest_rating_avg_idx'),
+            # Nearby search: bounding-box range scans (beyondborders.geo)
+            models.Index(fields=['latitude', 'longitude'], name='dest_lat_lng_idx'),
+            # Price filters in the visitor's currency: one range per source currency
+            models.Index(fields=['currency', 'price'], name='dest_currency_price_idx'),
+        ]
+
+class DestinationSearchDocument(models.Model):
+    """
+    A destination's row in the SQLite FTS5 table kept by beyondborders.search.
+    Unmanaged and SQLite only: it lets search join the table and rank in SQL.
+    """
+    destination = models.OneToOneField(
+        Destination, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_document',
+    )
+    # FTS5's hidden column named after the table: the left side of MATCH and
+    # the first argument of bm25() and snippet()
+    document = models.TextField(db_column='beyondborders_destination_fts')
+    
+    class Meta:
+        managed = False
+        db_table = 'beyondborders_destination_fts'
 
 class Booking(models.Model):
     STATUS_CHOICES = [
@@ -48,8 +103,27 @@ class Booking(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.destination.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the seats held as stored so the inventory can apply a delta on save
+        fields = ('destination_id', 'travel_date', 'number_of_travelers', 'status')
+        if all(field in instance.__dict__ for field in fields):
+            instance._loaded_seats = instance.held_seats()
+        return instance
+    
+    def held_seats(self):
+        """(destination_id, travel_date, seats) this booking takes from the inventory, or None when cancelled"""
+        if self.status == 'cancelled':
+            return None
+        return (self.destination_id, self.travel_date, self.number_of_travelers)
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # My Trips: a user's bookings, newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='booking_user_created_idx'),
+        ]
 
 class Review(models.Model):
     """User reviews for destinations"""
@@ -66,9 +140,23 @@ class Review(models.Model):
     class Meta:
         unique_together = ('user', 'destination')  # One review per user per destination
         ordering = ['-created_at']
+        indexes = [
+            # Latest reviews on the destination detail page
+            models.Index(fields=['destination', '-created_at'], name='review_dest_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.destination.name} ({self.rating}/5)"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so rating aggregates can apply a delta on save
+        # (when deferred, the pre_save signal looks them up instead)
+        if 'rating' in instance.__dict__ and 'destination_id' in instance.__dict__:
+            instance._loaded_rating = instance.rating
+            instance._loaded_destination_id = instance.destination_id
+        return instance
 
 class Wishlist(models.Model):
     """User wishlist for destinations"""
@@ -79,6 +167,10 @@ class Wishlist(models.Model):
     class Meta:
         unique_together = ('user', 'destination')  # One wishlist entry per user per destination
         ordering = ['-added_at']
+        indexes = [
+            # Wishlist page: a user's entries, newest first
+            models.Index(fields=['user', '-added_at', '-id'], name='wishlist_user_added_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.destination.name}"
@@ -96,6 +188,140 @@ class BlogPost(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Blog listing only ever reads published posts, newest first
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(is_published=True),
+                name='blogpost_published_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.title
+
+class DataMigrationCheckpoint(models.Model):
+    """Progress of a resumable data copy (see beyondborders.data_migration)"""
+    key = models.CharField(max_length=100, unique=True)
+    last_source_id = models.BigIntegerField(default=0)
+    rows_copied = models.BigIntegerField(default=0)
+    rows_skipped = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.key} (after #{self.last_source_id})"
+
+class LegacyDestination(models.Model):
+    """Maps a travello destination ID to the Destination it was copied to"""
+    source_id = models.BigIntegerField(primary_key=True)
+    destination = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='+')
+    
+    def __str__(self):
+        return f"travello #{self.source_id} -> {self.destination_id}"
+
+class LegacyBooking(models.Model):
+    """Maps a travello booking ID to the Booking it was copied to"""
+    source_id = models.BigIntegerField(primary_key=True)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='+')
+    
+    def __str__(self):
+        return f"travello #{self.source_id} -> {self.booking_id}"
+
+class SimilarDestination(models.Model):
+    """One entry of a destination's precomputed "you may also like" list (see beyondborders.similarity)"""
+    destination = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='similar_destinations')
+    similar = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    
+    class Meta:
+        # The detail page reads one destination's entries in rank order off this index
+        unique_together = ('destination', 'rank')
+        ordering = ['destination', 'rank']
+    
+    def __str__(self):
+        return f"{self.destination_id} -> {self.similar_id} (#{self.rank})"
+
+class ExchangeRate(models.Model):
+    """Units of ``currency`` per one unit of settings.BASE_CURRENCY (see beyondborders.currency)"""
+    currency = models.CharField(max_length=3, unique=True)
+    rate = models.DecimalField(max_digits=20, decimal_places=10, validators=[MinValueValidator(Decimal('0.0000000001'))])
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['currency']
+    
+    def __str__(self):
+        return f"{self.currency} {self.rate}"
+
+class DepartureInventory(models.Model):
+    """Seats on one travel date of a destination (see beyondborders.inventory)"""
+    destination = models.ForeignKey(Destination, on_delete=models.CASCADE, related_name='inventory')
+    travel_date = models.DateField()
+    capacity = models.PositiveIntegerField()
+    reserved = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('destination', 'travel_date')
+        verbose_name_plural = 'departure inventory'
+        constraints = [
+            models.CheckConstraint(condition=models.Q(reserved__lte=models.F('capacity')), name='inventory_not_overbooked'),
+        ]
+    
+    def __str__(self):
+        return f"{self.destination} on {self.travel_date}: {self.reserved}/{self.capacity}"
+    
+    @property
+    def available(self):
+        return max(self.capacity - self.reserved, 0)
+
+class IdempotencyKey(models.Model):
+    """A booking form submission already handled (see beyondborders.idempotency)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.UUIDField()
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='+')
+    # Digest of the submission that used the key, to refuse it for different details
+    fingerprint = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        # Also the index for the lookup on every booking submission
+        unique_together = ('user', 'key')
+    
+    def __str__(self):
+        return f"{self.key} -> booking #{self.booking_id}"
+
+class BookingConfirmationJob(models.Model):
+    """A booking waiting for the confirmation worker (see beyondborders.confirmations)"""
+    booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='+')
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    # Claim token of the worker processing it (SQLite only; PostgreSQL uses row locks)
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    
+    def __str__(self):
+        return f"confirm booking #{self.booking_id}"
+
+class ImageRenditionSet(models.Model):
+    """The resized renditions of one uploaded image (see beyondborders.images)"""
+    source = models.CharField(max_length=255, unique=True)
+    content_hash = models.CharField(max_length=64)
+    # Hash of the rendition settings the files were made with
+    spec = models.CharField(max_length=16)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    # [[format, width, storage name], ...]
+    renditions = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.source} ({len(self.renditions)} renditions)"
+
+class ImageRenditionJob(models.Model):
+    """An uploaded image waiting for the rendition worker (see beyondborders.rendition_queue)"""
+    source = models.CharField(max_length=255, unique=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    # Claim token of the worker encoding it, and when it was claimed
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    
+    def __str__(self):
+        return f"renditions of {self.source}"
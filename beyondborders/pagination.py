@@ -0,0 +1,183 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``OFFSET n`` plus a ``COUNT(*)`` per request, each page is fetched
+with a WHERE clause that continues after the last row of the previous page
+in the listing's ordering. Cursors are signed, opaque tokens holding that
+row's ordering values and a direction.
+
+Listing views opt in through KeysetPaginationMixin; the mode is switched on
+with ``settings.KEYSET_PAGINATION`` and otherwise falls back to Django's
+offset Paginator.
+"""
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+CURSOR_SALT = 'beyondborders.pagination'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _split(ordering):
+    """Return [(field name, descending)] for an ordering like ('-offer', 'name')"""
+    return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+def _keyset_filter(keys, values, forward):
+    """
+    Build the "comes after this row" condition for a multi-column ordering.
+
+    For keys (a, b, c) that is: a > x OR (a = x AND b > y) OR (a = x AND
+    b = y AND c > z), with > flipped to < for descending columns and again
+    when walking backwards.
+    """
+    condition = Q()
+    equal = Q()
+    for (name, descending), value in zip(keys, values):
+        after = descending != forward
+        condition |= equal & Q(**{f'{name}__{"gt" if after else "lt"}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPage:
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.keys = _split(self.ordering)
+
+    def _encode(self, obj, direction):
+        values = [getattr(obj, name) for name, _ in self.keys]
+        payload = {'v': values, 'd': direction}
+        return signing.dumps(payload, salt=CURSOR_SALT, compress=True, serializer=_CursorSerializer)
+
+    def _decode(self, cursor):
+        try:
+            payload = signing.loads(cursor, salt=CURSOR_SALT, serializer=_CursorSerializer)
+            values, direction = payload['v'], payload['d']
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        if direction not in ('next', 'prev') or len(values) != len(self.keys):
+            raise InvalidCursor(cursor)
+        model = self.queryset.model
+        decoded = []
+        for (name, _), value in zip(self.keys, values):
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except FieldDoesNotExist:
+                pass  # annotations such as search_rank are plain JSON values
+            except ValidationError:
+                raise InvalidCursor(cursor)
+            decoded.append(value)
+        return decoded, direction
+
+    def page(self, cursor=None):
+        """Return the page after (or before) ``cursor``; the first page when cursor is empty"""
+        queryset = self.queryset
+        forward = True
+        if cursor:
+            values, direction = self._decode(cursor)
+            forward = direction == 'next'
+            queryset = queryset.filter(_keyset_filter(self.keys, values, forward))
+
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = [('' if descending else '-') + name for name, descending in self.keys]
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows, None, None)
+        has_next = more if forward else True
+        has_previous = bool(cursor) if forward else more
+        return KeysetPage(
+            rows,
+            self._encode(rows[-1], 'next') if has_next else None,
+            self._encode(rows[0], 'prev') if has_previous else None,
+        )
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates to milliseconds, which would make
+        # rows created within the same millisecond fall between pages
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class _CursorSerializer:
+    def dumps(self, obj):
+        return _CursorEncoder(separators=(',', ':')).encode(obj).encode('latin-1')
+
+    def loads(self, data):
+        return signing.JSONSerializer().loads(data)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin that serves pages by cursor when KEYSET_PAGINATION is on.
+
+    Views set ``keyset_ordering`` (ending in a unique column) or override
+    ``get_keyset_ordering``. The page is exposed as ``page_obj`` with
+    ``is_keyset``, ``next_cursor`` and ``previous_cursor``; ``paginator`` is
+    None because no total is computed.
+    """
+    keyset_ordering = None
+    cursor_kwarg = 'cursor'
+
+    def keyset_enabled(self):
+        return getattr(settings, 'KEYSET_PAGINATION', False) and bool(self.get_keyset_ordering())
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset_enabled():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.get_keyset_ordering())
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (None, page, page.object_list, page.has_other_pages())
@@ -0,0 +1,49 @@
+"""
+Per-view query budgets.
+
+Listing views declare ``query_budget``, the maximum number of SQL queries a
+request (including template rendering) may issue regardless of page size:
+the whole request of a signed-in visitor with cold caches, as the tests in
+beyondborders.tests check at two page sizes. The mixin counts the view's own
+queries, which leaves out the session lookup done by middleware.
+``settings.QUERY_BUDGET_ENFORCEMENT`` selects what happens when a view goes
+over: ``'raise'`` fails the request, ``'warn'`` logs it, anything falsy turns
+the check off.
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudgetMixin:
+    query_budget = None
+
+    def dispatch(self, request, *args, **kwargs):
+        mode = getattr(settings, 'QUERY_BUDGET_ENFORCEMENT', None)
+        if not mode or self.query_budget is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = super().dispatch(request, *args, **kwargs)
+            # TemplateResponse renders lazily; render here so template N+1s count
+            if callable(getattr(response, 'render', None)):
+                response = response.render()
+
+        executed = len(queries)
+        if executed > self.query_budget:
+            message = (
+                f'{type(self).__name__} ran {executed} queries for {request.path} '
+                f'(budget {self.query_budget})'
+            )
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
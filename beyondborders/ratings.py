@@ -0,0 +1,112 @@
+"""
+Incremental maintenance of the denormalized rating aggregates on Destination.
+
+Listings read rating_avg / rating_count straight off the Destination row, so
+every Review write has to adjust those columns in the same transaction.
+Similarity scores use them too, so loaded similarity arrays are told which
+rows changed. Cached pages and card fragments showing a rating are
+invalidated by the Review signals, or by the rebuild for the rows it fixes.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from . import cache, similarity
+from .models import Destination, Review
+
+STARS = range(1, 6)
+
+
+def apply_rating_delta(destination_id, added=None, removed=None):
+    """
+    Adjust the stored aggregates of one destination.
+
+    ``added`` and ``removed`` are star ratings (1-5) or None. The update is a
+    single conditional UPDATE using F() expressions, so concurrent reviews on
+    the same destination never lose an increment.
+    """
+    if added is None and removed is None:
+        return
+    added = int(added) if added is not None else None
+    removed = int(removed) if removed is not None else None
+    if added == removed:
+        return
+
+    sum_delta = (added or 0) - (removed or 0)
+    count_delta = (added is not None) - (removed is not None)
+    updates = {}
+    if sum_delta:
+        updates['rating_sum'] = F('rating_sum') + sum_delta
+    if count_delta:
+        updates['rating_count'] = F('rating_count') + count_delta
+    if added is not None:
+        updates[f'rating_{added}_count'] = F(f'rating_{added}_count') + 1
+    if removed is not None:
+        updates[f'rating_{removed}_count'] = F(f'rating_{removed}_count') - 1
+
+    # The right-hand side of an UPDATE sees the pre-update row, so the new
+    # average is computed from the old columns plus the same deltas.
+    new_count = F('rating_count') + count_delta
+    updates['rating_avg'] = Case(
+        When(rating_count__lte=-count_delta, then=Value(0.0)),
+        default=Cast(F('rating_sum') + sum_delta, FloatField()) / new_count,
+        output_field=FloatField(),
+    )
+
+    Destination.objects.filter(pk=destination_id).update(**updates)
+    similarity.destination_arrays.changed(destination_id)
+
+
+def rebuild_rating_aggregates(batch_size=500):
+    """
+    Recompute every destination's aggregates from the Review table.
+
+    One grouped aggregate query feeds bulk_update in batches; destinations
+    without reviews are reset in a single UPDATE. The cached pages and card
+    fragments of destinations whose aggregates were wrong are invalidated.
+    Returns the number of destinations that have at least one review.
+    """
+    fields = ['rating_sum', 'rating_count', 'rating_avg'] + [f'rating_{stars}_count' for stars in STARS]
+    unreviewed = tuple(0 for _ in fields)
+    rows = (
+        Review.objects.order_by()
+        .values('destination_id')
+        .annotate(
+            total=Sum('rating'),
+            count=Count('id'),
+            **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in STARS}
+        )
+    )
+
+    with transaction.atomic():
+        stored = {
+            pk: tuple(values)
+            for pk, *values in Destination.objects.values_list('pk', *fields).iterator(chunk_size=batch_size)
+        }
+        Destination.objects.update(**{field: 0 for field in fields})
+        changed = {pk for pk, values in stored.items() if values != unreviewed}
+        batch = []
+        reviewed = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            destination = Destination(
+                pk=row['destination_id'],
+                rating_sum=row['total'],
+                rating_count=row['count'],
+                rating_avg=row['total'] / row['count'],
+                **{f'rating_{stars}_count': row[f'stars_{stars}'] for stars in STARS}
+            )
+            batch.append(destination)
+            reviewed += 1
+            if stored.get(destination.pk) == tuple(getattr(destination, field) for field in fields):
+                changed.discard(destination.pk)
+            else:
+                changed.add(destination.pk)
+            if len(batch) >= batch_size:
+                Destination.objects.bulk_update(batch, fields)
+                batch = []
+        if batch:
+            Destination.objects.bulk_update(batch, fields)
+        transaction.on_commit(similarity.destination_arrays.invalidate)
+        if changed:
+            cache.bump('destinations', *(f'destination:{pk}' for pk in changed))
+    return reviewed
@@ -0,0 +1,92 @@
+"""
+Background generation of image renditions for new uploads.
+
+Saving a Destination or BlogPost only looks its image up in the in-memory
+manifest (beyondborders.images); an image without renditions for the
+current spec gets an ImageRenditionJob row in the same transaction, so a
+rolled-back upload is never queued and the request never decodes or
+encodes anything. The ``process_image_renditions`` worker then generates
+the renditions, oldest job first.
+
+Encoding takes far longer than a transaction should stay open, so unlike
+the booking confirmation queue the worker claims a batch with a short
+conditional UPDATE (a token and a timestamp), commits, encodes, and then
+deletes each job it finished, or whose upload is missing or cannot be
+decoded. Any other error (storage, database) leaves the job claimed, and a
+claim older than ``CLAIM_TIMEOUT`` seconds, like that of a worker that
+died, is taken over, so the image is retried. Enqueueing an image that
+already has a job clears its claim, so an image replaced while a worker was
+encoding the old file is processed again.
+"""
+import datetime
+import logging
+import time
+import uuid
+
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from . import images
+from .models import ImageRenditionJob
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10
+CLAIM_TIMEOUT = 15 * 60
+
+
+def enqueue(*sources):
+    """Queue each of ``sources`` unless the manifest has renditions for it under the current spec"""
+    manifest, spec = images.get_manifest(), images.spec_key()
+    jobs = []
+    for source in dict.fromkeys(sources):
+        entry = manifest.get(source) if source else None
+        if source and (entry is None or entry.spec != spec):
+            jobs.append(ImageRenditionJob(source=source))
+    if jobs:
+        ImageRenditionJob.objects.bulk_create(
+            jobs, update_conflicts=True, unique_fields=['source'], update_fields=['claimed_by', 'claimed_at'],
+        )
+
+
+def claim(batch_size=BATCH_SIZE):
+    """Claim the oldest ``batch_size`` unclaimed (or abandoned) jobs; returns them"""
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    claimable = Q(claimed_by='') | Q(claimed_at__lt=now - datetime.timedelta(seconds=CLAIM_TIMEOUT))
+    with transaction.atomic():
+        pks = ImageRenditionJob.objects.filter(claimable).order_by('pk').values('pk')[:batch_size]
+        # Repeating the condition makes a concurrent claim of the same rows a no-op
+        ImageRenditionJob.objects.filter(claimable, pk__in=pks).update(claimed_by=token, claimed_at=now)
+    return list(ImageRenditionJob.objects.filter(claimed_by=token).order_by('pk'))
+
+
+def process_batch(batch_size=BATCH_SIZE):
+    """Generate renditions for up to ``batch_size`` queued images; returns the number of jobs done"""
+    from PIL import UnidentifiedImageError
+
+    jobs = claim(batch_size)
+    for job in jobs:
+        started = time.perf_counter()
+        # A missing or undecodable upload keeps being served as is
+        try:
+            images.generate(job.source)
+        except FileNotFoundError:
+            logger.warning('Could not generate renditions for %s: file not found', job.source)
+        except UnidentifiedImageError:
+            logger.warning('Could not generate renditions for %s: not a decodable image', job.source)
+        except Exception:
+            logger.warning('Renditions of %s failed, retrying in %ss', job.source, CLAIM_TIMEOUT, exc_info=True)
+            continue
+        # Left in place if it was enqueued again meanwhile (its claim was cleared)
+        ImageRenditionJob.objects.filter(pk=job.pk, claimed_by=job.claimed_by).delete()
+        logger.info('Renditions of %s: %.0fms', job.source, (time.perf_counter() - started) * 1000)
+    return len(jobs)
+
+
+def queue_stats():
+    """(queued jobs, seconds the oldest has waited)"""
+    stats = ImageRenditionJob.objects.aggregate(count=Count('pk'), oldest=Min('enqueued_at'))
+    waited = (timezone.now() - stats['oldest']).total_seconds() if stats['oldest'] else 0.0
+    return stats['count'], waited
@@ -0,0 +1,186 @@
+"""
+Full-text search over destinations.
+
+PostgreSQL keeps a weighted tsvector in Destination.search_vector (GIN
+indexed); SQLite keeps an FTS5 shadow table keyed by destination id, joined
+through the unmanaged DestinationSearchDocument model. Both rank by
+relevance in SQL, over every match, and return a highlighted snippet of the
+description. Other backends fall back to icontains filtering. Every query
+term is matched as a prefix, by each backend, so "lak" finds "Lake Bled"
+wherever the search runs.
+
+Setting ``SEARCH_BACKEND = 'memory'`` answers queries from the in-process
+inverted index in beyondborders.search_index instead. Its hits are ranked
+in Python and passed to SQL as a list, so only the best ``MAX_RESULTS`` of
+them are listed; a query matching more is logged.
+
+Snippets mark matches with HIGHLIGHT_START / HIGHLIGHT_STOP control
+characters so the text can be escaped before the ``highlight`` template
+filter turns them into <mark> tags.
+"""
+import logging
+import re
+
+from django.contrib.postgres.search import (
+    SearchHeadline, SearchQuery, SearchRank, SearchVector,
+)
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, Lookup, Q, TextField, Value, When
+from django.db.models.functions import Cast
+
+from .models import Destination, DestinationSearchDocument
+from . import search_index
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'beyondborders_destination_fts'
+SEARCH_CONFIG = 'english'
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+# Upper bound on ranked hits taken from the in-memory index
+MAX_RESULTS = 500
+# bm25() weights of the FTS columns: name, location, desc
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+@DestinationSearchDocument._meta.get_field('document').register_lookup
+class FullTextMatch(Lookup):
+    """``search_document__document__match=query``: an FTS5 MATCH, which also joins the table"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+def destination_search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('location', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('desc', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def index_destination(destination):
+    """Refresh the search document for one destination after it was saved"""
+    if connection.vendor == 'postgresql':
+        Destination.objects.filter(pk=destination.pk).update(search_vector=destination_search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [destination.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, location, "desc") VALUES (%s, %s, %s, %s)',
+                [destination.pk, destination.name, destination.location or '', destination.desc],
+            )
+
+
+def remove_destination(destination_id):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [destination_id])
+
+
+def rebuild_search_index():
+    """Rebuild every search document in bulk; returns the number of destinations indexed"""
+    if connection.vendor == 'postgresql':
+        return Destination.objects.update(search_vector=destination_search_vector())
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, location, "desc") '
+                f'SELECT id, name, COALESCE(location, \'\'), "desc" FROM {Destination._meta.db_table}'
+            )
+            return cursor.rowcount
+    return 0
+
+
+def search(queryset, query):
+    """
+    Restrict ``queryset`` to destinations matching ``query``.
+
+    Results are annotated with ``search_rank`` (higher is better) and
+    ``search_snippet``; callers order by ``-search_rank`` before any
+    tie-breakers.
+    """
+    terms = TOKEN_RE.findall(query.lower())
+    if not terms:
+        return _unranked(queryset).none()
+
+    if search_index.is_enabled():
+        hits = search_index.index_holder.search(query, limit=MAX_RESULTS + 1)
+        # None means the index hit its memory cap; use the database instead
+        if hits is not None:
+            if len(hits) > MAX_RESULTS:
+                logger.info('Search for %r matched more than %d destinations; listing the best of them', query, MAX_RESULTS)
+                hits = hits[:MAX_RESULTS]
+            return _ranked(queryset, [(pk, score, '') for pk, score in hits])
+
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(_prefix_tsquery(terms), search_type='raw', config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=search_query).annotate(
+            # ts_rank() is float4; widen it so cursor pagination can compare
+            # the rank it read back for equality
+            search_rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()),
+            search_snippet=SearchHeadline(
+                'desc', search_query, config=SEARCH_CONFIG,
+                start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP,
+                min_words=15, max_words=35,
+            ),
+        )
+
+    if connection.vendor == 'sqlite':
+        return _sqlite_search(queryset, terms)
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(desc__icontains=term)
+    return _unranked(queryset.filter(condition))
+
+
+def _ranked(queryset, hits):
+    """Annotate rank and snippet for [(pk, rank, snippet)] hits computed outside SQL"""
+    if not hits:
+        return _unranked(queryset).none()
+    return queryset.filter(pk__in=[pk for pk, _, _ in hits]).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(rank)) for pk, rank, _ in hits],
+            default=Value(0.0), output_field=FloatField(),
+        ),
+        search_snippet=Case(
+            *[When(pk=pk, then=Value(snippet)) for pk, _, snippet in hits if snippet],
+            default=Value(''), output_field=TextField(),
+        ),
+    )
+
+
+def _unranked(queryset):
+    return queryset.annotate(
+        search_rank=Value(0.0, output_field=FloatField()),
+        search_snippet=Value('', output_field=TextField()),
+    )
+
+
+def _prefix_tsquery(terms):
+    """to_tsquery() text requiring every term as a prefix; TOKEN_RE terms need no escaping inside quotes"""
+    return ' & '.join(f"'{term}':*" for term in terms)
+
+
+def _sqlite_search(queryset, terms):
+    # Quote every term so user input can't inject FTS5 syntax; the trailing
+    # * makes each term a prefix match.
+    match = ' '.join('"%s"*' % term.replace('"', '') for term in terms)
+    document = F('search_document__document')
+    return queryset.filter(search_document__document__match=match).annotate(
+        # bm25() is lower-is-better; flip it so search_rank sorts descending
+        search_rank=Func(
+            document, *(Value(weight) for weight in FTS_WEIGHTS), function='bm25', output_field=FloatField(),
+        ) * -1,
+        search_snippet=Func(
+            document, Value(2), Value(HIGHLIGHT_START), Value(HIGHLIGHT_STOP), Value('…'), Value(24),
+            function='snippet', output_field=TextField(),
+        ),
+    )
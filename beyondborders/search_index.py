@@ -0,0 +1,509 @@
+"""
+In-process inverted index for destination search.
+
+Used when ``settings.SEARCH_BACKEND == 'memory'`` (deployments without
+PostgreSQL full-text search). Each worker holds an index of Destination
+name/location/desc terms in memory and answers queries with exact, prefix
+and bounded edit-distance (typo) matching.
+
+The index is kept current by Destination post_save/post_delete signals,
+applied once the write commits (a rolled-back write never reaches it). The
+process handling a write updates its own index and appends the destination
+id to a change journal next to the snapshot file; other workers replay new
+journal entries (one query for the changed rows) on their next search. On
+startup a worker loads the snapshot plus the journal instead of reading the
+whole table, and only rebuilds from the database when the snapshot is
+missing or no longer matches the table: its row count, highest id and the
+total length of the indexed text, so edits that skipped the signals (bulk
+updates, raw SQL) are noticed too. Once the journal outgrows
+``JOURNAL_MAX_BYTES`` the writing process folds it into a new snapshot and
+truncates it.
+
+If the estimated index size would exceed ``SEARCH_INDEX_MAX_BYTES`` the
+index stops accepting documents and marks itself incomplete; search then
+falls back to the database backend.
+"""
+import bisect
+import gzip
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: journal writes are not locked
+    fcntl = None
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Coalesce, Length
+
+from .models import Destination
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+FIELD_WEIGHTS = {'name': 3, 'location': 2, 'desc': 1}
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in is it of on or the to with'.split()
+)
+# Score multipliers for the different ways a query term can match
+EXACT, PREFIX, TYPO = 1.0, 0.7, 0.5
+MAX_EXPANSIONS = 64
+# How often a worker checks whether another process rewrote the snapshot
+RELOAD_INTERVAL = 2.0
+# Journal size at which it is folded into a new snapshot (~150k changes)
+JOURNAL_MAX_BYTES = 1024 * 1024
+# Rough per-entry costs used for the memory cap (CPython dict/str overheads)
+POSTING_BYTES = 100
+TERM_BYTES = 120
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Sorts after every term starting with a given prefix
+_MAX_CHAR = chr(0x10FFFF)
+
+
+def tokenize(text):
+    """Lowercase, strip accents and split text into index terms"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [token for token in TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+
+def max_typos(term):
+    if len(term) < 4:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def _next_row(row, term, index_term, depth, before_row, limit):
+    """
+    The optimal string alignment row of ``term`` against the first ``depth``
+    characters of ``index_term``, from the rows of the ``depth - 1`` and
+    ``depth - 2`` character prefixes. Only cells within ``limit`` of the
+    diagonal are computed; the others can't lead to a match and hold
+    ``limit + 1``.
+    """
+    char = index_term[depth - 1]
+    current = [min(depth, limit + 1)] + [limit + 1] * len(term)
+    for j in range(max(1, depth - limit), min(len(term), depth + limit) + 1):
+        term_char = term[j - 1]
+        cost = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + (char != term_char))
+        if depth > 1 and j > 1 and char == term[j - 2] and index_term[depth - 2] == term_char:
+            cost = min(cost, before_row[j - 2] + 1)
+        current[j] = cost
+    return current
+
+
+def typo_matches(term, vocabulary, limit):
+    """
+    Return the terms of the sorted ``vocabulary`` within ``limit`` edits of ``term``.
+
+    Edits are insertions, deletions, substitutions and transpositions of
+    adjacent characters (optimal string alignment distance). Neighbouring
+    terms of a sorted list share prefixes, so the list is walked like a
+    trie: the rows computed for a prefix are kept for the next term, and
+    once every cell of a prefix's row exceeds the limit all the terms
+    starting with that prefix are skipped with one bisection.
+    """
+    shortest, longest = len(term) - limit, len(term) + limit
+    rows = [list(range(len(term) + 1))]  # rows[depth]: term against index_term[:depth]
+    previous = ''
+    matches = []
+    i = 0
+    while i < len(vocabulary):
+        index_term = vocabulary[i]
+        shared = 0
+        for a, b in zip(previous, index_term[:len(rows) - 1]):
+            if a != b:
+                break
+            shared += 1
+        del rows[shared + 1:]
+        previous = index_term
+        skip_prefix = None
+        for depth in range(shared + 1, min(len(index_term), longest) + 1):
+            rows.append(_next_row(rows[-1], term, index_term, depth, rows[-2] if depth > 1 else None, limit))
+            if min(rows[-1]) > limit:
+                skip_prefix = index_term[:depth]
+                break
+        else:
+            if len(index_term) > longest:
+                # Longer terms with this prefix can only be further away
+                skip_prefix = index_term[:longest]
+            elif len(index_term) >= shortest and rows[len(index_term)][-1] <= limit:
+                matches.append(index_term)
+        if skip_prefix is None:
+            i += 1
+        else:
+            i = bisect.bisect_left(vocabulary, skip_prefix + _MAX_CHAR, i + 1)
+    return matches
+
+
+def document_terms(name, location, desc):
+    """Return {term: weight} for one destination"""
+    weights = defaultdict(int)
+    for field, text in (('name', name), ('location', location), ('desc', desc)):
+        for token in tokenize(text):
+            weights[token] += FIELD_WEIGHTS[field]
+    return dict(weights)
+
+
+def text_length(name, location, desc):
+    """Characters of indexed text of one destination, summed into the table fingerprint"""
+    return len(name or '') + len(location or '') + len(desc or '')
+
+
+class InvertedIndex:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.postings = {}  # term -> {destination id: weight}
+        self.documents = {}  # destination id -> {term: weight}
+        self.lengths = {}  # destination id -> text_length()
+        self.text_length = 0
+        self.vocabulary = []  # sorted terms, for prefix and typo lookups
+        self.entries = 0
+        self.complete = True
+
+    @property
+    def estimated_bytes(self):
+        return self.entries * POSTING_BYTES + len(self.vocabulary) * TERM_BYTES
+
+    def add(self, doc_id, terms, length):
+        """Index (or re-index) one document from its {term: weight} map and text_length()"""
+        self.remove(doc_id)
+        if self.max_bytes and self.estimated_bytes + len(terms) * (POSTING_BYTES + TERM_BYTES) > self.max_bytes:
+            if self.complete:
+                logger.warning('Search index memory cap of %s bytes reached; falling back to the database', self.max_bytes)
+            self.complete = False
+            return
+        for term, weight in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                bisect.insort(self.vocabulary, term)
+            postings[doc_id] = weight
+        self.documents[doc_id] = terms
+        self.lengths[doc_id] = length
+        self.text_length += length
+        self.entries += len(terms)
+
+    def remove(self, doc_id):
+        self.text_length -= self.lengths.pop(doc_id, 0)
+        terms = self.documents.pop(doc_id, None)
+        if not terms:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+        self.entries -= len(terms)
+
+    def _expand(self, term):
+        """Return [(index term, multiplier)] candidates for one query term"""
+        candidates = []
+        if term in self.postings:
+            candidates.append((term, EXACT))
+        start = bisect.bisect_left(self.vocabulary, term)
+        for index_term in self.vocabulary[start:start + MAX_EXPANSIONS + 1]:
+            if not index_term.startswith(term):
+                break
+            if index_term != term:
+                candidates.append((index_term, PREFIX))
+        if not candidates and max_typos(term):
+            candidates.extend((index_term, TYPO) for index_term in typo_matches(term, self.vocabulary, max_typos(term)))
+        return candidates
+
+    def search(self, query, limit=None):
+        """Return [(destination id, score)] matching every query term, best first"""
+        scores = None
+        for term in dict.fromkeys(tokenize(query)):
+            term_scores = {}
+            for index_term, multiplier in self._expand(term):
+                for doc_id, weight in self.postings[index_term].items():
+                    score = weight * multiplier
+                    if score > term_scores.get(doc_id, 0):
+                        term_scores[doc_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id] for doc_id, score in scores.items() if doc_id in term_scores}
+            if not scores:
+                return []
+        if not scores:
+            return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+    def to_snapshot(self, table_state):
+        return {
+            'version': SNAPSHOT_VERSION,
+            'table_state': table_state,
+            'documents': {str(doc_id): terms for doc_id, terms in self.documents.items()},
+            'lengths': {str(doc_id): length for doc_id, length in self.lengths.items()},
+        }
+
+    @classmethod
+    def from_snapshot(cls, data, max_bytes=None):
+        index = cls(max_bytes=max_bytes)
+        lengths = data['lengths']
+        for doc_id, terms in data['documents'].items():
+            index.add(int(doc_id), terms, lengths[doc_id])
+        return index
+
+
+def _table_state():
+    """Cheap fingerprint of the Destination table used to validate snapshots"""
+    state = Destination.objects.aggregate(
+        count=Count('id'), max_id=Max('id'),
+        text_length=Sum(Length('name') + Coalesce(Length('location'), 0) + Length('desc')),
+    )
+    return [state['count'], state['max_id'], state['text_length'] or 0]
+
+
+def build_index(max_bytes=None, chunk_size=2000):
+    index = InvertedIndex(max_bytes=max_bytes)
+    rows = Destination.objects.values_list('id', 'name', 'location', 'desc').order_by()
+    for doc_id, name, location, desc in rows.iterator(chunk_size=chunk_size):
+        index.add(doc_id, document_terms(name, location, desc), text_length(name, location, desc))
+    return index
+
+
+def read_snapshot(path):
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            data = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != SNAPSHOT_VERSION:
+        return None
+    return data
+
+
+def write_snapshot(index, path, table_state, journal_offset):
+    """Atomically replace the snapshot file with the current index"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    data = index.to_snapshot(table_state)
+    data['journal_offset'] = journal_offset
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.search_index.')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as handle:
+            json.dump(data, handle, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+@contextmanager
+def _locked(path):
+    """Hold an exclusive lock on ``path`` (created if missing) across processes"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'ab') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield handle
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class IndexHolder:
+    """Process-wide index, loaded lazily and kept in step with other workers"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.index = None
+        self.snapshot_mtime = None
+        self.journal_offset = 0
+        self.checked_at = 0.0
+
+    @property
+    def snapshot_path(self):
+        return getattr(settings, 'SEARCH_INDEX_SNAPSHOT', None)
+
+    @property
+    def journal_path(self):
+        return self.snapshot_path + '.journal' if self.snapshot_path else None
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'SEARCH_INDEX_MAX_BYTES', None)
+
+    def load(self):
+        """Load snapshot + journal if they match the table, otherwise rebuild"""
+        path = self.snapshot_path
+        data = read_snapshot(path) if path else None
+        if data:
+            self.index = InvertedIndex.from_snapshot(data, max_bytes=self.max_bytes)
+            self.journal_offset = data.get('journal_offset', 0)
+            self.snapshot_mtime = _file_mtime(path)
+            self._replay_journal()
+            # An incomplete (capped) index is never served, so don't rebuild it
+            if not self.index.complete or self._index_state() == _table_state():
+                self.checked_at = time.monotonic()
+                return self.index
+        return self.rebuild()
+
+    def _index_state(self):
+        return [len(self.index.documents), max(self.index.documents, default=None), self.index.text_length]
+
+    def rebuild(self, compact=False):
+        """
+        Rebuild from the database and write a fresh snapshot.
+
+        With ``compact`` the change journal is truncated as well, since the
+        new snapshot already contains every change it recorded.
+        """
+        with self.lock:
+            self.index = build_index(max_bytes=self.max_bytes)
+            path = self.snapshot_path
+            if path:
+                with _locked(self.journal_path) as journal:
+                    if compact:
+                        journal.truncate(0)
+                    self.journal_offset = _file_size(self.journal_path)
+                    write_snapshot(self.index, path, _table_state(), self.journal_offset)
+                self.snapshot_mtime = _file_mtime(path)
+            self.checked_at = time.monotonic()
+            return self.index
+
+    def compact(self):
+        """
+        Fold the journal into a snapshot of this process's index and truncate
+        it. Journal writes are locked out meanwhile, so no change is lost;
+        other workers notice the new snapshot and reload it.
+        """
+        path = self.snapshot_path
+        if not path:
+            return
+        with self.lock:
+            # Before taking the journal lock: loading may rebuild, which takes it too
+            self.get()
+            with _locked(self.journal_path) as journal:
+                self._compact(path, journal)
+
+    def _compact(self, path, journal):
+        self._replay_journal()
+        # A capped index is never served, so snapshotting it gains nothing
+        if not self.index.complete:
+            return
+        write_snapshot(self.index, path, _table_state(), 0)
+        journal.truncate(0)
+        self.journal_offset = 0
+        self.snapshot_mtime = _file_mtime(path)
+
+    def _replay_journal(self):
+        """Re-index destinations that other processes changed since our last look"""
+        journal = self.journal_path
+        if not journal or _file_size(journal) <= self.journal_offset:
+            return
+        with open(journal, 'rb') as handle:
+            handle.seek(self.journal_offset)
+            chunk = handle.read()
+        # Only consume complete lines; a concurrent append may be mid-write
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        self.journal_offset += len(complete)
+        ids = {int(line) for line in complete.split() if line.strip()}
+        if not ids:
+            return
+        rows = Destination.objects.filter(pk__in=ids).values_list('id', 'name', 'location', 'desc')
+        found = set()
+        for doc_id, name, location, desc in rows:
+            self.index.add(doc_id, document_terms(name, location, desc), text_length(name, location, desc))
+            found.add(doc_id)
+        for doc_id in ids - found:
+            self.index.remove(doc_id)
+
+    def get(self):
+        with self.lock:
+            if self.index is None:
+                return self.load()
+            now = time.monotonic()
+            if self.snapshot_path and now - self.checked_at > RELOAD_INTERVAL:
+                self.checked_at = now
+                mtime = _file_mtime(self.snapshot_path)
+                if mtime is not None and mtime != self.snapshot_mtime:
+                    # Another process rebuilt the index
+                    return self.load()
+                self._replay_journal()
+            return self.index
+
+    def search(self, query, limit=None):
+        with self.lock:
+            index = self.get()
+            if not index.complete:
+                return None
+            return index.search(query, limit=limit)
+
+    def _record(self, destination_id):
+        """Journal a change; returns the journal's size afterwards"""
+        if not self.journal_path:
+            return 0
+        with _locked(self.journal_path) as handle:
+            handle.write(f'{destination_id}\n'.encode())
+            handle.flush()
+            return handle.tell()
+
+    def _apply(self, destination_id, terms, length=0):
+        with self.lock:
+            self.get()
+            if terms is None:
+                self.index.remove(destination_id)
+            else:
+                self.index.add(destination_id, terms, length)
+            size = self._record(destination_id)
+        if size > JOURNAL_MAX_BYTES:
+            self.compact()
+
+    def update(self, destination):
+        """Index ``destination`` as it is now, once the current transaction commits"""
+        destination_id = destination.pk
+        fields = destination.name, destination.location, destination.desc
+        terms, length = document_terms(*fields), text_length(*fields)
+        transaction.on_commit(lambda: self._apply(destination_id, terms, length))
+
+    def remove(self, destination_id):
+        """Drop ``destination_id`` once the current transaction commits"""
+        transaction.on_commit(lambda: self._apply(destination_id, None))
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+            self.snapshot_mtime = None
+            self.journal_offset = 0
+
+
+index_holder = IndexHolder()
+
+
+def is_enabled():
+    return getattr(settings, 'SEARCH_BACKEND', 'database') == 'memory'
@@ -0,0 +1,121 @@
+"""
+Parallel, sharded mode of the travello data copy.
+
+Each source table is split into primary-key ranges (see
+data_migration.plan_shards) and the shards are copied by a pool of worker
+processes, each with its own database connection. Destinations go first:
+every worker returns the source-to-new ID map of its shards, the maps are
+merged and the merged map is handed to the booking workers. Finally every
+shard is verified by row count and checksum.
+
+This module only imports Django lazily so that worker processes started
+with the "spawn" method can load it before Django is set up.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+_destination_ids = None
+
+
+def _init_worker(destination_ids):
+    global _destination_ids
+    import django
+    from django.db import connections
+
+    django.setup()
+    # Never reuse a connection inherited from the parent process
+    connections.close_all()
+    _destination_ids = destination_ids
+
+
+def _copy_destinations(shard, batch_size, chunk_size):
+    from . import data_migration
+
+    return data_migration.copy_destinations(shard, batch_size, chunk_size, streaming=False)
+
+
+def _copy_bookings(shard, batch_size, chunk_size):
+    from . import data_migration
+
+    return data_migration.copy_bookings(shard, _destination_ids, batch_size, chunk_size, streaming=False)
+
+
+def _verify(shard, chunk_size):
+    from . import data_migration
+
+    return data_migration.verify(shard, _destination_ids, chunk_size)
+
+
+def _pool(workers, destination_ids=None):
+    from django.db import connections
+
+    # Forked children must not share the parent's open connections
+    connections.close_all()
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context(method),
+        initializer=_init_worker, initargs=(destination_ids,),
+    )
+
+
+def _run(pool, function, shards, *args):
+    futures = {pool.submit(function, shard, *args): shard for shard in shards}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+def _add(total, result, started):
+    total.copied += result.copied
+    total.skipped += result.skipped
+    total.seconds = time.monotonic() - started
+
+
+def migrate_sharded(workers, shard_size, batch_size, chunk_size, progress=None):
+    """
+    Copy both tables shard by shard in ``workers`` processes.
+
+    ``progress(result)`` is called with each shard's StageResult as it
+    finishes. Returns a StageResult per table, timed by the wall clock,
+    and the ShardCheck of every shard.
+    """
+    from . import data_migration
+    from .data_migration import BOOKINGS, DESTINATIONS, DataMigrationError, StageResult
+    from .models import LegacyDestination
+
+    destination_shards = data_migration.plan_shards(DESTINATIONS, shard_size)
+    booking_shards = data_migration.plan_shards(BOOKINGS, shard_size)
+    data_migration.check_checkpoints(DESTINATIONS, destination_shards)
+    data_migration.check_checkpoints(BOOKINGS, booking_shards)
+
+    # Rows copied by earlier, interrupted runs plus what each shard copies now
+    destination_ids = data_migration.destination_id_map()
+    destinations = StageResult(DESTINATIONS)
+    started = time.monotonic()
+    with _pool(workers) as pool:
+        for shard, (result, copied_ids) in _run(pool, _copy_destinations, destination_shards, batch_size, chunk_size):
+            overlap = destination_ids.keys() & copied_ids.keys()
+            if overlap:
+                raise DataMigrationError(f'{shard} copied destinations that were already copied: {sorted(overlap)[:5]}')
+            destination_ids.update(copied_ids)
+            _add(destinations, result, started)
+            if progress:
+                progress(result)
+    recorded = LegacyDestination.objects.count()
+    if recorded != len(destination_ids):
+        raise DataMigrationError(f'Merged {len(destination_ids)} destination IDs but {recorded} are recorded')
+    if destination_ids:
+        data_migration.refresh_derived_data()
+
+    bookings = StageResult(BOOKINGS)
+    started = time.monotonic()
+    with _pool(workers, destination_ids) as pool:
+        for shard, result in _run(pool, _copy_bookings, booking_shards, batch_size, chunk_size):
+            _add(bookings, result, started)
+            if progress:
+                progress(result)
+
+        checks = [check for _, check in _run(pool, _verify, destination_shards + booking_shards, chunk_size)]
+    data_migration.refresh_booking_data()
+    checks.sort(key=lambda check: (check.shard.table != DESTINATIONS, check.shard.start))
+    return destinations, bookings, checks
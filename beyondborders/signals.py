@@ -0,0 +1,172 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import BlogPost, Booking, Destination, ExchangeRate, Review, Wishlist
+from .ratings import apply_rating_delta
+from . import cache, confirmations, currency, geo, inventory, rendition_queue, search, search_index, similarity, suggest
+
+# What the nearby lists of other destinations show
+PLACE_FIELDS = ('name', 'location', 'latitude', 'longitude')
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, raw=False, **kwargs):
+    """Load the stored rating for reviews that were not fetched through the ORM"""
+    if raw or instance.pk is None or hasattr(instance, '_loaded_rating'):
+        return
+    previous = sender.objects.filter(pk=instance.pk).values('rating', 'destination_id').first()
+    instance._loaded_rating = previous['rating'] if previous else None
+    instance._loaded_destination_id = previous['destination_id'] if previous else None
+
+
+@receiver(post_save, sender=Review)
+def update_rating_aggregates_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_rating = None if created else getattr(instance, '_loaded_rating', None)
+    old_destination_id = None if created else getattr(instance, '_loaded_destination_id', None)
+    new_rating = int(instance.rating)
+
+    if old_destination_id is not None and old_destination_id != instance.destination_id:
+        apply_rating_delta(old_destination_id, removed=old_rating)
+        apply_rating_delta(instance.destination_id, added=new_rating)
+    else:
+        apply_rating_delta(instance.destination_id, added=new_rating, removed=old_rating)
+
+    instance._loaded_rating = new_rating
+    instance._loaded_destination_id = instance.destination_id
+    invalidate_review_pages(instance, old_destination_id)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_aggregates_on_delete(sender, instance, **kwargs):
+    rating = getattr(instance, '_loaded_rating', instance.rating)
+    apply_rating_delta(instance.destination_id, removed=rating)
+    invalidate_review_pages(instance)
+
+
+def invalidate_review_pages(review, old_destination_id=None):
+    # Ratings show on every listing, the review itself on the detail page
+    namespaces = ['destinations', f'destination:{review.destination_id}', f'user:{review.user_id}']
+    if old_destination_id and old_destination_id != review.destination_id:
+        namespaces.append(f'destination:{old_destination_id}')
+    cache.bump(*namespaces)
+
+
+@receiver(pre_save, sender=Destination)
+def remember_previous_place(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None or hasattr(instance, '_loaded_place'):
+        return
+    instance._loaded_place = sender.objects.filter(pk=instance.pk).values(*PLACE_FIELDS).first()
+
+
+@receiver(post_save, sender=Destination)
+def invalidate_nearby_lists(sender, instance, created, raw=False, **kwargs):
+    deferred = instance.get_deferred_fields()
+    place = {field: getattr(instance, field) for field in PLACE_FIELDS if field not in deferred}
+    previous = None if created else getattr(instance, '_loaded_place', None)
+    if created:
+        moved = instance.latitude is not None and instance.longitude is not None
+    else:
+        moved = previous is None or any(previous.get(field, value) != value for field, value in place.items())
+    if moved:
+        cache.bump(geo.NAMESPACE)
+    if not raw:
+        instance._loaded_place = {**(previous or {}), **place}
+
+
+@receiver(post_save, sender=Destination)
+def update_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_destination(instance)
+        transaction.on_commit(suggest.suggestion_index.invalidate)
+        cache.bump('destinations', f'destination:{instance.pk}')
+        similarity.destination_arrays.changed(instance.pk)
+        if search_index.is_enabled():
+            search_index.index_holder.update(instance)
+        generate_renditions(instance.img)
+
+
+@receiver(post_delete, sender=Destination)
+def remove_search_document(sender, instance, **kwargs):
+    search.remove_destination(instance.pk)
+    cache.bump(geo.NAMESPACE)
+    transaction.on_commit(suggest.suggestion_index.invalidate)
+    cache.bump('destinations', f'destination:{instance.pk}')
+    similarity.destination_arrays.changed(instance.pk)
+    if search_index.is_enabled():
+        search_index.index_holder.remove(instance.pk)
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_wishlist_pages(sender, instance, **kwargs):
+    cache.bump(f'user:{instance.user_id}')
+
+
+@receiver(pre_save, sender=Booking)
+def update_inventory_on_save(sender, instance, raw=False, **kwargs):
+    """Take or give back seats for the change; raises inventory.SoldOut before the write"""
+    if raw:
+        return
+    if instance.pk is None:
+        previous = None
+    elif hasattr(instance, '_loaded_seats'):
+        previous = instance._loaded_seats
+    else:
+        stored = sender.objects.filter(pk=instance.pk).first()
+        previous = stored.held_seats() if stored else None
+    inventory.move(previous, instance.held_seats())
+
+
+@receiver(post_save, sender=Booking)
+def remember_held_seats(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._loaded_seats = instance.held_seats()
+
+
+@receiver(post_save, sender=Booking)
+def enqueue_confirmation(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.status == 'pending':
+        confirmations.enqueue(instance)
+
+
+@receiver(post_delete, sender=Booking)
+def release_seats_on_delete(sender, instance, **kwargs):
+    held = getattr(instance, '_loaded_seats', instance.held_seats())
+    if held:
+        inventory.release(*held)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def invalidate_booking_pages(sender, instance, **kwargs):
+    # Upcoming trips show on the user's detail and search pages
+    cache.bump(f'user:{instance.user_id}')
+
+
+@receiver(post_save, sender=BlogPost)
+@receiver(post_delete, sender=BlogPost)
+def invalidate_blog_pages(sender, instance, **kwargs):
+    cache.bump('blog')
+
+
+@receiver(post_save, sender=BlogPost)
+def generate_blog_renditions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        generate_renditions(instance.image)
+
+
+def generate_renditions(image):
+    # Queued in the same transaction, so a rolled-back upload is never processed
+    if image:
+        rendition_queue.enqueue(image.name)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_exchange_rates(sender, instance, **kwargs):
+    # Also for fixtures (raw saves): every price on every page may change
+    cache.bump(currency.NAMESPACE, 'destinations')
+    transaction.on_commit(currency.rate_table.invalidate)
@@ -0,0 +1,240 @@
+"""
+Precomputed "you may also like" rankings for the destination detail page.
+
+Every destination is scored against every other on four signals:
+
+- geographic closeness: haversine distance, decaying over ``DISTANCE_SCALE_KM``;
+- price proximity: (1 + the lower price) / (1 + the higher one);
+- the candidate's special-offer flag;
+- the candidate's rating, shrunk towards ``PRIOR_RATING`` while it has few reviews.
+
+Scores are computed with NumPy over column arrays (one array per signal,
+indexed by position in ``ids``) for a block of source destinations at a
+time, so the work is a handful of vectorized operations per block and
+memory stays bounded by ``BLOCK_CELLS``. The best ``DEFAULT_TOP_K`` of each
+row are written to SimilarDestination by the ``rebuild_similar_destinations``
+management command, and the detail page reads them with one indexed query.
+
+A process loads the arrays on first use. Once it has, Destination signals
+and rating updates (beyondborders.ratings) committed in that process mark
+the changed rows, which the next ``destination_arrays.get()`` reloads in one
+query; processes that never load them (web workers) track nothing. Changes
+made by other processes are picked up after ``SIMILARITY_ARRAYS_TTL``
+seconds.
+
+The module is imported by the signal handlers of every process, so NumPy is
+only imported by the functions that build or score the arrays: a process
+without it runs until it ranks destinations.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import cache
+from .geo import EARTH_RADIUS_KM
+from .models import Destination, SimilarDestination
+
+DEFAULT_TOP_K = 8
+WEIGHTS = {'distance': 0.4, 'price': 0.3, 'rating': 0.2, 'offer': 0.1}
+DISTANCE_SCALE_KM = 1000.0
+PRIOR_RATING = 3.0
+PRIOR_REVIEWS = 5
+# Score matrix cells per block: 4M float32 cells is 16 MB per buffer
+BLOCK_CELLS = 4_000_000
+# Source destinations written per transaction
+MAX_BLOCK_ROWS = 500
+
+COLUMNS = ('id', 'latitude', 'longitude', 'price', 'offer', 'rating_avg', 'rating_count')
+
+
+class DestinationArrays:
+    """Column arrays of every destination, sorted by ID"""
+
+    def __init__(self, ids, latitude, longitude, price, offer, rating_avg, rating_count):
+        import numpy as np
+
+        order = np.argsort(ids, kind='stable')
+        self.ids = ids[order]
+        self.latitude = latitude[order]
+        self.longitude = longitude[order]
+        self.price = price[order]
+        self.offer = offer[order]
+        self.rating_avg = rating_avg[order]
+        self.rating_count = rating_count[order]
+        # Derived columns used by every block, in float32: half the memory
+        # traffic of float64 and plenty of precision for ranking
+        lat, lon = np.radians(self.latitude), np.radians(self.longitude)
+        # Unit vectors, so the great-circle angle between two points is the arccos of their dot product
+        self._xyz = np.stack(
+            (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=1
+        ).astype(np.float32)
+        self._log_price = np.log1p(self.price).astype(np.float32)
+        reviews = self.rating_count.astype(float)
+        rating = (self.rating_avg * reviews + PRIOR_RATING * PRIOR_REVIEWS) / (reviews + PRIOR_REVIEWS)
+        self._candidate_score = (WEIGHTS['rating'] * rating / 5 + WEIGHTS['offer'] * self.offer).astype(np.float32)
+
+    @classmethod
+    def from_rows(cls, rows):
+        import numpy as np
+
+        rows = list(rows)
+        # float() of a None latitude is NaN, which scores no distance term
+        columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+        return cls(
+            np.array(columns[0], dtype=np.int64),
+            np.array(columns[1], dtype=float),
+            np.array(columns[2], dtype=float),
+            np.array(columns[3], dtype=float),
+            np.array(columns[4], dtype=float),
+            np.array(columns[5], dtype=float),
+            np.array(columns[6], dtype=np.int64),
+        )
+
+    @classmethod
+    def from_database(cls, ids=None):
+        rows = Destination.objects.order_by('pk')
+        if ids is not None:
+            rows = rows.filter(pk__in=ids)
+        return cls.from_rows(rows.values_list(*COLUMNS).iterator(chunk_size=2000))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _columns(self):
+        return (self.ids, self.latitude, self.longitude, self.price, self.offer, self.rating_avg, self.rating_count)
+
+    def replace(self, ids, changed):
+        """Return a copy with the rows of ``ids`` dropped and the rows of ``changed`` added"""
+        import numpy as np
+
+        keep = ~np.isin(self.ids, np.fromiter(ids, dtype=np.int64, count=len(ids)))
+        return DestinationArrays(*(
+            np.concatenate((column[keep], new)) for column, new in zip(self._columns(), changed._columns())
+        ))
+
+    def positions(self, ids):
+        """Positions of ``ids`` in the arrays; IDs that are not loaded are dropped"""
+        import numpy as np
+
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == ids[found]
+        return positions[found]
+
+    def scores(self, positions):
+        """Score matrix of the destinations at ``positions`` (rows) against all destinations (columns)"""
+        import numpy as np
+
+        # Operations run in place on two block-sized buffers
+        scores = self._xyz[positions] @ self._xyz.T
+        np.clip(scores, -1, 1, out=scores)
+        np.arccos(scores, out=scores)
+        scores *= -EARTH_RADIUS_KM / DISTANCE_SCALE_KM
+        np.exp(scores, out=scores)
+        # Destinations without coordinates (NaN) get no distance term
+        np.nan_to_num(scores, copy=False, nan=0.0)
+        scores *= WEIGHTS['distance']
+
+        # exp(-|log(1 + a) - log(1 + b)|) is (1 + lower price) / (1 + higher price)
+        proximity = np.subtract(self._log_price[positions, None], self._log_price)
+        np.abs(proximity, out=proximity)
+        np.negative(proximity, out=proximity)
+        np.exp(proximity, out=proximity)
+        proximity *= WEIGHTS['price']
+        scores += proximity
+        scores += self._candidate_score
+
+        # Never recommend a destination to itself
+        scores[np.arange(len(positions)), positions] = -np.inf
+        return scores
+
+    def top_k(self, positions, k=DEFAULT_TOP_K):
+        """Return (candidate positions, scores) of the best ``k`` per row, best first"""
+        import numpy as np
+
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return np.empty((len(positions), 0), dtype=np.int64), np.empty((len(positions), 0))
+        scores = self.scores(positions)
+        best = np.argpartition(scores, -k, axis=1)[:, -k:]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class _Holder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrays = None
+        self.loaded_at = 0.0
+        self.changed_ids = set()
+
+    def invalidate(self):
+        """Reload everything on next use, e.g. after bulk writes that skip signals"""
+        self.arrays = None
+
+    def changed(self, pk):
+        """Reload the row of ``pk`` on next use, once the current transaction commits"""
+        transaction.on_commit(lambda: self._mark(pk))
+
+    def _mark(self, pk):
+        # Only a process holding arrays has rows to refresh
+        if self.arrays is not None:
+            self.changed_ids.add(pk)
+
+    def get(self):
+        ttl = getattr(settings, 'SIMILARITY_ARRAYS_TTL', 300)
+        with self.lock:
+            if self.arrays is None or time.monotonic() - self.loaded_at >= ttl:
+                self.changed_ids = set()
+                self.arrays = DestinationArrays.from_database()
+                self.loaded_at = time.monotonic()
+            elif self.changed_ids:
+                ids, self.changed_ids = self.changed_ids, set()
+                # Deleted destinations are simply missing from the reloaded rows
+                self.arrays = self.arrays.replace(ids, DestinationArrays.from_database(ids))
+            return self.arrays
+
+
+destination_arrays = _Holder()
+
+
+def rebuild_similar_destinations(k=DEFAULT_TOP_K, destination_ids=None, progress=None):
+    """
+    Recompute the SimilarDestination rows of every destination, or of ``destination_ids``.
+
+    Each block of sources is replaced in its own transaction, so readers
+    always see a complete list, and their cached detail pages are
+    invalidated. ``progress(done, total)`` is called after each block. Returns the number of destinations ranked.
+    """
+    import numpy as np
+
+    arrays = destination_arrays.get()
+    if destination_ids is None:
+        positions = np.arange(len(arrays))
+        # Sources deleted since the last run lose their rows through the cascade
+    else:
+        positions = arrays.positions(sorted(set(destination_ids)))
+    block_size = max(1, min(MAX_BLOCK_ROWS, BLOCK_CELLS // max(len(arrays), 1)))
+
+    for start in range(0, len(positions), block_size):
+        block = positions[start:start + block_size]
+        best, best_scores = arrays.top_k(block, k)
+        source_ids = arrays.ids[block].tolist()
+        similar_ids = arrays.ids[best].tolist()
+        rows = [
+            SimilarDestination(destination_id=source_id, similar_id=similar_id, rank=rank, score=score)
+            for source_id, similar_row, score_row in zip(source_ids, similar_ids, best_scores.tolist())
+            for rank, (similar_id, score) in enumerate(zip(similar_row, score_row), 1)
+        ]
+        with transaction.atomic():
+            SimilarDestination.objects.filter(destination_id__in=source_ids).delete()
+            SimilarDestination.objects.bulk_create(rows)
+            cache.bump(*(f'destination:{source_id}' for source_id in source_ids))
+        if progress:
+            progress(min(start + block_size, len(positions)), len(positions))
+
+    return len(positions)
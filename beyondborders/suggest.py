@@ -0,0 +1,153 @@
+"""
+Prefix suggestions for the destination search form.
+
+Each worker keeps two sorted arrays: one of name keys (the full name plus
+every word inside it, so "york" finds "New York") and one of distinct
+locations. A lookup is a bisect to the first key with the prefix followed by
+a short forward scan, so cost does not depend on table size.
+
+The arrays are rebuilt when a Destination write commits in this process
+(signals bump ``generation``), and at most ``SUGGEST_INDEX_TTL`` seconds
+after a change made by another worker. Only a worker's first lookup waits
+for a build; later rebuilds run in a background thread while lookups keep
+using the previous arrays.
+"""
+import bisect
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Destination
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+# Cap on keys scanned per lookup so one-letter prefixes stay cheap
+MAX_SCAN = 200
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(char for char in text if not unicodedata.combining(char)).strip()
+
+
+class SuggestionIndex:
+    def __init__(self, rows):
+        names = []
+        locations = {}
+        for pk, name, location, offer in rows:
+            key = normalize(name)
+            # Offers sort ahead of other destinations that share a key
+            rank = 0 if offer else 1
+            names.append((key, rank, name, pk))
+            for position, char in enumerate(key):
+                if char == ' ' and key[position + 1:position + 2].strip():
+                    names.append((key[position + 1:], rank, name, pk))
+            if location:
+                locations.setdefault(normalize(location), location)
+        names.sort()
+        self.name_keys = [entry[0] for entry in names]
+        self.name_entries = [(entry[3], entry[2]) for entry in names]
+        self.location_keys = sorted(locations)
+        self.location_values = [locations[key] for key in self.location_keys]
+        digest = hashlib.sha1()
+        for key, (pk, name) in zip(self.name_keys, self.name_entries):
+            digest.update(f'{key}\0{pk}\0{name}\n'.encode())
+        for location in self.location_values:
+            digest.update(f'{location}\n'.encode())
+        self.fingerprint = digest.hexdigest()[:16]
+
+    @classmethod
+    def from_database(cls):
+        rows = Destination.objects.values_list('id', 'name', 'location', 'offer').order_by()
+        return cls(rows.iterator(chunk_size=2000))
+
+    def destinations(self, prefix, limit):
+        results, seen = [], set()
+        start = bisect.bisect_left(self.name_keys, prefix)
+        for position in range(start, min(start + MAX_SCAN, len(self.name_keys))):
+            if not self.name_keys[position].startswith(prefix):
+                break
+            pk, name = self.name_entries[position]
+            if pk not in seen:
+                seen.add(pk)
+                results.append({'id': pk, 'name': name})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def locations(self, prefix, limit):
+        start = bisect.bisect_left(self.location_keys, prefix)
+        results = []
+        for position in range(start, min(start + limit, len(self.location_keys))):
+            if not self.location_keys[position].startswith(prefix):
+                break
+            results.append(self.location_values[position])
+        return results
+
+
+class _Holder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.built_at = 0.0
+        self.built_generation = None
+        self.generation = 0
+        self.rebuilding = False
+
+    def invalidate(self):
+        self.generation += 1
+
+    def is_stale(self):
+        ttl = getattr(settings, 'SUGGEST_INDEX_TTL', 60)
+        return self.built_generation != self.generation or time.monotonic() - self.built_at >= ttl
+
+    def get(self):
+        index = self.index
+        if index is not None and not self.is_stale():
+            return index
+        with self.lock:
+            if self.index is None:
+                # Nothing to serve yet, so the first lookup waits for the build
+                self.build()
+            elif self.is_stale() and not self.rebuilding:
+                self.rebuilding = True
+                threading.Thread(target=self._rebuild, name='suggestion-index', daemon=True).start()
+            return self.index
+
+    def build(self):
+        generation = self.generation
+        index = SuggestionIndex.from_database()
+        self.index, self.built_generation, self.built_at = index, generation, time.monotonic()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            # The previous arrays stay in use; the next stale lookup tries again
+            logger.exception('Rebuilding the suggestion index failed')
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+
+suggestion_index = _Holder()
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    """Return (payload, fingerprint) for a prefix query"""
+    prefix = normalize(query)
+    limit = max(1, min(limit, MAX_LIMIT))
+    index = suggestion_index.get()
+    payload = {
+        'query': query,
+        'destinations': index.destinations(prefix, limit) if prefix else [],
+        'locations': index.locations(prefix, limit) if prefix else [],
+    }
+    return payload, index.fingerprint
@@ -0,0 +1,247 @@
+"""
+Template render profiling.
+
+With ``TEMPLATE_PROFILING`` on, TemplateProfilingMiddleware times every
+request's template rendering and reports where it went:
+
+- ``template``: each template rendered (the page, its parents and every
+  include), with its self time: the time spent in its own nodes, including
+  the blocks it fills in a parent, excluding other templates;
+- ``include``: each ``{% include %}`` tag, including the included template;
+- ``block``: each ``{% block %}`` of the page, whichever template filled it;
+- ``variable``: each variable or filter expression resolved, e.g.
+  ``destination.average_rating`` in a ``{% with %}``, with the template it
+  appears in.
+
+The hottest entries go out in a ``Server-Timing`` header (shown by the
+browser's developer tools), and with ``TEMPLATE_PROFILE_DUMP`` set every
+profile is appended to that file as a JSON line, which the
+``template_profile_report`` command sums up across requests, e.g. after a
+load test.
+
+Timing works by wrapping a few methods of django.template, which happens
+once when the middleware is loaded; without TEMPLATE_PROFILING nothing is
+wrapped and rendering costs nothing extra. With it on, timings include the
+profiler's own overhead (most of it for variables), so compare entries
+with each other rather than with unprofiled response times.
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.template.base import FilterExpression, Node, Template
+from django.template.loader_tags import BLOCK_CONTEXT_KEY, BlockNode, IncludeNode
+
+# Entries in the Server-Timing header
+HEADER_ENTRIES = 10
+
+_current = contextvars.ContextVar('template_profile', default=None)
+_install_lock = threading.Lock()
+_installed = False
+_dump_lock = threading.Lock()
+
+
+class TemplateProfile:
+    """Timings of one request's rendering, keyed by (kind, name, template)"""
+
+    def __init__(self):
+        # key: [calls, seconds, self seconds]
+        self.entries = {}
+        # Template currently rendering a node, for variables and includes
+        self.origin = None
+        # [seconds spent in nested frames] per template or block rendering
+        self.stack = []
+
+    def add(self, key, seconds, self_seconds=None, calls=1):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0, 0.0, 0.0]
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] += seconds if self_seconds is None else self_seconds
+
+    def enter(self):
+        self.stack.append([0.0])
+
+    def leave(self, template, elapsed):
+        """Credit ``template`` with ``elapsed`` minus the time spent in frames entered since enter()"""
+        nested = self.stack.pop()[0]
+        if self.stack:
+            self.stack[-1][0] += elapsed
+        self.add(('template', template, None), 0.0, elapsed - nested, calls=0)
+
+    @property
+    def total(self):
+        """Seconds spent rendering top-level templates"""
+        return sum(seconds for (kind, _, _), (_, seconds, _) in self.entries.items() if kind == 'render')
+
+    def hot_spots(self, limit=None):
+        """Entries as dicts, slowest (by self time for templates, total otherwise) first"""
+        rows = [
+            {
+                'kind': kind, 'name': name, 'template': template, 'calls': calls,
+                'ms': round(seconds * 1000, 3), 'self_ms': round(self_seconds * 1000, 3),
+            }
+            for (kind, name, template), (calls, seconds, self_seconds) in self.entries.items()
+            if kind != 'render'
+        ]
+        rows.sort(key=lambda row: row['self_ms'] if row['kind'] == 'template' else row['ms'], reverse=True)
+        return rows[:limit] if limit else rows
+
+    def server_timing(self, limit=HEADER_ENTRIES):
+        """Value for a Server-Timing header"""
+        metrics = [f'tpl;desc="templates";dur={self.total * 1000:.2f}']
+        for i, row in enumerate(self.hot_spots(limit)):
+            duration = row['self_ms'] if row['kind'] == 'template' else row['ms']
+            label = f'{row["kind"]} {row["name"]}' + (f' in {row["template"]}' if row['template'] else '')
+            label = label.replace('\\', '\\\\').replace('"', '\\"')
+            metrics.append(f'tpl{i};desc="{label} x{row["calls"]}";dur={duration:.2f}')
+        return ', '.join(metrics)
+
+
+def _template_name(template):
+    return getattr(template.origin, 'template_name', None) or template.name or '<string>'
+
+
+def _wrap(cls, method, timed):
+    original = getattr(cls, method)
+
+    @functools.wraps(original)
+    def wrapper(self, *args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return original(self, *args, **kwargs)
+        return timed(profile, original, self, *args, **kwargs)
+
+    setattr(cls, method, wrapper)
+
+
+def _time_template(profile, render, template, context):
+    name = _template_name(template)
+    top_level = not profile.stack
+    profile.enter()
+    started = time.perf_counter()
+    try:
+        return render(template, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        profile.leave(name, elapsed)
+        profile.add(('template', name, None), elapsed, 0.0)
+        if top_level:
+            profile.add(('render', name, None), elapsed)
+
+
+def _time_node(profile, render, node, context):
+    # Nodes of an extended template's blocks run inside the parent's
+    # render, so the node's own origin says which template a variable is in
+    previous = profile.origin
+    if node.origin is not None:
+        profile.origin = node.origin.template_name or node.origin.name
+    try:
+        return render(node, context)
+    finally:
+        profile.origin = previous
+
+
+def _time_include(profile, render, node, context):
+    started = time.perf_counter()
+    try:
+        return render(node, context)
+    finally:
+        name = node.template.token.strip('\'"')
+        profile.add(('include', name, profile.origin), time.perf_counter() - started)
+
+
+def _time_block(profile, render, node, context):
+    # The parent template renders the block, but its content (and self
+    # time) belongs to the template that overrides it last
+    block_context = context.render_context.get(BLOCK_CONTEXT_KEY)
+    filler = (block_context and block_context.get_block(node.name)) or node
+    profile.enter()
+    started = time.perf_counter()
+    try:
+        return render(node, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        profile.leave(filler.origin.template_name or filler.origin.name, elapsed)
+        profile.add(('block', node.name, _template_name(context.template)), elapsed)
+
+
+def _time_variable(profile, resolve, expression, context, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return resolve(expression, context, *args, **kwargs)
+    finally:
+        profile.add(('variable', expression.token, profile.origin), time.perf_counter() - started)
+
+
+def install():
+    """Wrap the django.template methods the profiler times; safe to call repeatedly"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _wrap(Template, '_render', _time_template)
+        _wrap(Node, 'render_annotated', _time_node)
+        _wrap(IncludeNode, 'render', _time_include)
+        _wrap(BlockNode, 'render', _time_block)
+        _wrap(FilterExpression, 'resolve', _time_variable)
+        _installed = True
+
+
+def start():
+    """Profile rendering in this thread (or task) until stop(token); returns (profile, token)"""
+    profile = TemplateProfile()
+    return profile, _current.set(profile)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def dump(profile, request, response):
+    """Append ``profile`` to TEMPLATE_PROFILE_DUMP as one JSON line"""
+    path = getattr(settings, 'TEMPLATE_PROFILE_DUMP', None)
+    if not path:
+        return
+    line = json.dumps({
+        'time': time.time(), 'method': request.method, 'path': request.path,
+        'status': response.status_code, 'ms': round(profile.total * 1000, 3),
+        'entries': profile.hot_spots(),
+    })
+    # One write per line keeps lines whole when worker processes share the file
+    with _dump_lock, open(path, 'a', encoding='utf-8') as handle:
+        handle.write(line + '\n')
+
+
+def summarize(lines):
+    """
+    Sum JSON lines written by dump() into (requests, total ms, rows), rows
+    like TemplateProfile.hot_spots() plus ``per_request_ms``, slowest first.
+    """
+    requests, total, entries = 0, 0.0, {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        requests += 1
+        total += record['ms']
+        for row in record['entries']:
+            key = (row['kind'], row['name'], row['template'])
+            entry = entries.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += row['calls']
+            entry[1] += row['ms']
+            entry[2] += row['self_ms']
+    rows = [
+        {
+            'kind': kind, 'name': name, 'template': template, 'calls': calls,
+            'ms': round(ms, 3), 'self_ms': round(self_ms, 3),
+            'per_request_ms': round((self_ms if kind == 'template' else ms) / requests, 3),
+        }
+        for (kind, name, template), (calls, ms, self_ms) in entries.items()
+    ]
+    rows.sort(key=lambda row: row['per_request_ms'], reverse=True)
+    return requests, total, rows
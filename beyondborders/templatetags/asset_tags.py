@@ -0,0 +1,24 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html_join
+
+from beyondborders.assets import bundle_urls
+
+register = template.Library()
+
+@register.simple_tag
+def bundle(name, **attrs):
+    """Link an ASSET_BUNDLES bundle: a stylesheet for .css, a script for .js.
+
+    {% bundle 'site.css' %}
+    {% bundle 'site.js' defer=True %}
+
+    Extra keyword arguments become attributes of every tag.
+    """
+    if name.endswith('.css'):
+        html = '<link rel="stylesheet" href="{}"{}>'
+    elif name.endswith('.js'):
+        html = '<script src="{}"{}></script>'
+    else:
+        raise template.TemplateSyntaxError(f'Cannot link bundle {name!r}: only .css and .js bundles are supported')
+    return format_html_join('\n', html, ((url, flatatt(attrs)) for url in bundle_urls(name)))
@@ -0,0 +1,31 @@
+from django import template
+
+from beyondborders.currency import format_money, get_rates
+
+register = template.Library()
+
+@register.filter
+def money(value, currency):
+    """Format an amount already in ``currency``, e.g. {{ budget|money:currency }}."""
+    try:
+        return format_money(value, currency)
+    except (ValueError, TypeError, ArithmeticError):
+        return ''
+
+@register.filter
+def local_price(destination, currency):
+    """A destination's price per person in ``currency``, formatted; the original price when no rate is known."""
+    amount = get_rates().convert(destination.price, destination.currency, currency)
+    if amount is None:
+        return format_money(destination.price, destination.currency)
+    return format_money(amount, currency)
+
+@register.filter
+def local_total(booking, currency):
+    """A booking's total for all travelers in ``currency``, formatted."""
+    destination = booking.destination
+    total = destination.price * booking.number_of_travelers
+    amount = get_rates().convert(total, destination.currency, currency)
+    if amount is None:
+        return format_money(total, destination.currency)
+    return format_money(amount, currency)
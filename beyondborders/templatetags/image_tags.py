@@ -0,0 +1,36 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from beyondborders.images import srcsets
+
+register = template.Library()
+
+@register.simple_tag
+def responsive_img(image, alt='', sizes='100vw', **attrs):
+    """Render an uploaded image as a lazy-loaded <picture> with a srcset per format.
+
+    {% responsive_img destination.img alt=destination.name sizes='(min-width: 992px) 33vw, 100vw' class='card-img' %}
+
+    Extra keyword arguments become <img> attributes; pass loading='eager'
+    for images above the fold. Images without renditions yet render as a
+    plain <img> of the original.
+    """
+    if not image:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    rendered = srcsets(image.name)
+    if rendered is None:
+        return format_html('<img src="{}" alt="{}"{}>', image.url, alt, flatatt(attrs))
+    width, height, sources, fallback = rendered
+    # Intrinsic size lets the browser reserve the box before the image loads
+    attrs.setdefault('width', width)
+    attrs.setdefault('height', height)
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}"{}></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+            (mime_type, srcset, sizes) for mime_type, srcset in sources[:-1]
+        )),
+        fallback, sources[-1][1], sizes, alt, flatatt(attrs),
+    )
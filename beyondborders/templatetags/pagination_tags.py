@@ -0,0 +1,27 @@
+from django import template
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def query_replace(context, **kwargs):
+    """Return the current query string with the given parameters replaced.
+
+    Parameters set to None or '' are dropped; `page` and `cursor` are
+    always dropped unless given, so the two pagination modes never mix.
+    """
+    query = context['request'].GET.copy()
+    for key in ('page', 'cursor'):
+        query.pop(key, None)
+    for key, value in kwargs.items():
+        query.pop(key, None)
+        if value not in (None, ''):
+            query[key] = value
+    encoded = query.urlencode()
+    return f'?{encoded}' if encoded else '?'
+
+@register.simple_tag
+def elided_page_range(page_obj, on_each_side=2, on_ends=1):
+    """Page numbers around the current page, with Paginator.ELLIPSIS gaps."""
+    return page_obj.paginator.get_elided_page_range(
+        page_obj.number, on_each_side=on_each_side, on_ends=on_ends
+    )
@@ -0,0 +1,15 @@
+from django import template
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from beyondborders.search import HIGHLIGHT_START, HIGHLIGHT_STOP
+
+register = template.Library()
+
+@register.filter(needs_autoescape=True)
+def highlight(value, autoescape=True):
+    """Escape a search snippet and wrap its matched terms in <mark> tags."""
+    text = conditional_escape(value) if autoescape else value
+    return mark_safe(
+        str(text).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+    )
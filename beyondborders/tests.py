@@ -1,3 +1,1626 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from unittest import SkipTest, mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from PIL import Image
+
+from . import (
+    bulk_io, confirmations, currency, data_migration, facets, file_serving, fragments, geo, idempotency, image_batch,
+    images, inventory, rendition_queue, search, search_index, similarity, suggest, template_profiling, views,
+)
+from .assets import build_bundle, minify_css, minify_js
+from .cache import cache_view, namespace_versions
+from .currency import price_range_q
+from .data_migration import BOOKINGS, DESTINATIONS, Shard
+from .ratings import STARS, rebuild_rating_aggregates
+from .models import (
+    DESTINATION_CARD_FIELDS, BlogPost, Booking, BookingConfirmationJob, DataMigrationCheckpoint, DepartureInventory,
+    Destination, ExchangeRate, ImageRenditionJob, ImageRenditionSet, LegacyBooking, LegacyDestination, Review, Wishlist,
+)
+
+
+def make_destination(name, **fields):
+    fields.setdefault('desc', f'{name} and its surroundings')
+    fields.setdefault('price', 100)
+    return Destination.objects.create(name=name, img='pics/destination_1.jpg', **fields)
+
+
+class _Rollback(Exception):
+    pass
+
+
+RATING_FIELDS = ['rating_sum', 'rating_count', 'rating_avg'] + [f'rating_{stars}_count' for stars in STARS]
+
+
+def stored_ratings():
+    return {row.pop('id'): row for row in Destination.objects.values('id', *RATING_FIELDS)}
+
+
+class MultipleConnectionsMixin:
+    
+    @classmethod
+    def setUpClass(cls):
+        # SQLite reports test_db_allows_multiple_connections = False even for a test database in a file
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise SkipTest('the in-memory test database has one connection: run with --settings=firstprogram.test_settings')
+        super().setUpClass()
+
+
+class RatingAggregatesMixin:
+    
+    def assertAggregatesMatchRebuild(self):
+        """The incrementally maintained aggregates equal a rebuild from the Review table"""
+        maintained = stored_ratings()
+        rebuild_rating_aggregates()
+        self.assertEqual(maintained, stored_ratings())
+
+
+class RatingAggregateTests(RatingAggregatesMixin, TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([User(username=f'reviewer-{i}') for i in range(3)])
+        cls.alps = make_destination('Alps')
+        cls.coast = make_destination('Coast')
+    
+    def review(self, user, destination, rating):
+        return Review.objects.create(user=user, destination=destination, rating=rating, comment='Lovely')
+    
+    def test_create(self):
+        for user, rating in zip(self.users, (5, 4, 4)):
+            self.review(user, self.alps, rating)
+        self.alps.refresh_from_db()
+        self.assertEqual((self.alps.rating_count, self.alps.rating_sum), (3, 13))
+        self.assertAlmostEqual(self.alps.rating_avg, 13 / 3)
+        self.assertEqual(self.alps.rating_histogram(), {1: 0, 2: 0, 3: 0, 4: 2, 5: 1})
+        self.assertAggregatesMatchRebuild()
+    
+    def test_update(self):
+        review = self.review(self.users[0], self.alps, 2)
+        self.review(self.users[1], self.alps, 4)
+        review.rating = 5
+        review.save()
+        # Loaded without its rating: the stored one is looked up before saving
+        deferred = Review.objects.defer('rating').get(pk=review.pk)
+        deferred.rating = 1
+        deferred.save()
+        self.alps.refresh_from_db()
+        self.assertEqual((self.alps.rating_count, self.alps.rating_sum), (2, 5))
+        self.assertEqual(self.alps.rating_histogram(), {1: 1, 2: 0, 3: 0, 4: 1, 5: 0})
+        self.assertAggregatesMatchRebuild()
+    
+    def test_move_to_another_destination(self):
+        review = self.review(self.users[0], self.alps, 3)
+        self.review(self.users[1], self.alps, 5)
+        review.destination = self.coast
+        review.rating = 4
+        review.save()
+        self.alps.refresh_from_db()
+        self.coast.refresh_from_db()
+        self.assertEqual((self.alps.rating_count, self.alps.rating_avg), (1, 5.0))
+        self.assertEqual((self.coast.rating_count, self.coast.rating_avg), (1, 4.0))
+        self.assertAggregatesMatchRebuild()
+    
+    def test_delete(self):
+        first = self.review(self.users[0], self.alps, 3)
+        second = self.review(self.users[1], self.alps, 5)
+        first.delete()
+        self.alps.refresh_from_db()
+        self.assertEqual((self.alps.rating_count, self.alps.rating_avg, self.alps.rating_3_count), (1, 5.0, 0))
+        second.delete()
+        self.alps.refresh_from_db()
+        self.assertEqual((self.alps.rating_count, self.alps.rating_sum, self.alps.rating_avg), (0, 0, 0.0))
+        self.assertAggregatesMatchRebuild()
+    
+    def test_rebuild_refreshes_cached_pages(self):
+        self.review(self.users[0], self.alps, 4)
+        # Aggregates gone wrong without any signal, e.g. after a raw SQL import
+        Destination.objects.filter(pk=self.alps.pk).update(rating_count=0, rating_sum=0, rating_avg=0, rating_4_count=0)
+        cache.clear()
+        urls = [reverse('destinations'), reverse('destination_detail', args=[self.alps.pk])]
+        for url in urls:
+            self.assertNotContains(self.client.get(url), '4.0/5')
+            self.assertEqual(self.client.get(url)['X-View-Cache'], 'hit')
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_rating_aggregates()
+        for url in urls:
+            self.assertContains(self.client.get(url), '4.0/5')
+
+
+class ConcurrentRatingAggregateTests(MultipleConnectionsMixin, RatingAggregatesMixin, TransactionTestCase):
+    
+    def test_concurrent_reviews_lose_no_update(self):
+        destination = make_destination('Alps')
+        users = User.objects.bulk_create([User(username=f'reviewer-{i}') for i in range(8)])
+        barrier = threading.Barrier(len(users))
+        errors = []
+        
+        def review(user, rating):
+            try:
+                barrier.wait()
+                created = Review.objects.create(user=user, destination=destination, rating=rating, comment='Lovely')
+                barrier.wait()
+                created.rating = 6 - rating
+                created.save()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=review, args=(user, i % 5 + 1)) for i, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        destination.refresh_from_db()
+        self.assertEqual(destination.rating_count, len(users))
+        self.assertAggregatesMatchRebuild()
+
+
+class QueryBudgetTests(TestCase):
+    """Listing pages run no more than their view's query_budget, whatever the page size"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='traveller')
+        reviewers = User.objects.bulk_create([User(username=f'reviewer-{i}') for i in range(3)])
+        for i in range(30):
+            destination = make_destination(
+                f'Destination {i}', price=100 + i, offer=i % 3 == 0, location=f'Location {i % 5}',
+            )
+            Wishlist.objects.create(user=cls.user, destination=destination)
+            Booking.objects.create(
+                user=cls.user, destination=destination, travel_date='2030-01-01', number_of_travelers=2,
+            )
+            for reviewer in reviewers:
+                Review.objects.create(user=reviewer, destination=destination, rating=i % 5 + 1, comment='Lovely')
+            BlogPost.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', content='Travel tips ' * 20,
+                image='blog/post.jpg', author=reviewers[i % 3],
+            )
+    
+    def setUp(self):
+        self.client.force_login(self.user)
+    
+    def assertWithinBudget(self, view, url, context_name):
+        for page_size in (3, 20):
+            with self.subTest(page_size=page_size):
+                # Cold caches, the worst case a budget has to cover
+                cache.clear()
+                currency.rate_table.invalidate()
+                images.manifest_holder.invalidate()
+                with mock.patch.object(view, 'paginate_by', page_size), self.assertNumQueries(view.query_budget):
+                    response = self.client.get(url)
+                self.assertEqual(len(response.context[context_name]), page_size)
+    
+    def test_destinations(self):
+        self.assertWithinBudget(views.DestinationListView, reverse('destinations'), 'destinations')
+    
+    def test_wishlist(self):
+        self.assertWithinBudget(views.WishlistView, reverse('wishlist'), 'wishlist_items')
+    
+    def test_my_trips(self):
+        self.assertWithinBudget(views.MyTripsView, reverse('my_trips'), 'bookings')
+    
+    def test_blog(self):
+        self.assertWithinBudget(views.BlogListView, reverse('blog'), 'blog_posts')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 search is SQLite only')
+class SQLiteFullTextSearchTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.lake = make_destination('Lake Bled', location='Slovenia', desc='An island church in an alpine lake')
+        cls.alps = make_destination('Julian Alps', location='Slovenia', desc='Peaks above the lakes of the valley')
+        cls.coast = make_destination('Piran', location='Slovenia', desc='Venetian streets by the sea')
+    
+    def search(self, query):
+        return search.search(Destination.objects.all(), query).order_by('-search_rank', 'id')
+    
+    def test_ranks_and_highlights_matches(self):
+        results = list(self.search('lake'))
+        # A match in the name outweighs one in the description; "lakes" matches the prefix
+        self.assertEqual(results, [self.lake, self.alps])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+        self.assertIn(f'{search.HIGHLIGHT_START}lake{search.HIGHLIGHT_STOP}', results[0].search_snippet)
+    
+    def test_every_match_is_ranked(self):
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            self.assertEqual(self.search('slovenia').count(), 3)
+    
+    def test_query_syntax_is_not_interpreted(self):
+        # Every word, OR included, is a term that has to match
+        self.assertEqual(list(self.search('lake OR sea')), [])
+        self.assertEqual(list(self.search('"lake')), [self.lake, self.alps])
+    
+    @override_settings(KEYSET_PAGINATION=True)
+    def test_pages_through_ranked_results(self):
+        names = []
+        params = {'query': 'slovenia'}
+        with mock.patch.object(views.DestinationListView, 'paginate_by', 2):
+            while True:
+                page = self.client.get(reverse('destinations'), params).context['page_obj']
+                names += [destination.name for destination in page]
+                if not page.has_next():
+                    break
+                params['cursor'] = page.next_cursor
+        self.assertCountEqual(names, ['Lake Bled', 'Julian Alps', 'Piran'])
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'needs full-text search')
+class SearchBackendParityTests(TestCase):
+    """The database search (PostgreSQL or SQLite, whichever runs the tests) and the in-memory index agree"""
+    
+    QUERIES = {
+        'lak': ['Lake Bled', 'Julian Alps'],
+        'julian alp': ['Julian Alps'],
+        'slov': ['Lake Bled', 'Julian Alps', 'Piran'],
+        'church lake': ['Lake Bled'],
+        'venetian sea': ['Piran'],
+        'lake sea': [],
+    }
+    
+    @classmethod
+    def setUpTestData(cls):
+        make_destination('Lake Bled', location='Slovenia', desc='An island church in an alpine lake')
+        make_destination('Julian Alps', location='Slovenia', desc='Peaks above the lakes of the valley')
+        make_destination('Piran', location='Slovenia', desc='Venetian streets by the sea')
+    
+    def setUp(self):
+        search_index.index_holder.reset()
+        self.addCleanup(search_index.index_holder.reset)
+    
+    def matches(self, query):
+        return sorted(search.search(Destination.objects.all(), query).values_list('name', flat=True))
+    
+    def test_every_term_matches_as_a_prefix(self):
+        for backend in ('database', 'memory'):
+            with self.settings(SEARCH_BACKEND=backend):
+                for query, names in self.QUERIES.items():
+                    with self.subTest(backend=backend, query=query):
+                        self.assertEqual(self.matches(query), sorted(names))
+    
+    def test_postgresql_query_text(self):
+        self.assertEqual(search._prefix_tsquery(['lake', 'bled']), "'lake':* & 'bled':*")
+
+
+@override_settings(SEARCH_BACKEND='memory')
+class InMemorySearchIndexTests(TestCase):
+    
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.snapshot = os.path.join(directory, 'search_index.json.gz')
+        settings = self.settings(SEARCH_INDEX_SNAPSHOT=self.snapshot)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        search_index.index_holder.reset()
+        self.addCleanup(search_index.index_holder.reset)
+    
+    def hits(self, query):
+        return [doc_id for doc_id, _ in search_index.index_holder.search(query)]
+    
+    def test_changes_apply_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lagoon = make_destination('Blue Lagoon')
+        try:
+            with transaction.atomic():
+                make_destination('Phantom Lagoon')
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.assertEqual(self.hits('lagoon'), [lagoon.pk])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            lagoon.delete()
+        self.assertEqual(self.hits('lagoon'), [])
+    
+    def test_journal_is_compacted(self):
+        with mock.patch.object(search_index, 'JOURNAL_MAX_BYTES', 8):
+            with self.captureOnCommitCallbacks(execute=True):
+                fjords = [make_destination(f'Fjord {i}') for i in range(5)]
+        journal = search_index.index_holder.journal_path
+        self.assertLessEqual(os.path.getsize(journal), 8)
+        
+        # A new worker starts from the snapshot and what is left of the journal
+        worker = search_index.IndexHolder()
+        self.assertCountEqual([doc_id for doc_id, _ in worker.search('fjord')], [d.pk for d in fjords])
+    
+    def test_snapshot_of_an_edited_table_is_rebuilt(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lagoon = make_destination('Blue Lagoon')
+        self.assertEqual(self.hits('lagoon'), [lagoon.pk])
+        # Same rows and ids, but edited without signals
+        Destination.objects.filter(pk=lagoon.pk).update(name='Blue Grotto', desc='Blue Grotto and its surroundings')
+        worker = search_index.IndexHolder()
+        self.assertEqual([doc_id for doc_id, _ in worker.search('grotto')], [lagoon.pk])
+        self.assertEqual(worker.search('lagoon'), [])
+    
+    def test_typo_matching_skips_distant_prefixes(self):
+        syllables = [consonant + vowel for consonant in 'bdklmnprst' for vowel in 'aeiou']
+        vocabulary = sorted(''.join(word) for word in itertools.product(syllables, repeat=3))
+        with mock.patch.object(search_index, '_next_row', wraps=search_index._next_row) as next_row:
+            matches = search_index.typo_matches('kalimo', vocabulary, 1)
+        # Every term has six letters, so only substitutions are within one edit
+        self.assertEqual(matches, [term for term in vocabulary if sum(map(str.__ne__, term, 'kalimo')) <= 1])
+        # Far fewer rows than the 750,000 of comparing against each of the 125,000 terms
+        self.assertLess(next_row.call_count, 1000)
+        self.assertEqual(search_index.typo_matches('lkae', ['lake', 'lakes', 'leak', 'like'], 1), ['lake'])
+        self.assertEqual(search_index.typo_matches('lakse', ['lake', 'lakes', 'leak', 'like'], 1), ['lake', 'lakes'])
+
+
+class SuggestionIndexTests(TestCase):
+    
+    def test_rebuilds_in_the_background(self):
+        holder = suggest._Holder()
+        old = suggest.SuggestionIndex([(1, 'Old Town', None, False)])
+        new = suggest.SuggestionIndex([(1, 'New Town', None, False)])
+        release = threading.Event()
+        
+        def slow_build():
+            release.wait(5)
+            return new
+        
+        with mock.patch.object(suggest.SuggestionIndex, 'from_database', return_value=old):
+            self.assertIs(holder.get(), old)
+        holder.invalidate()
+        with mock.patch.object(suggest.SuggestionIndex, 'from_database', side_effect=slow_build):
+            # The lookup doesn't wait for the rebuild it started
+            self.assertIs(holder.get(), old)
+            self.assertIs(holder.get(), old)
+            release.set()
+            for _ in range(100):
+                if not holder.rebuilding:
+                    break
+                time.sleep(0.01)
+        self.assertIs(holder.get(), new)
+
+
+@override_settings(BASE_CURRENCY='USD', DEFAULT_CURRENCY='USD')
+class ViewCacheTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('traveller', password='secret')
+        cls.alps = make_destination('Alps')
+    
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+    
+    def test_hit_and_miss(self):
+        first = self.client.get(reverse('destinations'))
+        self.assertEqual(first['X-View-Cache'], 'miss')
+        second = self.client.get(reverse('destinations'))
+        self.assertEqual(second['X-View-Cache'], 'hit')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        # Another query string is another page
+        self.assertEqual(self.client.get(reverse('destinations'), {'query': 'alps'})['X-View-Cache'], 'miss')
+    
+    def test_writes_bump_namespaces_on_commit_only(self):
+        url = reverse('destinations')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    make_destination('Dolomites')
+                    raise _Rollback
+            except _Rollback:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.client.get(url)['X-View-Cache'], 'hit')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_destination('Dolomites')
+        response = self.client.get(url)
+        self.assertEqual(response['X-View-Cache'], 'miss')
+        self.assertContains(response, 'Dolomites')
+    
+    def test_authenticated_pages_are_per_session(self):
+        url = reverse('destinations')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url)['X-View-Cache'], 'miss')
+        self.assertEqual(self.client.get(url)['X-View-Cache'], 'hit')
+        other_session = self.client_class()
+        other_session.force_login(self.user)
+        self.assertEqual(other_session.get(url)['X-View-Cache'], 'miss')
+        # Anonymous visitors never see a signed-in page
+        self.assertEqual(self.client_class().get(url)['X-View-Cache'], 'miss')
+    
+    def test_pending_messages_bypass_the_cache(self):
+        url = reverse('destinations')
+        self.client.force_login(self.user)
+        self.client.post(reverse('add_review', args=[self.alps.pk]), {'rating': 9})
+        response = self.client.get(url)
+        self.assertContains(response, 'Please correct the errors in your review.')
+        self.assertNotIn('X-View-Cache', response)
+        # The message was shown once, and the page without it is cached
+        response = self.client.get(url)
+        self.assertEqual(response['X-View-Cache'], 'miss')
+        self.assertNotContains(response, 'Please correct the errors in your review.')
+    
+    def test_responses_setting_cookies_are_not_stored(self):
+        def set_cookie(request):
+            response = HttpResponse('Hello')
+            response.set_cookie('seen', '1')
+            return response
+        view = cache_view(['test'])(set_cookie)
+        for _ in range(2):
+            request = self.factory.get('/')
+            request.user = AnonymousUser()
+            self.assertNotIn('X-View-Cache', view(request))
+    
+    def test_hit_restores_headers(self):
+        def localized(request):
+            response = HttpResponse('{"hello": "Hallo"}', content_type='application/json')
+            response['Content-Language'] = 'de'
+            patch_vary_headers(response, ['Accept-Language'])
+            return response
+        view = cache_view(['test'])(localized)
+        responses = []
+        for _ in range(2):
+            request = self.factory.get('/')
+            request.user = AnonymousUser()
+            responses.append(view(request))
+        miss, hit = responses
+        self.assertEqual((miss['X-View-Cache'], hit['X-View-Cache']), ('miss', 'hit'))
+        self.assertEqual(hit.content, miss.content)
+        for header in ('Content-Type', 'Content-Language', 'Vary'):
+            self.assertEqual(hit[header], miss[header])
+    
+    def test_signed_in_detail_page_cached_once_csrf_cookie_set(self):
+        url = reverse('destination_detail', args=[self.alps.pk])
+        self.client.force_login(self.user)
+        # The first page sets the CSRF cookie, so it is not stored
+        response = self.client.get(url)
+        self.assertNotIn('X-View-Cache', response)
+        self.assertIn('csrftoken', response.cookies)
+        self.assertEqual(self.client.get(url)['X-View-Cache'], 'miss')
+        response = self.client.get(url)
+        self.assertEqual(response['X-View-Cache'], 'hit')
+        self.assertContains(response, '<input type="hidden" name="csrfmiddlewaretoken">', html=True)
+
+
+class LocalPriceTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        ExchangeRate.objects.create(currency='EUR', rate='0.5')
+        cls.dollars = make_destination('Dollars', price=100, currency='USD')
+        cls.euros = make_destination('Euros', price=100, currency='EUR')
+        # No rate loaded for it
+        cls.unknown = make_destination('Unknown', price=150, currency='XYZ')
+    
+    def setUp(self):
+        cache.clear()
+        currency.rate_table.invalidate()
+    
+    def names(self, **params):
+        response = self.client.get(reverse('destinations'), params)
+        return [destination.name for destination in response.context['destinations']]
+    
+    def test_unknown_currency_prices_are_filtered_as_stored(self):
+        self.assertCountEqual(self.names(min_price=120, max_price=250), ['Euros', 'Unknown'])
+        self.assertCountEqual(self.names(max_price=120), ['Dollars'])
+    
+    def test_unknown_currency_prices_sort_last(self):
+        self.assertEqual(self.names(sort='price'), ['Dollars', 'Euros', 'Unknown'])
+        self.assertEqual(self.names(sort='-price'), ['Euros', 'Dollars', 'Unknown'])
+    
+    @override_settings(KEYSET_PAGINATION=True)
+    def test_unknown_currency_prices_sort_last_across_pages(self):
+        with mock.patch.object(views.DestinationListView, 'paginate_by', 2):
+            response = self.client.get(reverse('destinations'), {'sort': 'price'})
+            cursor = response.context['page_obj'].next_cursor
+            response = self.client.get(reverse('destinations'), {'sort': 'price', 'cursor': cursor})
+        self.assertEqual([destination.name for destination in response.context['destinations']], ['Unknown'])
+
+
+class CardFragmentTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reviewer')
+        ExchangeRate.objects.create(currency='EUR', rate='0.5')
+        cls.alps = make_destination('Alps', price=100)
+        cls.coast = make_destination('Coast', price=80)
+    
+    def setUp(self):
+        cache.clear()
+        currency.rate_table.invalidate()
+    
+    def cards(self, currency='USD', authenticated=False):
+        """{name: card html} and the number of cards rendered rather than taken from the cache"""
+        destinations = Destination.objects.only(*DESTINATION_CARD_FIELDS).order_by('name')
+        with mock.patch.object(fragments, 'render_to_string', wraps=render_to_string) as render:
+            destinations = fragments.attach_card_html(
+                destinations, 'includes/destination_card.html', authenticated, currency,
+            )
+        return {destination.name: destination.card_html for destination in destinations}, render.call_count
+    
+    def test_cards_are_reused(self):
+        html, rendered = self.cards()
+        self.assertEqual(rendered, 2)
+        self.assertEqual(self.cards(), (html, 0))
+        # Signed-in visitors get the Book Now variant
+        self.assertEqual(self.cards(authenticated=True)[1], 2)
+    
+    def test_destination_change_rerenders_its_card(self):
+        html, _ = self.cards()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alps.desc = 'Peaks and glaciers'
+            self.alps.save()
+        changed, rendered = self.cards()
+        self.assertEqual(rendered, 1)
+        self.assertIn('Peaks and glaciers', changed['Alps'])
+        self.assertEqual(changed['Coast'], html['Coast'])
+    
+    def test_rating_change_rerenders_its_card(self):
+        self.cards()
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.user, destination=self.alps, rating=4, comment='Lovely')
+        html, rendered = self.cards()
+        self.assertEqual(rendered, 1)
+        self.assertIn('4.0/5', html['Alps'])
+    
+    def test_currency_and_exchange_rates_select_the_variant(self):
+        dollars, _ = self.cards()
+        euros, rendered = self.cards('EUR')
+        self.assertEqual(rendered, 2)
+        self.assertNotEqual(euros['Alps'], dollars['Alps'])
+        self.assertEqual(self.cards('EUR'), (euros, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            rate = ExchangeRate.objects.get(currency='EUR')
+            rate.rate = '0.25'
+            rate.save()
+        html, rendered = self.cards('EUR')
+        self.assertEqual(rendered, 2)
+        self.assertNotEqual(html['Alps'], euros['Alps'])
+        # Prices in dollars are unchanged, but every card's key carries the rates version
+        self.assertEqual(self.cards()[1], 2)
+
+
+class FacetTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        ExchangeRate.objects.create(currency='EUR', rate='0.5')
+        ratings = {}
+        for name, location, price, code, rating in (
+            ('Alps', 'Switzerland', 80, 'USD', 4.5),
+            ('Zermatt', 'Switzerland', 300, 'USD', 3.2),
+            ('Paris', 'France', 100, 'EUR', 4.0),
+            # No rate loaded for it: counted at its stored price
+            ('Atlantis', 'Ocean', 150, 'XYZ', 0),
+            ('Coast', None, 1200, 'USD', 2.5),
+        ):
+            ratings[make_destination(name, location=location, price=price, currency=code).pk] = rating
+        for pk, rating in ratings.items():
+            Destination.objects.filter(pk=pk).update(rating_avg=rating)
+    
+    def setUp(self):
+        cache.clear()
+        currency.rate_table.invalidate()
+        currency.get_rates()
+    
+    def count(self, data):
+        return facets.count_facets(Destination.objects.all(), data, 'USD')
+    
+    def test_counts_match_filtered_querysets(self):
+        for data in ({}, {'location': 'switzerland'}, {'min_rating': '4'}, {'max_price': 249, 'location': 'France'}):
+            with self.subTest(data=data):
+                counts = self.count(data)
+                conditions = facets.filter_conditions(data, 'USD')
+                
+                def matching(*extra, ignore=None):
+                    condition = Q()
+                    for name, facet_condition in conditions.items():
+                        if name != ignore:
+                            condition &= facet_condition
+                    for other in extra:
+                        condition &= other
+                    return Destination.objects.filter(condition).count()
+                
+                self.assertEqual(counts['total'], matching())
+                for location in counts['locations']:
+                    self.assertEqual(location['count'], matching(Q(location=location['value']), ignore='location'))
+                for bucket in counts['prices']:
+                    bucket_q = price_range_q(bucket['min'], bucket['max'], 'USD')
+                    self.assertEqual(bucket['count'], matching(bucket_q, ignore='price'))
+                for bucket in counts['ratings']:
+                    self.assertEqual(bucket['count'], matching(Q(rating_avg__gte=bucket['stars']), ignore='rating'))
+    
+    def test_counts(self):
+        counts = self.count({'min_rating': '4'})
+        self.assertEqual(counts['total'], 2)
+        self.assertEqual(
+            [(location['value'], location['count']) for location in counts['locations']],
+            [('France', 1), ('Switzerland', 1)],
+        )
+        # Paris costs 200 dollars
+        self.assertEqual([bucket['count'] for bucket in counts['prices']], [1, 1, 0, 0, 0])
+        # Atlantis joins it at its stored price of 150
+        self.assertEqual([bucket['count'] for bucket in self.count({})['prices']], [1, 2, 1, 0, 1])
+        self.assertEqual([bucket['count'] for bucket in counts['ratings']], [2, 3, 4, 4])
+        self.assertEqual([bucket['selected'] for bucket in counts['ratings']], [True, False, False, False])
+    
+    def test_one_query_then_cached_until_destinations_change(self):
+        with self.assertNumQueries(1):
+            counts = self.count({'location': 'switzerland'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count({'location': 'switzerland'}), counts)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_destination('Davos', location='Switzerland', price=120)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.count({'location': 'switzerland'})['total'], counts['total'] + 1)
+
+
+class InventoryTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='traveller')
+        cls.destination = make_destination('Alps', seats_per_date=4)
+        cls.date = datetime.date(2030, 1, 1)
+    
+    def book(self, travellers, date=None):
+        return inventory.atomic_with_retry(lambda: Booking.objects.create(
+            user=self.user, destination=self.destination, travel_date=date or self.date,
+            number_of_travelers=travellers,
+        ))
+    
+    def reserved(self, date=None):
+        return DepartureInventory.objects.get(destination=self.destination, travel_date=date or self.date).reserved
+    
+    def test_overbooking_is_refused(self):
+        self.book(3)
+        with self.assertRaises(inventory.SoldOut) as raised:
+            self.book(2)
+        self.assertEqual(raised.exception.available, 1)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(self.reserved(), 3)
+        self.book(1)
+        self.assertEqual(self.reserved(), 4)
+    
+    def test_cancelling_releases_seats(self):
+        booking = self.book(4)
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertEqual(self.reserved(), 0)
+        self.book(3)
+        Booking.objects.get(pk=booking.pk).delete()
+        self.assertEqual(self.reserved(), 3)
+    
+    def test_moving_a_booking_moves_its_seats(self):
+        later = self.date + datetime.timedelta(days=1)
+        booking = self.book(2)
+        booking.travel_date = later
+        booking.number_of_travelers = 4
+        booking.save()
+        self.assertEqual((self.reserved(), self.reserved(later)), (0, 4))
+    
+    def test_contention_is_not_reported_as_sold_out(self):
+        self.book(1)
+        # Free seats on every read, taken again before every UPDATE
+        with mock.patch.object(inventory, '_take', return_value=0):
+            with self.assertRaises(inventory.InventoryBusy):
+                self.book(1)
+        self.assertEqual(self.reserved(), 1)
+
+
+class BookingConfirmationTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='traveller')
+        cls.alps = make_destination('Alps', seats_per_date=10)
+        cls.date = datetime.date(2030, 1, 1)
+    
+    def book(self, travel_date=None, **fields):
+        return Booking.objects.create(
+            user=self.user, destination=self.alps, travel_date=travel_date or self.date, number_of_travelers=1, **fields
+        )
+    
+    def test_new_bookings_are_queued_in_their_transaction(self):
+        booking = self.book()
+        self.assertEqual(list(BookingConfirmationJob.objects.values_list('booking_id', flat=True)), [booking.pk])
+        try:
+            with transaction.atomic():
+                self.book()
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.assertEqual(BookingConfirmationJob.objects.count(), 1)
+        # Only pending bookings need confirming
+        self.book(status='confirmed')
+        self.assertEqual(BookingConfirmationJob.objects.count(), 1)
+    
+    def test_process_batch(self):
+        past = timezone.localdate() - datetime.timedelta(days=1)
+        pending, expired = self.book(), self.book(past)
+        cancelled, confirmed = self.book(), self.book()
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        Booking.objects.filter(pk=confirmed.pk).update(status='confirmed')
+        
+        result = confirmations.process_batch()
+        self.assertEqual((result.jobs, result.confirmed, result.cancelled, result.skipped), (4, 1, 1, 2))
+        statuses = dict(Booking.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[booking.pk] for booking in (pending, expired, cancelled, confirmed)],
+            ['confirmed', 'cancelled', 'cancelled', 'confirmed'],
+        )
+        # The expired booking gave its seats back
+        self.assertEqual(DepartureInventory.objects.get(destination=self.alps, travel_date=past).reserved, 0)
+        self.assertFalse(BookingConfirmationJob.objects.exists())
+        self.assertEqual(confirmations.process_batch().jobs, 0)
+    
+    def test_batches_take_oldest_jobs_first(self):
+        bookings = [self.book() for _ in range(3)]
+        self.assertEqual(confirmations.process_batch(batch_size=2).jobs, 2)
+        self.assertEqual(
+            list(Booking.objects.filter(status='pending').values_list('pk', flat=True)), [bookings[2].pk],
+        )
+    
+    def test_command_drains_queue(self):
+        for _ in range(5):
+            self.book()
+        # Made before the worker existed
+        unqueued = self.book()
+        BookingConfirmationJob.objects.filter(booking=unqueued).delete()
+        out = io.StringIO()
+        call_command('process_booking_confirmations', once=True, enqueue_pending=True, batch_size=2, stdout=out)
+        self.assertFalse(BookingConfirmationJob.objects.exists())
+        self.assertFalse(Booking.objects.filter(status='pending').exists())
+        self.assertIn('Queued 1 pending bookings', out.getvalue())
+        self.assertIn('Processed 6 jobs', out.getvalue())
+
+
+class IdempotentBookingTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='traveller')
+        cls.destination = make_destination('Alps')
+    
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('book_destination', args=[self.destination.pk])
+        self.key = str(uuid.uuid4())
+    
+    def submit(self, travellers=2):
+        return self.client.post(self.url, {
+            'travel_date': '2030-01-01', 'number_of_travelers': travellers, 'idempotency_key': self.key,
+        })
+    
+    def test_replayed_key_returns_the_first_booking(self):
+        first = self.submit()
+        replay = self.submit()
+        booking = Booking.objects.get()
+        self.assertRedirects(first, reverse('booking_success', args=[booking.pk]), fetch_redirect_response=False)
+        self.assertRedirects(replay, reverse('booking_success', args=[booking.pk]), fetch_redirect_response=False)
+        self.assertEqual(DepartureInventory.objects.get().reserved, 2)
+    
+    def test_key_reused_with_other_details_is_refused(self):
+        self.submit(travellers=2)
+        response = self.submit(travellers=3)
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.get().number_of_travelers, 2)
+        self.assertEqual(DepartureInventory.objects.get().reserved, 2)
+        with self.assertRaises(idempotency.KeyReused):
+            idempotency.find_booking_id(self.user, self.key, idempotency.fingerprint('other'))
+    
+    def test_keys_are_per_user(self):
+        self.submit()
+        self.client.force_login(User.objects.create_user(username='companion'))
+        self.submit()
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+@override_settings(IMAGE_RENDITION_WIDTHS=(32,), IMAGE_RENDITION_FORMATS=('webp', 'jpeg'))
+class RenditionQueueTests(TestCase):
+    
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = self.settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        images.manifest_holder.invalidate()
+        self.addCleanup(images.manifest_holder.invalidate)
+        data = io.BytesIO()
+        Image.new('RGB', (64, 48), 'teal').save(data, 'JPEG')
+        self.source = default_storage.save('pics/lake.jpg', ContentFile(data.getvalue()))
+    
+    def queued(self):
+        return list(ImageRenditionJob.objects.values_list('source', flat=True))
+    
+    def test_saving_queues_instead_of_encoding(self):
+        with mock.patch.object(images, 'generate') as generate, self.captureOnCommitCallbacks(execute=True):
+            Destination.objects.create(name='Lake', img=self.source, desc='Lake', price=100)
+        generate.assert_not_called()
+        self.assertEqual(self.queued(), [self.source])
+    
+    def test_rolled_back_upload_is_not_queued(self):
+        try:
+            with transaction.atomic():
+                Destination.objects.create(name='Lake', img=self.source, desc='Lake', price=100)
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.assertEqual(self.queued(), [])
+    
+    def test_worker_generates_queued_renditions(self):
+        rendition_queue.enqueue(self.source)
+        self.assertEqual(rendition_queue.process_batch(), 1)
+        self.assertEqual(self.queued(), [])
+        rendition_set = ImageRenditionSet.objects.get(source=self.source)
+        self.assertEqual((rendition_set.width, rendition_set.height), (64, 48))
+        self.assertEqual({image_format for image_format, _, _ in rendition_set.renditions}, {'webp', 'jpeg'})
+        # Current renditions are found in the manifest and not queued again
+        images.manifest_holder.invalidate()
+        rendition_queue.enqueue(self.source)
+        self.assertEqual(self.queued(), [])
+    
+    def test_image_queued_again_while_encoding_is_kept(self):
+        rendition_queue.enqueue(self.source)
+        with mock.patch.object(images, 'generate', side_effect=rendition_queue.enqueue):
+            rendition_queue.process_batch()
+        self.assertEqual(self.queued(), [self.source])
+        self.assertEqual(rendition_queue.process_batch(), 1)
+    
+    def test_abandoned_claims_are_taken_over(self):
+        rendition_queue.enqueue(self.source)
+        self.assertEqual(len(rendition_queue.claim()), 1)
+        self.assertEqual(rendition_queue.claim(), [])
+        ImageRenditionJob.objects.update(claimed_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(len(rendition_queue.claim()), 1)
+    
+    def test_failed_job_is_retried_after_claim_timeout(self):
+        rendition_queue.enqueue(self.source)
+        with mock.patch.object(images, 'generate', side_effect=OSError('storage unavailable')), \
+                self.assertLogs('beyondborders.rendition_queue', 'WARNING'):
+            self.assertEqual(rendition_queue.process_batch(), 1)
+        self.assertEqual(self.queued(), [self.source])
+        self.assertEqual(rendition_queue.claim(), [])
+        ImageRenditionJob.objects.update(claimed_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(rendition_queue.process_batch(), 1)
+        self.assertEqual(self.queued(), [])
+    
+    def test_undecodable_or_missing_upload_is_dropped(self):
+        broken = default_storage.save('pics/broken.jpg', ContentFile(b'not an image'))
+        rendition_queue.enqueue(broken, 'pics/gone.jpg')
+        with self.assertLogs('beyondborders.rendition_queue', 'WARNING') as logs:
+            self.assertEqual(rendition_queue.process_batch(), 2)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(self.queued(), [])
+        self.assertFalse(ImageRenditionSet.objects.exists())
+    
+    def test_generating_invalidates_only_pages_showing_the_image(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            lake = Destination.objects.create(name='Lake', img=self.source, desc='Lake', price=100)
+        urls = [reverse('destinations'), reverse('blog'), reverse('destination_detail', args=[lake.pk])]
+        for url in urls:
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-View-Cache'], 'hit')
+        with self.captureOnCommitCallbacks(execute=True):
+            rendition_queue.process_batch()
+        self.assertEqual([self.client.get(url)['X-View-Cache'] for url in urls], ['hit', 'hit', 'miss'])
+
+
+class BulkImportExportTests(TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = self.settings(MEDIA_ROOT=os.path.join(self.root, 'media'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.images_dir = os.path.join(self.root, 'incoming')
+        os.makedirs(self.images_dir)
+        for name in ('coast.jpg', 'lakes.jpg'):
+            Image.new('RGB', (8, 8)).save(os.path.join(self.images_dir, name))
+    
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+    
+    def test_import_creates_and_updates_by_natural_key(self):
+        alps = make_destination('Alps', location='Switzerland')
+        make_destination('Alps', location='Austria', price=90)
+        path = self.write('destinations.csv', (
+            'name,location,price,offer\n'
+            'Alps,Switzerland,120,yes\n'
+        ))
+        call_command('import_destinations', path, stdout=io.StringIO())
+        path = self.write('destinations.jsonl', (
+            '{"name": "Coast", "desc": "Beaches", "price": "80", "img": "pics/coast.jpg", "currency": "eur"}\n'
+            '{"name": "Alps", "location": "Austria", "price": 95}\n'
+        ))
+        call_command('import_destinations', path, stdout=io.StringIO())
+        alps.refresh_from_db()
+        self.assertEqual((alps.price, alps.offer, alps.desc), (120, True, 'Alps and its surroundings'))
+        self.assertEqual(Destination.objects.get(name='Alps', location='Austria').price, 95)
+        coast = Destination.objects.get(name='Coast')
+        self.assertEqual((coast.price, coast.currency, coast.location), (80, 'EUR', None))
+        self.assertEqual(Destination.objects.count(), 3)
+        # The search documents are refreshed after the bulk writes
+        self.assertEqual([d.name for d in search.search(Destination.objects.all(), 'beaches')], ['Coast'])
+    
+    def test_invalid_rows_are_reported_and_skipped(self):
+        path = self.write('destinations.csv', (
+            'name,desc,price,latitude,img\n'
+            'Coast,Beaches,80,,coast.jpg\n'
+            ',No name,10,,coast.jpg\n'
+            'Lakes,Lakes,cheap,,lakes.jpg\n'
+            'Pole,Ice,10,91,coast.jpg\n'
+            'Lakes,,50,,lakes.jpg\n'
+            'Dunes,Sand,40,,missing.jpg\n'
+        ))
+        errors_path = os.path.join(self.root, 'errors.jsonl')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command(
+            'import_destinations', path, images_dir=self.images_dir, errors=errors_path, stdout=stdout, stderr=stderr,
+        )
+        with open(errors_path) as file:
+            errors = {error['line']: error['errors'] for error in map(json.loads, file)}
+        self.assertEqual(sorted(errors), [3, 4, 5, 6, 7])
+        self.assertIn('name', errors[3])
+        self.assertIn('price', errors[4])
+        self.assertEqual(errors[5], {'latitude': ['Must be between -90 and 90.']})
+        self.assertEqual(errors[6], {'desc': ['This field cannot be blank.']})
+        self.assertIn('img', errors[7])
+        self.assertIn('line 3: name:', stderr.getvalue())
+        self.assertIn('Skipped 5 invalid rows', stdout.getvalue())
+        self.assertEqual(list(Destination.objects.values_list('name', flat=True)), ['Coast'])
+    
+    def test_images_dir_copies_images_of_written_rows_only(self):
+        path = self.write('destinations.jsonl', (
+            '{"name": "Coast", "desc": "Beaches", "price": 80, "img": "coast.jpg"}\n'
+            # Valid as an update, but a new destination needs a description
+            '{"name": "Lakes", "price": 50, "img": "lakes.jpg"}\n'
+        ))
+        options = {'images_dir': self.images_dir, 'stdout': io.StringIO(), 'stderr': io.StringIO()}
+        call_command('import_destinations', path, **options)
+        coast = Destination.objects.get(name='Coast')
+        self.assertEqual(coast.img.name, 'pics/coast.jpg')
+        self.assertTrue(default_storage.exists('pics/coast.jpg'))
+        # The row rejected for its missing description left no file behind
+        self.assertFalse(default_storage.exists('pics/lakes.jpg'))
+        self.assertEqual(list(ImageRenditionJob.objects.values_list('source', flat=True)), ['pics/coast.jpg'])
+        # Importing the same file again reuses the stored copy
+        call_command('import_destinations', path, **options)
+        self.assertEqual(os.listdir(os.path.join(self.root, 'media', 'pics')), ['coast.jpg'])
+    
+    def test_export_streams_bookings_and_reviews(self):
+        alps = make_destination('Alps')
+        users = User.objects.bulk_create([User(username=f'traveller-{i}') for i in range(3)])
+        travel_date = timezone.localdate() + datetime.timedelta(days=30)
+        for user in users:
+            Booking.objects.create(user=user, destination=alps, travel_date=travel_date, number_of_travelers=2)
+            Review.objects.create(user=user, destination=alps, rating=4, comment='Snow, and "more" snow')
+        for kind, model in (('bookings', Booking), ('reviews', Review)):
+            for file_format in bulk_io.FORMATS:
+                with self.subTest(kind=kind, format=file_format):
+                    output = io.StringIO()
+                    # Smaller chunks than rows: the rows are read in several fetches
+                    self.assertEqual(bulk_io.export_rows(kind, output, file_format, chunk_size=2), 3)
+                    output.seek(0)
+                    if file_format == 'csv':
+                        rows = list(csv.DictReader(output))
+                    else:
+                        rows = [json.loads(line) for line in output]
+                    pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+                    self.assertEqual([int(row['id']) for row in rows], pks)
+                    self.assertEqual([row['user'] for row in rows], [user.username for user in users])
+                    self.assertEqual(rows[0]['destination'], 'Alps')
+                    if kind == 'reviews':
+                        self.assertEqual(rows[0]['comment'], 'Snow, and "more" snow')
+                    else:
+                        self.assertEqual(rows[0]['travel_date'], travel_date.isoformat())
+        path = os.path.join(self.root, 'reviews.jsonl')
+        call_command('export_data', 'reviews', output=path, stderr=io.StringIO())
+        with open(path) as file:
+            self.assertEqual(len(file.readlines()), 3)
+
+
+class NearbyDestinationTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.zurich = make_destination('Zurich', latitude=47.37, longitude=8.54)
+        cls.lucerne = make_destination('Lucerne', latitude=47.05, longitude=8.31)
+        cls.milan = make_destination('Milan', latitude=45.46, longitude=9.19)
+        # Either side of the antimeridian, and around the North Pole
+        for name, latitude, longitude in (
+            ('Fiji', -17.7, 178.0), ('Samoa', -13.8, -172.1), ('Tonga', -21.2, -175.2),
+            ('Longyearbyen', 78.22, 15.65), ('Alert', 82.5, -62.35), ('Pole Station', 89.9, 100.0),
+        ):
+            make_destination(name, latitude=latitude, longitude=longitude)
+        make_destination('Nowhere')
+    
+    def setUp(self):
+        cache.clear()
+    
+    def expected(self, lat, lng, radius_km=geo.MAX_DISTANCE_KM):
+        """Names of the destinations within ``radius_km``, nearest first, by checking every row"""
+        distances = [
+            (geo.haversine_km(lat, lng, destination.latitude, destination.longitude), destination.name)
+            for destination in Destination.objects.exclude(latitude=None)
+        ]
+        return [name for distance, name in sorted(distances) if distance <= radius_km]
+    
+    def test_within_matches_a_full_scan(self):
+        for lat, lng, radius in (
+            (47.0, 8.5, 300), (47.0, 8.5, 2000),
+            # The search circle crosses the antimeridian, from either side
+            (-17.0, 179.9, 1500), (-17.0, -179.9, 1500), (-17.7, 178.0, 900),
+            # Close enough to the pole for the box to span every longitude
+            (85.0, 0.0, 1200), (89.0, -170.0, 500), (-89.0, 0.0, 1000),
+        ):
+            with self.subTest(lat=lat, lng=lng, radius=radius):
+                found = list(geo.within(Destination.objects.all(), lat, lng, radius))
+                self.assertEqual([destination.name for destination in found], self.expected(lat, lng, radius))
+                for destination in found:
+                    self.assertAlmostEqual(
+                        destination.distance_km,
+                        geo.haversine_km(lat, lng, destination.latitude, destination.longitude), places=6,
+                    )
+        # Tonga and Samoa are 810 and 1140 km east of Fiji, across the antimeridian
+        self.assertEqual(
+            [destination.name for destination in geo.within(Destination.objects.all(), -17.7, 178.0, 1200)],
+            ['Fiji', 'Tonga', 'Samoa'],
+        )
+    
+    def test_nearest(self):
+        nearest = geo.nearest(Destination.objects.exclude(pk=self.zurich.pk), 47.37, 8.54, limit=2)
+        self.assertEqual([destination.name for destination in nearest], ['Lucerne', 'Milan'])
+        # Widened until enough are found, however far
+        nearest = geo.nearest(Destination.objects.all(), -17.0, -179.9, limit=5)
+        self.assertEqual([destination.name for destination in nearest], self.expected(-17.0, -179.9)[:5])
+        # Never beyond max_radius_km
+        nearest = geo.nearest(Destination.objects.all(), 47.37, 8.54, limit=5, max_radius_km=100)
+        self.assertEqual([destination.name for destination in nearest], ['Zurich', 'Lucerne'])
+    
+    def test_nearby_endpoint(self):
+        url = reverse('nearby_destinations')
+        results = self.client.get(url, {'lat': 47.37, 'lng': 8.54, 'limit': 3}).json()['results']
+        self.assertEqual([result['name'] for result in results], ['Zurich', 'Lucerne', 'Milan'])
+        self.assertEqual(results[1]['url'], reverse('destination_detail', args=[self.lucerne.pk]))
+        results = self.client.get(url, {'lat': 47.37, 'lng': 8.54, 'radius': 100}).json()['results']
+        self.assertEqual([result['name'] for result in results], ['Zurich', 'Lucerne'])
+        # Around a destination, without the destination itself
+        results = self.client.get(url, {'destination': self.zurich.pk, 'limit': 2}).json()['results']
+        self.assertEqual([result['name'] for result in results], ['Lucerne', 'Milan'])
+    
+    def test_nearby_endpoint_rejects_bad_parameters(self):
+        url = reverse('nearby_destinations')
+        for params in (
+            {}, {'lat': 47.37}, {'lat': 'north', 'lng': 8.54}, {'lat': 91, 'lng': 8.54}, {'lat': 47.37, 'lng': 180.5},
+            {'lat': 'nan', 'lng': 8.54}, {'lat': 47.37, 'lng': 8.54, 'limit': 0},
+            {'lat': 47.37, 'lng': 8.54, 'limit': geo.MAX_LIMIT + 1}, {'lat': 47.37, 'lng': 8.54, 'limit': 'ten'},
+            {'lat': 47.37, 'lng': 8.54, 'radius': -1}, {'destination': 'zurich'},
+            {'destination': Destination.objects.get(name='Nowhere').pk},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+        self.assertEqual(self.client.get(url, {'destination': 0}).status_code, 404)
+    
+    def test_detail_page_follows_place_changes_only(self):
+        url = reverse('destination_detail', args=[self.zurich.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'Lucerne')
+        self.assertContains(response, 'Milan')
+        # A price change elsewhere leaves the page cached
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milan.price = 120
+            self.milan.save()
+        self.assertEqual(self.client.get(url)['X-View-Cache'], 'hit')
+        # Moving a neighbour away refreshes its nearby block
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milan.latitude, self.milan.longitude = -33.87, 151.21
+            self.milan.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-View-Cache'], 'miss')
+        self.assertContains(response, 'Lucerne')
+        self.assertNotContains(response, 'Milan')
+    
+    def test_nearby_block_reused_when_page_rerenders(self):
+        url = reverse('destination_detail', args=[self.zurich.pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.zurich.desc = 'The city on the lake'
+            self.zurich.save()
+        # Destination, reviews and similar destinations; the nearby block comes from the cache
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, 'The city on the lake')
+        self.assertContains(response, 'Lucerne')
+
+
+class AssetTests(SimpleTestCase):
+    
+    def test_minify_js_tells_regex_literals_from_division(self):
+        self.assertEqual(minify_js('return /ab+c\\/[/]/.test(x)'), 'return/ab+c\\/[/]/.test(x)')
+        self.assertEqual(minify_js('s.match( /a b/g )'), 's.match(/a b/g)')
+        self.assertEqual(minify_js('r = (a) / 2 / c'), 'r=(a)/2/c')
+    
+    def test_minify_js_leaves_strings_and_templates_alone(self):
+        source = 'var u = "http://x/*y*/", v = \'a // b\', t = `a // b /* c */`; // note'
+        self.assertEqual(minify_js(source), 'var u="http://x/*y*/",v=\'a // b\',t=`a // b /* c */`;')
+    
+    def test_minify_js_comments_and_operators(self):
+        source = 'var n = a + +b - -c; /*! License: MIT */\n/* gone\n */\nf()\n\n    g()'
+        self.assertEqual(minify_js(source), 'var n=a+ +b- -c;/*! License: MIT */\nf()\ng()')
+    
+    def test_minify_css(self):
+        source = '/*! keep */\na > b { content: "/* not a comment */" ; color: red ; }\n/* gone */'
+        self.assertEqual(minify_css(source), '/*! keep */ a>b{content:"/* not a comment */";color:red}')
+    
+    def test_css_bundle_rebases_urls_and_hoists_imports(self):
+        bundle = build_bundle('site.css', [
+            ('styles/main.css', (
+                '@charset "utf-8";\n.x { background: url(../images/bg.png?v=1#a) }\n'
+                '@import url("fonts.css");\n.y { background: url(data:image/png;base64,AA==) }'
+            )),
+            ('plugins/p/p.min.css', '@import "other.css";.z{background:url(\'img/z.png\')}'),
+        ])
+        self.assertEqual(bundle, (
+            '@import url("../styles/fonts.css");\n'
+            '@import "../plugins/p/other.css";\n'
+            '.x{background:url(../images/bg.png?v=1#a)}.y{background:url(data:image/png;base64,AA==)}\n'
+            '.z{background:url(\'../plugins/p/img/z.png\')}\n'
+        ))
+    
+    def test_js_bundle_separates_members(self):
+        bundle = build_bundle('site.js', [('js/a.js', 'a()  // no semicolon'), ('js/b.min.js', 'b()')])
+        self.assertEqual(bundle, 'a()\n;b()\n')
+    
+    def test_collectstatic_writes_hashed_bundles_and_compressed_siblings(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        source, static_root = os.path.join(root, 'static'), os.path.join(root, 'collected')
+        os.makedirs(os.path.join(source, 'css'))
+        with open(os.path.join(source, 'css', 'a.css'), 'w') as file:
+            file.write(''.join(f'.rule-{i} {{ color: red; }}\n' for i in range(100)))
+        with open(os.path.join(source, 'css', 'b.css'), 'w') as file:
+            file.write('.b { background: url(dot.png) }\n')
+        Image.new('RGB', (1, 1)).save(os.path.join(source, 'css', 'dot.png'))
+        with self.settings(
+            STATICFILES_DIRS=[source], STATIC_ROOT=static_root, DEBUG=False,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            ASSET_BUNDLES={'site.css': ['css/a.css', 'css/b.css']},
+        ):
+            # Before collectstatic has written a manifest, the members are linked
+            html = Template("{% load asset_tags %}{% bundle 'site.css' %}").render(Context())
+            self.assertEqual(html, (
+                '<link rel="stylesheet" href="/static/css/a.css">\n<link rel="stylesheet" href="/static/css/b.css">'
+            ))
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(static_root, 'staticfiles.json')) as file:
+                hashed = json.load(file)['paths']
+            bundle = os.path.join(static_root, hashed['bundles/site.css'])
+            self.assertRegex(hashed['bundles/site.css'], r'^bundles/site\.[0-9a-f]{12}\.css$')
+            with open(bundle) as file:
+                content = file.read()
+            self.assertIn('.rule-99{color:red}', content)
+            # The rebased url() points at the hashed image
+            self.assertIn(f'url("../{hashed["css/dot.png"]}")', content)
+            with gzip.open(bundle + '.gz', 'rt') as file:
+                self.assertEqual(file.read(), content)
+            # Too small to be worth compressing
+            self.assertFalse(os.path.exists(os.path.join(static_root, hashed['css/b.css']) + '.gz'))
+            # A new process reads the manifest and links the bundle
+            with self.settings(STATIC_ROOT=static_root):
+                html = Template("{% load asset_tags %}{% bundle 'site.css' %}").render(Context())
+            self.assertEqual(html, f'<link rel="stylesheet" href="/static/{hashed["bundles/site.css"]}">')
+
+
+class FileServingTests(TestCase):
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.media_root = os.path.join(self.root, 'media')
+        os.makedirs(os.path.join(self.media_root, 'docs'))
+        self.body = bytes(range(256)) * 4
+        with open(os.path.join(self.media_root, 'docs', 'guide.txt'), 'wb') as file:
+            file.write(self.body)
+        with open(os.path.join(self.root, 'secret.txt'), 'wb') as file:
+            file.write(b'secret')
+        settings = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/media/')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        file_serving.stat_cache.clear()
+        self.addCleanup(file_serving.stat_cache.clear)
+    
+    def write_sibling(self, suffix, content):
+        with open(os.path.join(self.media_root, 'docs', 'guide.txt' + suffix), 'wb') as file:
+            file.write(content)
+        file_serving.stat_cache.clear()
+    
+    def test_full_response_and_conditional_get(self):
+        response = self.client.get('/media/docs/guide.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.body)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+        self.assertIn('Last-Modified', response)
+        self.assertNotIn('Vary', response)
+        response = self.client.get('/media/docs/guide.txt', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+    
+    def test_head_has_no_body(self):
+        response = self.client.head('/media/docs/guide.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+        self.assertEqual(response.content, b'')
+    
+    def test_byte_ranges(self):
+        response = self.client.get('/media/docs/guide.txt', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.body)}')
+        self.assertEqual(response.getvalue(), self.body[10:20])
+        # The last N bytes
+        response = self.client.get('/media/docs/guide.txt', HTTP_RANGE='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 924-1023/1024')
+        self.assertEqual(response.getvalue(), self.body[-100:])
+        response = self.client.get('/media/docs/guide.txt', HTTP_RANGE=f'bytes={len(self.body)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.body)}')
+    
+    def test_if_range_with_stale_etag_gets_whole_file(self):
+        etag = self.client.get('/media/docs/guide.txt')['ETag']
+        response = self.client.get('/media/docs/guide.txt', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get('/media/docs/guide.txt', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.body)
+    
+    def test_precompressed_siblings(self):
+        self.write_sibling('.gz', b'gzipped')
+        self.write_sibling('.br', b'brotli')
+        response = self.client.get('/media/docs/guide.txt', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual((response['Content-Encoding'], response.getvalue()), ('br', b'brotli'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        response = self.client.get('/media/docs/guide.txt', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual((response['Content-Encoding'], response.getvalue()), ('gzip', b'gzipped'))
+        response = self.client.get('/media/docs/guide.txt')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        # Ranges refer to the identity encoding
+        response = self.client.get('/media/docs/guide.txt', HTTP_ACCEPT_ENCODING='gzip, br', HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response.getvalue(), self.body[:4])
+    
+    def test_traversal_and_directories_fall_through(self):
+        paths = ['/media/../secret.txt', '/media/docs/../../secret.txt', '/media/docs', '/media/docs/', '/media/missing.txt']
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class ImageRegenerationTests(TransactionTestCase):
+    """Runs the real process pool, which closes the database connections before forking"""
+    
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = self.settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        images.manifest_holder.invalidate()
+        self.addCleanup(images.manifest_holder.invalidate)
+        for name, colour in (('lake', 'teal'), ('peak', 'white')):
+            self.save_image(f'pics/{name}.jpg', colour)
+        default_storage.save('pics/broken.jpg', ContentFile(b'not an image'))
+    
+    def save_image(self, name, colour):
+        data = io.BytesIO()
+        Image.new('RGB', (64, 48), colour).save(data, 'JPEG')
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        return default_storage.save(name, ContentFile(data.getvalue()))
+    
+    def test_reruns_only_do_missing_work(self):
+        result = image_batch.regenerate(workers=1, chunk_size=2)
+        self.assertEqual((result.scanned, result.generated, result.current), (3, 2, 0))
+        # An undecodable file is reported without stopping the others
+        self.assertEqual([source for source, _ in result.failed], ['pics/broken.jpg'])
+        self.assertCountEqual(
+            ImageRenditionSet.objects.values_list('source', flat=True), ['pics/lake.jpg', 'pics/peak.jpg'],
+        )
+        
+        result = image_batch.regenerate(workers=1)
+        self.assertEqual((result.generated, result.current, len(result.failed)), (0, 2, 1))
+        self.assertEqual(result.files_written, 0)
+        
+        # Replaced in place under the same name
+        self.save_image('pics/lake.jpg', 'navy')
+        before = ImageRenditionSet.objects.get(source='pics/lake.jpg').content_hash
+        result = image_batch.regenerate(workers=1)
+        self.assertEqual((result.generated, result.current), (1, 1))
+        self.assertNotEqual(ImageRenditionSet.objects.get(source='pics/lake.jpg').content_hash, before)
+
+
+class TemplateProfilingTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.dump = os.path.join(directory, 'profile.jsonl')
+    
+    def test_profiles_includes_blocks_and_variables(self):
+        alps = make_destination('Alps')
+        with self.settings(TEMPLATE_PROFILING=True, TEMPLATE_PROFILE_DUMP=self.dump):
+            # A new client loads the middleware with profiling on
+            response = self.client_class().get(reverse('destination_detail', args=[alps.pk]))
+        self.assertRegex(response['Server-Timing'], r'^tpl;desc="templates";dur=[0-9.]+, tpl0;desc=".+ x[0-9]+";dur=')
+        with open(self.dump) as file:
+            profile, = map(json.loads, file)
+        self.assertEqual((profile['path'], profile['status']), (f'/destination/{alps.pk}/', 200))
+        entries = {(row['kind'], row['name'], row['template']): row for row in profile['entries']}
+        for key in (
+            ('template', 'destination_detail.html', None),
+            ('template', 'base.html', None),
+            ('template', 'includes/header.html', None),
+            ('include', 'includes/header.html', 'destination_detail.html'),
+            ('block', 'content', 'destination_detail.html'),
+            # Resolved in {% with %}, and in a block base.html renders but destination_detail.html fills
+            ('variable', 'destination.average_rating', 'destination_detail.html'),
+            ('variable', 'destination.name', 'destination_detail.html'),
+            ('variable', 'messages', 'base.html'),
+        ):
+            self.assertIn(key, entries)
+        self.assertEqual(entries['include', 'includes/header.html', 'destination_detail.html']['calls'], 1)
+        # The page's self time includes the blocks it fills in base.html
+        page = entries['template', 'destination_detail.html', None]
+        self.assertLessEqual(page['self_ms'], page['ms'])
+        self.assertGreaterEqual(page['ms'], entries['block', 'content', 'destination_detail.html']['ms'])
+    
+    def test_summarize_and_report(self):
+        def line(ms, *entries):
+            rows = [
+                {'kind': kind, 'name': name, 'template': template, 'calls': calls, 'ms': total, 'self_ms': own}
+                for kind, name, template, calls, total, own in entries
+            ]
+            return json.dumps({'ms': ms, 'entries': rows}) + '\n'
+        
+        with open(self.dump, 'w') as file:
+            file.write(line(
+                10.0, ('template', 'page.html', None, 1, 10.0, 4.0), ('variable', 'a.b', 'page.html', 3, 2.0, 2.0),
+            ))
+            file.write('\n')
+            file.write(line(
+                6.0, ('template', 'page.html', None, 1, 6.0, 2.0), ('block', 'content', 'page.html', 1, 5.0, 5.0),
+            ))
+        with open(self.dump) as file:
+            requests, total, rows = template_profiling.summarize(file)
+        self.assertEqual((requests, total), (2, 16.0))
+        self.assertEqual(
+            [(row['kind'], row['name'], row['calls'], row['ms'], row['self_ms'], row['per_request_ms'])
+             for row in rows],
+            [
+                ('template', 'page.html', 2, 16.0, 6.0, 3.0),
+                ('block', 'content', 1, 5.0, 5.0, 2.5),
+                ('variable', 'a.b', 3, 2.0, 2.0, 1.0),
+            ],
+        )
+        out = io.StringIO()
+        call_command('template_profile_report', self.dump, kind=['variable'], stdout=out)
+        self.assertIn('2 requests, 8.00 ms rendering per request', out.getvalue())
+        self.assertRegex(out.getvalue(), r'1\.000 +12\.5% +1\.5  a\.b  \(page\.html\)')
+
+
+class SimilarityArraysTests(TestCase):
+    
+    def setUp(self):
+        self.holder = similarity._Holder()
+        patcher = mock.patch.object(similarity, 'destination_arrays', self.holder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='reviewer')
+    
+    def test_processes_without_arrays_track_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            destination = make_destination('Alps')
+            Review.objects.create(user=self.user, destination=destination, rating=4, comment='Lovely')
+        self.assertEqual(self.holder.changed_ids, set())
+    
+    def test_web_processes_run_without_numpy(self):
+        with mock.patch.dict(sys.modules, {'numpy': None}):
+            with self.captureOnCommitCallbacks(execute=True):
+                destination = make_destination('Alps')
+                Review.objects.create(user=self.user, destination=destination, rating=4, comment='Lovely')
+            with self.assertRaises(ImportError):
+                self.holder.get()
+    
+    def test_rating_changes_reach_loaded_arrays(self):
+        destination = make_destination('Alps')
+        self.holder.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=self.user, destination=destination, rating=4, comment='Lovely')
+        self.assertEqual(self.holder.changed_ids, {destination.pk})
+        arrays = self.holder.get()
+        position = arrays.positions([destination.pk])
+        self.assertEqual((arrays.rating_count[position][0], arrays.rating_avg[position][0]), (1, 4.0))
+        self.assertEqual(self.holder.changed_ids, set())
+    
+    def test_rebuilding_ratings_reloads_the_arrays(self):
+        self.holder.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_rating_aggregates()
+        self.assertIsNone(self.holder.arrays)
+
+
+@skipUnless(apps.is_installed('travello'), 'needs the travello app: run with --settings=firstprogram.test_settings')
+class ShardedDataMigrationTests(MultipleConnectionsMixin, TransactionTestCase):
+    
+    SHARD_SIZE = 10
+    
+    def setUp(self):
+        OldDestination, OldBooking = data_migration.source_models()
+        user = User.objects.create_user(username='traveller')
+        # Destinations in shards 1-10, 11-20 and 21-30, bookings in 1-10 and 11-20
+        OldDestination.objects.bulk_create([
+            OldDestination(
+                pk=pk, name=f'Place {pk}', img='pics/destination_1.jpg', desc=f'About place {pk}',
+                price=pk * 10, offer=pk % 2 == 0,
+            )
+            for pk in (1, 2, 3, 11, 12, 25)
+        ])
+        OldBooking.objects.bulk_create([
+            OldBooking(
+                pk=pk, user=user, destination_id=destination_id, travel_date=datetime.date(2030, 1, pk),
+                number_of_travelers=pk % 4 + 1, status='confirmed',
+            )
+            for pk, destination_id in ((1, 1), (2, 11), (3, 25), (14, 2), (15, 12))
+        ])
+    
+    def migrate(self, shard_size=SHARD_SIZE, workers=2):
+        out = io.StringIO()
+        call_command('migrate_data', workers=workers, shard_size=shard_size, batch_size=2, stdout=out)
+        return out.getvalue()
+    
+    def interrupt_first_shard(self):
+        """Stop copying destinations 1-10 after its first batch of two commits"""
+        def interrupt(result, last_source_id):
+            raise KeyboardInterrupt
+        
+        with self.assertRaises(KeyboardInterrupt):
+            data_migration.copy_destinations(Shard(DESTINATIONS, 1, self.SHARD_SIZE), batch_size=2, progress=interrupt)
+    
+    def assertShardsCopied(self):
+        copied = dict(DataMigrationCheckpoint.objects.values_list('key', 'rows_copied'))
+        self.assertEqual(copied, {
+            'travello.destination:1-10': 3, 'travello.destination:11-20': 2, 'travello.destination:21-30': 1,
+            'travello.booking:1-10': 3, 'travello.booking:11-20': 2,
+        })
+        for table in (DESTINATIONS, BOOKINGS):
+            for shard in data_migration.plan_shards(table, self.SHARD_SIZE):
+                check = data_migration.verify(shard)
+                self.assertTrue(check.ok, shard)
+                self.assertEqual(check.target_count, copied[shard.key])
+        self.assertEqual(sorted(LegacyDestination.objects.values_list('source_id', flat=True)), [1, 2, 3, 11, 12, 25])
+        self.assertEqual(Destination.objects.count(), 6)
+        self.assertEqual(
+            dict(LegacyBooking.objects.values_list('source_id', 'booking__destination__name')),
+            {1: 'Place 1', 2: 'Place 11', 3: 'Place 25', 14: 'Place 2', 15: 'Place 12'},
+        )
+    
+    def test_copies_and_verifies_every_shard(self):
+        output = self.migrate()
+        self.assertIn('Verified 5 shards: counts and checksums match', output)
+        self.assertShardsCopied()
+        # A second run finds every checkpoint at its end
+        self.assertIn('travello.destination: copied 0 rows', self.migrate())
+        self.assertShardsCopied()
+    
+    def test_resumes_an_interrupted_run(self):
+        self.interrupt_first_shard()
+        self.assertEqual(DataMigrationCheckpoint.objects.get(key='travello.destination:1-10').last_source_id, 2)
+        output = self.migrate()
+        self.assertIn('travello.destination: copied 4 rows', output)
+        self.assertShardsCopied()
+    
+    def test_refuses_a_changed_shard_layout(self):
+        self.interrupt_first_shard()
+        for shard_size, workers in ((20, 2), (None, 1)):
+            with self.assertRaisesMessage(CommandError, 'resume it with the same sharding options'):
+                self.migrate(shard_size, workers)
+        self.assertEqual(Destination.objects.count(), 2)
+        self.assertEqual(Booking.objects.count(), 0)
+
+
+@skipUnless(apps.is_installed('travello'), 'needs the travello app: run with --settings=firstprogram.test_settings')
+class SerialDataMigrationTests(TestCase):
+    
+    def setUp(self):
+        images.manifest_holder.invalidate()
+        self.addCleanup(images.manifest_holder.invalidate)
+        OldDestination, OldBooking = data_migration.source_models()
+        self.user = User.objects.create_user(username='traveller')
+        OldDestination.objects.bulk_create([
+            OldDestination(pk=1, name='Lake', img='pics/lake.jpg', desc='A lake', price=100),
+            OldDestination(pk=2, name='Coast', img='pics/coast.jpg', desc='A coast', price=200, offer=True),
+        ])
+        OldBooking.objects.bulk_create([
+            OldBooking(
+                pk=pk, user=self.user, destination_id=destination_id, travel_date=datetime.date(2030, 1, pk),
+                number_of_travelers=1, status=status,
+            )
+            for pk, destination_id, status in ((1, 1, 'pending'), (2, 2, 'confirmed'), (3, 2, 'pending'))
+        ])
+    
+    def migrate(self):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('migrate_data', batch_size=2, verify=True, stdout=out)
+        return out.getvalue()
+    
+    def queued_bookings(self):
+        queued = BookingConfirmationJob.objects.values('booking_id')
+        return set(LegacyBooking.objects.filter(booking__in=queued).values_list('source_id', flat=True))
+    
+    def queued_images(self):
+        return set(ImageRenditionJob.objects.values_list('source', flat=True))
+    
+    def test_copies_and_verifies_both_tables(self):
+        output = self.migrate()
+        self.assertIn('travello.destination: copied 2 rows', output)
+        self.assertIn('travello.booking: copied 3 rows', output)
+        self.assertIn('Verified 2 shards: counts and checksums match', output)
+        self.assertEqual(
+            dict(LegacyBooking.objects.values_list('source_id', 'booking__destination__name')),
+            {1: 'Lake', 2: 'Coast', 3: 'Coast'},
+        )
+    
+    def test_queues_what_the_skipped_signals_would_have(self):
+        versions = namespace_versions([f'user:{self.user.pk}'])
+        self.migrate()
+        self.assertEqual(self.queued_bookings(), {1, 3})
+        self.assertEqual(self.queued_images(), {'pics/lake.jpg', 'pics/coast.jpg'})
+        self.assertNotEqual(namespace_versions([f'user:{self.user.pk}']), versions)
+    
+    def test_rerun_queues_rows_an_earlier_run_left_out(self):
+        self.migrate()
+        BookingConfirmationJob.objects.all().delete()
+        ImageRenditionJob.objects.all().delete()
+        self.assertIn('travello.destination: copied 0 rows', self.migrate())
+        self.assertEqual(self.queued_bookings(), {1, 3})
+        self.assertEqual(self.queued_images(), {'pics/lake.jpg', 'pics/coast.jpg'})
@@ -9,6 +9,9 @@ urlpatterns = [
     path('booking-success/<int:booking_id>/', views.booking_success, name='booking_success'),
     path('my-trips/', views.MyTripsView.as_view(), name='my_trips'),
     path('search/', views.search_destinations, name='search_destinations'),
+    path('search/suggest/', views.search_suggestions, name='search_suggestions'),
+    path('destinations/nearby/', views.nearby_destinations, name='nearby_destinations'),
+    path('currency/', views.set_currency, name='set_currency'),
     
     # Phase 2 URLs
     path('review/<int:destination_id>/', views.add_review, name='add_review'),
@@ -0,0 +1,74 @@
+"""
+Per-request state of the current user: wishlist, reviews and upcoming bookings.
+
+Pages overlay this state on destinations they render (wishlist hearts,
+"your review", upcoming trips). Instead of one query per destination, each
+kind of state is loaded for the whole user at most once per request, on
+first use, and memoized on the request, so an authenticated page costs a
+constant number of extra queries however many destinations it shows.
+Anonymous users get empty state without touching the database.
+"""
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Booking, Review, Wishlist
+
+
+class UserState:
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def wishlist_ids(self):
+        """IDs of the destinations in the user's wishlist"""
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(
+            Wishlist.objects.filter(user=self.user).values_list('destination_id', flat=True)
+        )
+
+    @cached_property
+    def reviews(self):
+        """The user's reviews, keyed by destination ID"""
+        if not self.user.is_authenticated:
+            return {}
+        reviews = Review.objects.filter(user=self.user).only(
+            'id', 'destination_id', 'rating', 'comment', 'created_at'
+        )
+        return {review.destination_id: review for review in reviews}
+
+    @property
+    def reviewed_ids(self):
+        return frozenset(self.reviews)
+
+    def review_for(self, destination_id):
+        return self.reviews.get(destination_id)
+
+    @cached_property
+    def upcoming_bookings(self):
+        """IDs of the user's upcoming, not cancelled bookings, keyed by destination ID"""
+        if not self.user.is_authenticated:
+            return {}
+        rows = Booking.objects.filter(
+            user=self.user, travel_date__gte=timezone.localdate()
+        ).exclude(status='cancelled').order_by('travel_date', 'id').values_list('destination_id', 'id')
+        bookings = {}
+        for destination_id, booking_id in rows:
+            bookings.setdefault(destination_id, []).append(booking_id)
+        return bookings
+
+    @property
+    def upcoming_booking_ids(self):
+        return frozenset(booking_id for ids in self.upcoming_bookings.values() for booking_id in ids)
+
+    @property
+    def upcoming_destination_ids(self):
+        return frozenset(self.upcoming_bookings)
+
+
+def get_user_state(request):
+    """Return the request's UserState, creating it on first use"""
+    state = getattr(request, '_user_state', None)
+    if state is None or state.user is not request.user:
+        state = request._user_state = UserState(request.user)
+    return state
@@ -1,101 +1,151 @@
+import math
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.generic import ListView, DetailView
 from django.utils.decorators import method_decorator
-from django.db.models import Q, Avg
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
+from django.middleware.csrf import get_token
 from django.urls import reverse
-from .models import Destination, Booking, Review, Wishlist, BlogPost
+from django.utils.functional import cached_property
+from django.utils.http import url_has_allowed_host_and_scheme
+from .models import Destination, Booking, Review, Wishlist, BlogPost, SimilarDestination, DESTINATION_CARD_FIELDS
 from .forms import BookingForm, ReviewForm, DestinationSearchForm
+from .query_budget import QueryBudgetMixin
+from .pagination import KeysetPaginationMixin
+from .cache import CachedViewMixin, cache_view
+from .currency import COOKIE_NAME, annotate_local_price, get_currency, get_rates, money_affixes, price_range_q
+from .fragments import attach_card_html, nearby_html
+from .user_state import get_user_state
+from . import facets, geo, idempotency, inventory, search, suggest
 
 # Create your views here.
 
+@cache_view(['destinations'])
 def index(request):
     # Filter only destinations with special offers (offer=True)
     # Order by offer status (True first) then alphabetically by name
-    dests = Destination.objects.filter(offer=True).order_by('name')
+    dests = Destination.objects.filter(offer=True).only(
+        'id', 'name', 'img', 'desc', 'price', 'offer', 'currency'
+    ).order_by('name')
     return render(request, 'index.html', {'dests': dests})
 
-class DestinationListView(ListView):
+class DestinationListView(QueryBudgetMixin, CachedViewMixin, KeysetPaginationMixin, ListView):
     model = Destination
     template_name = 'destinations.html'
     context_object_name = 'destinations'
     paginate_by = 12
+    query_budget = 8
+    keyset_ordering = ('-offer', 'name', 'id')
+    cache_namespaces = ['destinations']
+    
+    @cached_property
+    def search_form(self):
+        return DestinationSearchForm(self.request.GET, currency=get_currency(self.request))
+    
+    def get_sort(self):
+        """'price' or '-price' to sort by price in the visitor's currency, else ''"""
+        return self.search_form.cleaned_data.get('sort', '') if self.search_form.is_valid() else ''
+    
+    def get_keyset_ordering(self):
+        sort = self.get_sort()
+        if sort:
+            return ('rate_unknown', f'{sort}_local', 'id')
+        if self.request.GET.get('query'):
+            return ('-search_rank',) + self.keyset_ordering
+        return self.keyset_ordering
     
     def get_queryset(self):
-        queryset = Destination.objects.all()
-        form = DestinationSearchForm(self.request.GET)
+        queryset = Destination.objects.only(*DESTINATION_CARD_FIELDS)
+        form = self.search_form
+        currency = get_currency(self.request)
         
         if form.is_valid():
             query = form.cleaned_data.get('query')
-            location = form.cleaned_data.get('location')
-            min_price = form.cleaned_data.get('min_price')
-            max_price = form.cleaned_data.get('max_price')
-            min_rating = form.cleaned_data.get('min_rating')
-            offer_only = form.cleaned_data.get('offer_only')
             
             if query:
-                queryset = queryset.filter(
-                    Q(name__icontains=query) | Q(desc__icontains=query)
-                )
-            
-            if location:
-                queryset = queryset.filter(location__icontains=location)
-            
-            if min_price:
-                queryset = queryset.filter(price__gte=min_price)
+                queryset = search.search(queryset, query)
+            # Facet counts start from the text matches, before the other filters
+            self.facet_base = queryset
             
-            if max_price:
-                queryset = queryset.filter(price__lte=max_price)
+            for condition in facets.filter_conditions(form.cleaned_data, currency).values():
+                queryset = queryset.filter(condition)
             
-            if min_rating:
-                # Filter destinations with average rating >= min_rating
-                queryset = queryset.annotate(
-                    avg_rating=Avg('reviews__rating')
-                ).filter(avg_rating__gte=int(min_rating))
+            sort = form.cleaned_data.get('sort')
+            if sort:
+                # Prices without a known rate can't be placed among the others, so they come last
+                return annotate_local_price(queryset, currency).order_by('rate_unknown', f'{sort}_local', 'id')
             
-            if offer_only:
-                queryset = queryset.filter(offer=True)
+            if query:
+                # Most relevant first, then the usual offer/name order
+                return queryset.order_by('-search_rank', '-offer', 'name')
         
         # Order by offer status (True first) then alphabetically by name
         return queryset.order_by('-offer', 'name')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['search_form'] = DestinationSearchForm(self.request.GET)
+        context['search_form'] = self.search_form
+        if self.search_form.is_valid():
+            context['facets'] = facets.count_facets(
+                self.facet_base, self.search_form.cleaned_data, get_currency(self.request)
+            )
+        destinations = attach_card_html(
+            context['destinations'], 'includes/destination_card.html', self.request.user.is_authenticated,
+            get_currency(self.request),
+        )
+        context['object_list'] = context['destinations'] = destinations
+        context['wishlist_destinations'] = get_user_state(self.request).wishlist_ids
         return context
 
-class DestinationDetailView(DetailView):
+class DestinationDetailView(CachedViewMixin, DetailView):
     model = Destination
     template_name = 'destination_detail.html'
     context_object_name = 'destination'
+    nearby_limit = 4
+    nearby_radius_km = 500
+    similar_limit = 8
+    
+    def dispatch(self, request, *args, **kwargs):
+        # The review form takes its token from the CSRF cookie, so the page can be cached once
+        # the visitor has one; get_token() sets it, and keeps this response out of the cache
+        if request.user.is_authenticated and 'CSRF_COOKIE' not in request.META:
+            get_token(request)
+        return super().dispatch(request, *args, **kwargs)
+    
+    def get_cache_namespaces(self):
+        # Other destinations show in the nearby block, which only changes when one is placed, moved,
+        # renamed or removed, and in the similar list, which rebuild_similar_destinations refreshes
+        return [f"destination:{self.kwargs['pk']}", geo.NAMESPACE]
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        destination = self.get_object()
+        destination = self.object
+        user_state = get_user_state(self.request)
         
         # Get reviews for this destination
-        context['reviews'] = destination.reviews.all()[:10]  # Latest 10 reviews
-        context['user_review'] = None
+        context['reviews'] = destination.reviews.select_related('user')[:10]  # Latest 10 reviews
         context['review_form'] = ReviewForm()
-        context['is_in_wishlist'] = False
+        # The user's own review, wishlist and booking state
+        context['user_review'] = user_state.review_for(destination.pk)
+        context['is_in_wishlist'] = destination.pk in user_state.wishlist_ids
+        context['upcoming_bookings'] = user_state.upcoming_bookings.get(destination.pk, [])
         
-        if self.request.user.is_authenticated:
-            # Check if user already reviewed this destination
-            try:
-                context['user_review'] = Review.objects.get(
-                    user=self.request.user, 
-                    destination=destination
-                )
-            except Review.DoesNotExist:
-                pass
-            
-            # Check if destination is in user's wishlist
-            context['is_in_wishlist'] = Wishlist.objects.filter(
-                user=self.request.user, 
-                destination=destination
-            ).exists()
+        # Closest other destinations, when this one is on the map
+        context['nearby_html'] = ''
+        if destination.latitude is not None and destination.longitude is not None:
+            context['nearby_html'] = nearby_html(destination, self.nearby_limit, self.nearby_radius_km)
+        
+        # "You may also like": precomputed by the rebuild_similar_destinations command
+        similar = SimilarDestination.objects.filter(destination=destination).select_related('similar').only(
+            'rank', 'similar__id', 'similar__name', 'similar__img', 'similar__price',
+            'similar__currency', 'similar__offer', 'similar__location', 'similar__rating_avg',
+        ).order_by('rank')[:self.similar_limit]
+        context['similar_destinations'] = [entry.similar for entry in similar]
         
         return context
 
@@ -117,7 +167,9 @@ def add_review(request, destination_id):
         review = form.save(commit=False)
         review.user = request.user
         review.destination = destination
-        review.save()
+        # Saving the review and adjusting the rating aggregates commit together
+        with transaction.atomic():
+            review.save()
         
         messages.success(request, f'Your review has been {action} successfully!')
     else:
@@ -159,14 +211,30 @@ def toggle_wishlist(request, destination_id):
     return redirect('destination_detail', pk=destination_id)
 
 @method_decorator(login_required, name='dispatch')
-class WishlistView(ListView):
+class WishlistView(QueryBudgetMixin, KeysetPaginationMixin, ListView):
     model = Wishlist
     template_name = 'wishlist.html'
     context_object_name = 'wishlist_items'
     paginate_by = 12
+    query_budget = 6
+    keyset_ordering = ('-added_at', '-id')
     
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return Wishlist.objects.filter(user=self.request.user).select_related(
+            'destination'
+        ).only(
+            'id', 'added_at', 'destination',
+            *(f'destination__{field}' for field in DESTINATION_CARD_FIELDS)
+        )
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        items = list(context['wishlist_items'])
+        attach_card_html(
+            [item.destination for item in items], 'includes/wishlist_card.html', True, get_currency(self.request)
+        )
+        context['object_list'] = context['wishlist_items'] = items
+        return context
 
 @login_required
 def book_destination(request, destination_id):
@@ -175,34 +243,93 @@ def book_destination(request, destination_id):
     if request.method == 'POST':
         form = BookingForm(request.POST)
         if form.is_valid():
+            key = form.cleaned_data.get('idempotency_key')
+            submission = idempotency.fingerprint(
+                destination.pk, form.cleaned_data['travel_date'], form.cleaned_data['number_of_travelers'],
+            )
+            try:
+                booking_id = idempotency.find_booking_id(request.user, key, submission)
+            except idempotency.KeyReused:
+                return _resubmitted_with_changes(request, destination)
+            if booking_id is not None:
+                # Resubmitted form: the booking already exists
+                return redirect('booking_success', booking_id=booking_id)
             booking = form.save(commit=False)
             booking.user = request.user
             booking.destination = destination
-            booking.save()
-            messages.success(request, 'Your booking has been submitted successfully!')
-            return redirect('booking_success', booking_id=booking.id)
+            
+            def save_booking():
+                # A retried attempt starts again from an unsaved booking
+                booking.pk = None
+                booking.save(force_insert=True)
+                idempotency.remember(request.user, key, booking, submission)
+            
+            try:
+                # Saving takes the seats from the date's inventory (beyondborders.inventory)
+                inventory.atomic_with_retry(save_booking)
+            except inventory.SoldOut as exc:
+                if exc.available:
+                    form.add_error('number_of_travelers', f'Only {exc.available} seat{"s" if exc.available != 1 else ""} left on this date.')
+                else:
+                    form.add_error('travel_date', 'This date is sold out. Please choose another date.')
+            except inventory.InventoryBusy:
+                form.add_error('travel_date', 'Seats on this date are being booked right now. Please try again.')
+            except IntegrityError:
+                # A concurrent copy of this submission saved first; ours was rolled back
+                try:
+                    booking_id = idempotency.find_booking_id(request.user, key, submission)
+                except idempotency.KeyReused:
+                    return _resubmitted_with_changes(request, destination)
+                if booking_id is None:
+                    raise
+                return redirect('booking_success', booking_id=booking_id)
+            else:
+                messages.success(request, 'Your booking has been submitted and will be confirmed shortly!')
+                return redirect('booking_success', booking_id=booking.id)
     else:
         form = BookingForm()
     
+    # The total is estimated in the browser in the visitor's currency
+    currency = get_currency(request)
+    unit_price = get_rates().convert(destination.price, destination.currency, currency)
+    if unit_price is None:
+        currency, unit_price = destination.currency, destination.price
+    prefix, suffix = money_affixes(currency)
     return render(request, 'booking_form.html', {
         'form': form,
-        'destination': destination
+        'destination': destination,
+        'unit_price': round(unit_price, 2),
+        'money_prefix': prefix,
+        'money_suffix': suffix,
     })
 
+def _resubmitted_with_changes(request, destination):
+    # A fresh form comes with a new key for the changed details
+    messages.error(request, 'This booking form was already submitted with other details. Please fill it in again.')
+    return redirect('book_destination', destination_id=destination.pk)
+
 @login_required
 def booking_success(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id, user=request.user)
     return render(request, 'booking_success.html', {'booking': booking})
 
 @method_decorator(login_required, name='dispatch')
-class MyTripsView(ListView):
+class MyTripsView(QueryBudgetMixin, KeysetPaginationMixin, ListView):
     model = Booking
     template_name = 'my_trips.html'
     context_object_name = 'bookings'
     paginate_by = 10
+    query_budget = 6
+    keyset_ordering = ('-created_at', '-id')
     
     def get_queryset(self):
-        return Booking.objects.filter(user=self.request.user)
+        return Booking.objects.filter(user=self.request.user).select_related(
+            'destination'
+        ).only(
+            'id', 'travel_date', 'number_of_travelers', 'status', 'created_at', 'destination',
+            'destination__id', 'destination__name', 'destination__img',
+            'destination__desc', 'destination__price', 'destination__currency',
+        )
 
 def search_destinations(request):
     """
@@ -213,19 +340,17 @@ def search_destinations(request):
     offer_only = request.GET.get('offer_only', '')
     travel_date = request.GET.get('travel_date', '')
     
-    destinations = Destination.objects.all()
+    destinations = Destination.objects.only(*DESTINATION_CARD_FIELDS)
     
-    # Filter by destination name or description
+    # Full-text search on name, location and description
     if query:
-        destinations = destinations.filter(
-            Q(name__icontains=query) | Q(desc__icontains=query)
-        )
+        destinations = search.search(destinations, query)
     
-    # Filter by maximum price
+    # Filter by maximum price, given in the visitor's currency
     if max_price:
         try:
             max_price = int(max_price)
-            destinations = destinations.filter(price__lte=max_price)
+            destinations = destinations.filter(price_range_q(None, max_price, get_currency(request)))
         except ValueError:
             pass  # Invalid budget, ignore filter
     
@@ -233,34 +358,143 @@ def search_destinations(request):
     if offer_only == 'true':
         destinations = destinations.filter(offer=True)
     
-    # Order by offer status (True first) then alphabetically by name
-    destinations = destinations.order_by('-offer', 'name')
+    # Most relevant first when searching, then offer status (True first)
+    # and alphabetically by name
+    ordering = ('-search_rank', '-offer', 'name') if query else ('-offer', 'name')
+    # Evaluate once so the result count doesn't cost a separate COUNT query
+    destinations = attach_card_html(
+        destinations.order_by(*ordering), 'includes/search_result_card.html', True, get_currency(request)
+    )
     
+    user_state = get_user_state(request)
     return render(request, 'search_results.html', {
         'destinations': destinations,
+        'wishlist_destinations': user_state.wishlist_ids,
+        'upcoming_destinations': user_state.upcoming_destination_ids,
         'query': query,
         'budget': max_price,
         'offer_only': offer_only,
         'travel_date': travel_date,
-        'total_results': destinations.count()
+        'total_results': len(destinations)
     })
 
+@require_GET
+def set_currency(request):
+    """Remember the currency to show prices in and go back to ``next``"""
+    currency = request.GET.get('currency', '').upper()
+    next_url = request.GET.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+        next_url = reverse('index')
+    response = redirect(next_url)
+    if get_rates().supports(currency):
+        response.set_cookie(COOKIE_NAME, currency, max_age=365 * 24 * 60 * 60, samesite='Lax')
+    return response
+
+def _suggestion_params(request):
+    try:
+        limit = int(request.GET.get('limit', suggest.DEFAULT_LIMIT))
+    except ValueError:
+        limit = suggest.DEFAULT_LIMIT
+    return request.GET.get('q', ''), limit
+
+def _suggestion_etag(request):
+    query, limit = _suggestion_params(request)
+    fingerprint = suggest.suggestion_index.get().fingerprint
+    return f'{fingerprint}-{limit}-{suggest.normalize(query)}'
+
+@require_GET
+@cache_control(public=True, max_age=60)
+@condition(etag_func=_suggestion_etag)
+def search_suggestions(request):
+    """
+    Typeahead suggestions for the destination search form: destination names
+    and distinct locations starting with ``q``
+    """
+    query, limit = _suggestion_params(request)
+    payload, _ = suggest.suggest(query, limit)
+    return JsonResponse(payload)
+
+def _float_param(request, name, default=None, low=None, high=None):
+    value = request.GET.get(name, '')
+    if value == '':
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+    if not math.isfinite(value) or (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f'{name} must be between {low} and {high}')
+    return value
+
+@require_GET
+@cache_control(public=True, max_age=60)
+@cache_view(['destinations'])
+def nearby_destinations(request):
+    """
+    Destinations near ``lat``/``lng`` (or near destination ``destination``):
+    all within ``radius`` km when given, otherwise the ``limit`` nearest
+    """
+    queryset = Destination.objects.only('id', 'name', 'location', 'latitude', 'longitude', 'price', 'currency')
+    try:
+        if request.GET.get('destination'):
+            origin = get_object_or_404(Destination, pk=int(request.GET['destination']))
+            if origin.latitude is None or origin.longitude is None:
+                raise ValueError('destination has no coordinates')
+            lat, lng = origin.latitude, origin.longitude
+            queryset = queryset.exclude(pk=origin.pk)
+        else:
+            lat = _float_param(request, 'lat', low=-90, high=90)
+            lng = _float_param(request, 'lng', low=-180, high=180)
+        limit = int(_float_param(request, 'limit', geo.DEFAULT_LIMIT, 1, geo.MAX_LIMIT))
+        radius = _float_param(request, 'radius', 0, 0, geo.MAX_DISTANCE_KM)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    
+    if radius:
+        destinations = list(geo.within(queryset, lat, lng, radius)[:limit])
+    else:
+        destinations = geo.nearest(queryset, lat, lng, limit)
+    return JsonResponse({'results': [
+        {
+            'id': destination.pk,
+            'name': destination.name,
+            'location': destination.location,
+            'latitude': float(destination.latitude),
+            'longitude': float(destination.longitude),
+            'price': destination.price,
+            'currency': destination.currency,
+            'distance_km': round(destination.distance_km, 2),
+            'url': reverse('destination_detail', args=[destination.pk]),
+        }
+        for destination in destinations
+    ]})
+
 # Blog Views
-class BlogListView(ListView):
+class BlogListView(QueryBudgetMixin, CachedViewMixin, KeysetPaginationMixin, ListView):
     model = BlogPost
     template_name = 'blog.html'
     context_object_name = 'blog_posts'
     paginate_by = 6
+    query_budget = 6
+    keyset_ordering = ('-created_at', '-id')
+    cache_namespaces = ['blog']
     
     def get_queryset(self):
-        return BlogPost.objects.filter(is_published=True)
+        return BlogPost.objects.filter(is_published=True).select_related('author').only(
+            'id', 'title', 'slug', 'content', 'image', 'created_at', 'author',
+            'author__username', 'author__first_name', 'author__last_name',
+        )
 
-class BlogDetailView(DetailView):
+class BlogDetailView(CachedViewMixin, DetailView):
     model = BlogPost
     template_name = 'blog_detail.html'
     context_object_name = 'post'
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
+    # Slugs can change on edit, so posts share the blog namespace
+    cache_namespaces = ['blog']
     
     def get_queryset(self):
         return BlogPost.objects.filter(is_published=True)
@@ -44,10 +44,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'beyondborders.middleware.FileServingMiddleware',
+    'beyondborders.middleware.TemplateProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'beyondborders.middleware.CurrencyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,7 +67,11 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'beyondborders.context_processors.currency',
             ],
+            # No 'loaders': Django then wraps the DIRS/APP_DIRS loaders in the
+            # cached loader, so each process parses a template once (and
+            # reloads it on change when DEBUG is on)
         },
     },
 ]
@@ -87,6 +94,32 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Per-process memory by default; for a cache shared between workers without
+# Redis, use 'django.core.cache.backends.filebased.FileBasedCache' with a
+# LOCATION such as os.path.join(BASE_DIR, 'var', 'cache').
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'beyondborders',
+    }
+}
+
+# Response cache for read-mostly views (beyondborders.cache)
+VIEW_CACHE_ALIAS = 'default'
+VIEW_CACHE_TIMEOUT = 300
+
+# Rendered destination cards (beyondborders.fragments); keys are versioned,
+# so this only bounds how long unused fragments linger
+CARD_FRAGMENT_TIMEOUT = 3600
+
+# Facet counts on the destinations page (beyondborders.facets); keys are
+# versioned like the card fragments
+FACET_CACHE_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -127,6 +160,52 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = os.path.join(BASE_DIR, 'assets')
 
+# collectstatic gives files content-hashed names, builds ASSET_BUNDLES and
+# precompresses them (beyondborders.assets)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'beyondborders.assets.BundlingStaticFilesStorage'},
+}
+
+# Bundles linked with {% bundle %} (asset_tags): the member files in order.
+# With DEBUG on the members are linked one by one.
+ASSET_BUNDLES = {
+    'site.css': [
+        'styles/bootstrap4/bootstrap.min.css',
+        'plugins/font-awesome-4.7.0/css/font-awesome.min.css',
+        'plugins/OwlCarousel2-2.2.1/owl.carousel.css',
+        'plugins/OwlCarousel2-2.2.1/owl.theme.default.css',
+        'plugins/OwlCarousel2-2.2.1/animate.css',
+        'styles/main_styles.css',
+        'styles/responsive.css',
+    ],
+    'site.js': [
+        'js/jquery-3.2.1.min.js',
+        'styles/bootstrap4/popper.js',
+        'styles/bootstrap4/bootstrap.min.js',
+        'plugins/greensock/TweenMax.min.js',
+        'plugins/greensock/TimelineMax.min.js',
+        'plugins/scrollmagic/ScrollMagic.min.js',
+        'plugins/greensock/animation.gsap.min.js',
+        'plugins/greensock/ScrollToPlugin.min.js',
+        'plugins/OwlCarousel2-2.2.1/owl.carousel.js',
+        'plugins/easing/easing.js',
+        'plugins/parallax-js-master/parallax.min.js',
+        'js/custom.js',
+    ],
+    'home.js': [
+        'js/jquery-3.2.1.min.js',
+        'styles/bootstrap4/popper.js',
+        'styles/bootstrap4/bootstrap.min.js',
+        'plugins/OwlCarousel2-2.2.1/owl.carousel.js',
+        'plugins/Isotope/isotope.pkgd.min.js',
+        'plugins/scrollTo/jquery.scrollTo.min.js',
+        'plugins/easing/easing.js',
+        'plugins/parallax-js-master/parallax.min.js',
+        'js/custom.js',
+    ],
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -134,3 +213,55 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# FileServingMiddleware serves STATIC_ROOT and MEDIA_ROOT itself; a worker
+# notices a file changed in place at most this many seconds later
+# (content-hashed files never change and are never checked again)
+FILE_STAT_CACHE_TTL = 2.0
+
+# Query budgets declared by listing views (beyondborders.query_budget):
+# 'raise' fails over-budget requests, 'warn' logs them, None disables the check
+QUERY_BUDGET_ENFORCEMENT = 'warn' if DEBUG else None
+
+# Destination search: 'database' uses PostgreSQL full-text search (FTS5 on
+# SQLite); 'memory' uses the in-process index in beyondborders.search_index
+SEARCH_BACKEND = 'database'
+SEARCH_INDEX_SNAPSHOT = os.path.join(BASE_DIR, 'var', 'search_index.json.gz')
+SEARCH_INDEX_MAX_BYTES = 64 * 1024 * 1024
+
+# Seconds a worker may serve search suggestions built before another
+# worker's Destination change
+SUGGEST_INDEX_TTL = 60
+
+# Seconds a worker may score similar destinations from arrays loaded before
+# another worker's Destination change (beyondborders.similarity)
+SIMILARITY_ARRAYS_TTL = 300
+
+# Prices: exchange rates are units per one BASE_CURRENCY (beyondborders.currency);
+# visitors see DEFAULT_CURRENCY until they pick another. A worker reloads the
+# rates at most EXCHANGE_RATES_TTL seconds after a change made elsewhere.
+BASE_CURRENCY = 'USD'
+DEFAULT_CURRENCY = 'USD'
+EXCHANGE_RATES_TTL = 600
+
+# Responsive renditions of uploaded images (beyondborders.images): widths in
+# pixels and formats, the last being the <img> fallback. Changing any of
+# these makes generate_image_renditions redo every image.
+IMAGE_RENDITION_WIDTHS = (320, 640, 960, 1440)
+IMAGE_RENDITION_FORMATS = ('avif', 'webp', 'jpeg')
+IMAGE_RENDITION_QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80, 'png': None}
+
+# Seconds a booking form submission is remembered so a resubmission redirects
+# to the original booking; older keys are deleted by purge_idempotency_keys
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Serve listing pages by opaque cursor (no COUNT/OFFSET) instead of page number
+KEYSET_PAGINATION = False
+
+# Template render profiling (beyondborders.template_profiling): adds a
+# Server-Timing header with the slowest templates, includes, blocks and
+# variables of each response and, with TEMPLATE_PROFILE_DUMP set, appends a
+# JSON line per request for template_profile_report. Slows rendering down;
+# turn it on for staging and load tests only.
+TEMPLATE_PROFILING = False
+TEMPLATE_PROFILE_DUMP = None
@@ -0,0 +1,29 @@
+"""
+Settings for the test suite, which needs no PostgreSQL server:
+
+    python manage.py test --settings=firstprogram.test_settings
+
+The test database is an SQLite file rather than the in-memory default, so
+tests can open several connections to it (threads, and the worker processes
+of ``migrate_data --workers``), and the legacy travello app is installed so
+its data migration can be tested.
+"""
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, INSTALLED_APPS
+
+INSTALLED_APPS = INSTALLED_APPS + ['travello.apps.TravelloConfig']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {'timeout': 30},
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'firstprogram_test.sqlite3')},
+    }
+}
+
+# travello ships the same math_filters tag library as beyondborders
+SILENCED_SYSTEM_CHECKS = ['templates.W003']
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('travello', '0004_alter_booking_options_alter_destination_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='travello_bookings', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
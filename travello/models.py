@@ -20,7 +20,8 @@ class Booking(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Distinct from beyondborders.Booking so both apps can be installed for migrate_data
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='travello_bookings')
     destination = models.ForeignKey(Destination, on_delete=models.CASCADE)
     travel_date = models.DateField()
     number_of_travelers = models.PositiveIntegerField()